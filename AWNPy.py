@@ -23,58 +23,3300 @@
 # ==================================================================================================================== #
 
 try:
-    import pandas as pd
-except ImportWarning:
-    print('Pandas not installed -- unable to return API calls as dataframes')
-try:
-    import urllib.parse
-    import urllib.request
-    import urllib.error
+    import http.client as httplib
+    from urllib.parse import urlencode, urlsplit
 except ImportError:
-    import urllib2
-    import urllib
+    import httplib
+    from urllib import urlencode
+    from urlparse import urlsplit
+
+import codecs
+import collections
+import difflib
+import hashlib
+import io
+import json
+import logging
+import mmap
+import datetime
+import importlib
+import operator
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import os
+import random
+import re
+import socket
+import ssl
+import threading
+import time
+import zlib
+
+
+class _LazyModule(object):
+    r""" Stands in for a module that is only imported when one of its attributes is first used, so that importing
+    AWNPy does not pay for pandas, numpy or asyncio unless they are actually needed. """
+
+    def __init__(self, name, purpose=None):
+        self._name = name
+        self._purpose = purpose
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            try:
+                self._module = importlib.import_module(self._name)
+            except ImportError:
+                if self._purpose is None:
+                    raise
+                raise ImportError('%s is not installed -- unable to %s' % (self._name, self._purpose))
+        return getattr(self._module, attr)
+
+
+pd = _LazyModule('pandas', 'return API calls as dataframes')
+np = _LazyModule('numpy', 'return API calls as dataframes or arrays')
+asyncio = _LazyModule('asyncio')
+
+_logger = logging.getLogger('AWNPy')
+
+# all timestamps sent to and returned by the API are UTC-8, with no daylight savings
+_API_TIMEZONE = datetime.timezone(datetime.timedelta(hours=-8), 'PST')
+_TIME_FORMATS = {'TIMESTAMP_PST': '%Y-%m-%d %H:%M:%S', 'JULDATE_PST': '%Y-%m-%d'}
+
+
+# ==================================================================================================================== #
+# AWNPyError class                                                                                                    #
+# Type: Exception                                                                                                      #
+# Description: This class is simply the means for error handling when an exception is raised.                          #
+# ==================================================================================================================== #
+
+
+class AWNPyError(Exception):
+    def __init__(self, error_message):
+        self.error_message = error_message
+
+    def __str__(self):
+        r""" This just returns one of the error messages listed in the checkresponse() function"""
+        return repr(self.error_message)
+
+
+class AWNPyNoResultsError(AWNPyError):
+    r""" Raised when the API finds no results matching a query. """
+    pass
+
+
+class AWNPyBatchError(AWNPyError):
+    def __init__(self, error_message, results, errors):
+        r""" Raised when some requests of a batch failed. results holds what was fetched and errors maps each failed
+        item to the exception it raised. """
+        AWNPyError.__init__(self, error_message)
+        self.results = results
+        self.errors = errors
+
+
+# ==================================================================================================================== #
+# Helper functions                                                                                                     #
+# Type: Internal                                                                                                       #
+# Description: Small functions shared by the classes below.                                                            #
+# ==================================================================================================================== #
+
+
+def _default_ssl_context():
+    r""" Returns the SSL context transports use when none is given. Certificates are not verified unless the
+    PYTHONHTTPSVERIFY environment variable is set, as AWNPy has always done, but only for AWNPy's own connections. """
+    if not os.environ.get('PYTHONHTTPSVERIFY', '') and getattr(ssl, '_create_unverified_context', None):
+        return ssl._create_unverified_context()
+    return ssl.create_default_context()
+
+
+def _api_now():
+    r""" Returns the current time as a naive datetime in the API's fixed UTC-8 time zone. """
+    return datetime.datetime.now(_API_TIMEZONE).replace(tzinfo=None)
+
+
+def _map_concurrently(func, items, max_workers):
+    r""" Calls func on every item using a pool of at most max_workers threads.
+
+    Returns:
+    --------
+        (results, errors): dictionaries keyed by item, holding the return value or the exception raised.
+    """
+    results = {}
+    errors = {}
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(items) or 1))) as executor:
+        futures = dict((executor.submit(func, item), item) for item in items)
+        for future in as_completed(futures):
+            try:
+                results[futures[future]] = future.result()
+            except Exception as e:
+                errors[futures[future]] = e
+    return results, errors
+
+
+def _date_windows(start, end, window):
+    r""" Splits the range start to end into consecutive (start, end) windows no longer than window. Neighbouring
+    windows share their boundary, so records on it are returned twice and must be de-duplicated.
+    """
+    windows = []
+    while start + window < end:
+        windows.append((start, start + window))
+        start = start + window
+    windows.append((start, end))
+    return windows
+
+
+def _record_time(record):
+    r""" Returns the timestamp string of a stationdata DATA record (TIMESTAMP_PST, or JULDATE_PST for daily data). """
+    return record.get('TIMESTAMP_PST', record.get('JULDATE_PST'))
+
+
+def _records_to_arrays(records, dtype='float64'):
+    r""" Converts a non-empty list of stationdata DATA records to columns in one pass.
+
+    Returns:
+    --------
+        (time_field, times, columns, values): the name of the time field (TIMESTAMP_PST, or JULDATE_PST for daily
+        data), a list of its values, a list of the other field names and a 2D array of their values as dtype. Values
+        that are not numbers become NaN.
+    """
+    first = records[0]
+    time_field = 'TIMESTAMP_PST' if 'TIMESTAMP_PST' in first else 'JULDATE_PST'
+    fields = list(first)
+    if any(len(record) != len(first) for record in records):
+        seen = set(fields)
+        for record in records:
+            for field in record:
+                if field not in seen:
+                    seen.add(field)
+                    fields.append(field)
+    columns = [field for field in fields if field != time_field]
+
+    times = [record.get(time_field) for record in records]
+    try:
+        rows = list(map(operator.itemgetter(*columns), records)) if len(columns) > 1 else None
+    except KeyError:
+        rows = None
+    if rows is None:
+        rows = [tuple(record.get(column) for column in columns) for record in records]
+    values = np.empty((len(records), len(columns)), dtype=object)
+    values[:] = rows
+    return time_field, times, columns, _to_float_block(values, dtype)
+
+
+def _to_float_block(values, dtype):
+    r""" Converts a 2D object array to dtype, trying the whole block at once and falling back to pandas.to_numeric
+    (with non-numbers becoming NaN) only for the columns that need it. """
+    try:
+        return values.astype(dtype)
+    except (TypeError, ValueError):
+        pass
+    converted = np.empty(values.shape, dtype=dtype)
+    for j in range(values.shape[1]):
+        try:
+            converted[:, j] = values[:, j].astype(dtype)
+        except (TypeError, ValueError):
+            converted[:, j] = pd.to_numeric(values[:, j], errors='coerce')
+    return converted
+
+
+def _parse_times(times, time_field):
+    r""" Parses API time strings into a DatetimeIndex named time_field, using the API's fixed format when it matches. """
+    try:
+        index = pd.to_datetime(times, format=_TIME_FORMATS.get(time_field))
+    except (TypeError, ValueError):
+        index = pd.to_datetime(times)
+    return pd.DatetimeIndex(index, name=time_field)
+
+
+# the return_timezone names that are not IANA time zones
+_TIMEZONE_ALIASES = {'PDT': 'America/Los_Angeles'}
+
+# recent conversions, keyed on (zone, name, dtype, length, first, last), holding (API times, converted index)
+_timezone_cache = collections.OrderedDict()
+_timezone_cache_lock = threading.Lock()
+_TIMEZONE_CACHE_SIZE = 16
+
+
+def _convert_timezone(index, time_field, return_timezone):
+    r""" Converts a DatetimeIndex of API times (PST) to return_timezone. Daily dates are returned unchanged.
+
+    API times are a fixed UTC-8 with no daylight saving, so adding 8 hours gives UTC without any ambiguous or missing
+    times, and the result is viewed in the requested zone. Stations in one response usually share their times, so
+    recent conversions are kept and reused when an index with the same times comes again. Callers get a new Index
+    each time, so that renaming one never changes the cached one.
+
+    Raises:
+    -------
+        ValueError: if return_timezone is not PST, UTC, PDT or an IANA time zone name.
+    """
+    if time_field == 'JULDATE_PST' or return_timezone == 'PST':
+        return index
+    zone = _TIMEZONE_ALIASES.get(return_timezone, return_timezone)
+    times = np.asarray(index.values)
+    ints = times.view('int64')
+    key = (zone, index.name, times.dtype.str, len(ints), int(ints[0]) if len(ints) else None,
+           int(ints[-1]) if len(ints) else None)
+    with _timezone_cache_lock:
+        cached = _timezone_cache.get(key)
+        if cached is not None:
+            _timezone_cache.move_to_end(key)
+    if cached is not None and np.array_equal(cached[0], times):
+        return cached[1].copy()
+
+    converted = pd.DatetimeIndex(times + np.timedelta64(8, 'h'), name=index.name).tz_localize('UTC')
+    if zone != 'UTC':
+        try:
+            converted = converted.tz_convert(zone)
+        except (KeyError, TypeError, ValueError):
+            raise ValueError('Invalid return_timezone %r. Must be UTC, PDT, PST or an IANA time zone name such as '
+                             'America/Los_Angeles' % (return_timezone,))
+    with _timezone_cache_lock:
+        _timezone_cache[key] = (times, converted)
+        if len(_timezone_cache) > _TIMEZONE_CACHE_SIZE:
+            _timezone_cache.popitem(last=False)
+    return converted.copy()
+
+
+def _merge_station_messages(messages):
+    r""" Combines stationdata response messages for consecutive date windows into one message, with each station's
+    DATA records sorted by time and de-duplicated (later windows win).
+    """
+    stations = {}
+    order = []
+    for message in messages:
+        for station in message:
+            station_id = station['STATION_ID']
+            if station_id not in stations:
+                stations[station_id] = dict(station, DATA=[])
+                order.append(station_id)
+            stations[station_id]['DATA'].extend(station['DATA'])
+    for station_id in order:
+        records = dict((_record_time(record), record) for record in stations[station_id]['DATA'])
+        stations[station_id]['DATA'] = [records[key] for key in sorted(records)]
+    return [stations[station_id] for station_id in order]
+
+
+def _merge_station_dataframes(df_dicts):
+    r""" Combines dictionaries of station dataframes for consecutive date windows into one, with each dataframe sorted
+    by time and de-duplicated (later windows win).
+    """
+    frames = {}
+    for df_dict in df_dicts:
+        for station_id, df in df_dict.items():
+            frames.setdefault(station_id, []).append(df)
+    merged = {}
+    for station_id, station_frames in frames.items():
+        non_empty = [df for df in station_frames if not df.empty]
+        if not non_empty:
+            merged[station_id] = station_frames[0]
+            continue
+        df = pd.concat(non_empty) if len(non_empty) > 1 else non_empty[0]
+        merged[station_id] = df[~df.index.duplicated(keep='last')].sort_index()
+    return merged
+
+
+def _collect_window_parts(outcomes):
+    r""" Takes the result or exception of each date window in order and returns the results, skipping windows with no
+    data. Re-raises the first error other than AWNPyNoResultsError, or AWNPyNoResultsError if no window had data.
+    """
+    errors = [outcome for outcome in outcomes if isinstance(outcome, Exception)]
+    for error in errors:
+        if not isinstance(error, AWNPyNoResultsError):
+            raise error
+    if len(errors) == len(outcomes):
+        raise errors[0]
+    return [outcome for outcome in outcomes if not isinstance(outcome, Exception)]
+
+
+# ==================================================================================================================== #
+# JSON streaming                                                                                                       #
+# Type: Internal                                                                                                       #
+# Description: An incremental reader for stationdata responses, which turns the body into a sequence of events as it  #
+#              arrives so that large responses never have to be held in memory whole.                                 #
+# ==================================================================================================================== #
+
+
+class _JSONStream(object):
+    def __init__(self, fileobj, chunk_size=65536):
+        r""" Reads JSON tokens and values from a binary file-like object, keeping only a small window of it in memory.
+        """
+        self._file = fileobj
+        self._chunk_size = chunk_size
+        self._decoder = codecs.getincrementaldecoder('utf-8')()
+        self._json = json.JSONDecoder()
+        self._buffer = ''
+        self._pos = 0
+        self._eof = False
+
+    def _fill(self, size):
+        r""" Drops the consumed part of the buffer and appends up to size more bytes of the file. """
+        data = self._file.read(size)
+        if not data:
+            self._eof = True
+        self._buffer = self._buffer[self._pos:] + self._decoder.decode(data, final=not data)
+        self._pos = 0
+
+    def peek(self):
+        r""" Skips whitespace and returns the next character without consuming it, or '' at the end. """
+        while True:
+            while self._pos < len(self._buffer) and self._buffer[self._pos] in ' \t\r\n':
+                self._pos += 1
+            if self._pos < len(self._buffer) or self._eof:
+                return self._buffer[self._pos:self._pos + 1]
+            self._fill(self._chunk_size)
+
+    def next(self):
+        r""" Consumes and returns the next non-whitespace character, or '' at the end. """
+        char = self.peek()
+        self._pos += len(char)
+        return char
+
+    def expect(self, char):
+        if self.next() != char:
+            raise ValueError('Expected %r in JSON stream' % char)
+
+    def value(self):
+        r""" Consumes and returns the next complete JSON value. """
+        self.peek()
+        size = self._chunk_size
+        while True:
+            try:
+                value, end = self._json.raw_decode(self._buffer, self._pos)
+            except ValueError:
+                if self._eof:
+                    raise
+                value, end = None, None
+            # a number that runs to the end of the buffer may continue in the next chunk
+            if end is not None and (end < len(self._buffer) or self._eof or isinstance(value, (str, list, dict))):
+                self._pos = end
+                return value
+            # values larger than a chunk are read in growing steps so they are not re-parsed too often
+            self._fill(size)
+            size *= 2
+
+    def items(self):
+        r""" Iterates over the elements of the array that starts at the current position, consuming it. """
+        self.expect('[')
+        if self.peek() == ']':
+            self.next()
+            return
+        while True:
+            yield
+            char = self.next()
+            if char == ']':
+                return
+            if char != ',':
+                raise ValueError('Expected , or ] in JSON stream')
+
+    def members(self):
+        r""" Iterates over the keys of the object that starts at the current position, consuming it. Each member's
+        value must be consumed by the caller before the next key is read. """
+        self.expect('{')
+        if self.peek() == '}':
+            self.next()
+            return
+        while True:
+            key = self.value()
+            self.expect(':')
+            yield key
+            char = self.next()
+            if char == '}':
+                return
+            if char != ',':
+                raise ValueError('Expected , or } in JSON stream')
+
+
+def _iter_stationdata_events(fileobj, batch_size=5000):
+    r""" Parses a stationdata response body incrementally. Yields:
+        ('records', list): up to batch_size DATA records of the current station,
+        ('station', dict): a station's other fields, once the whole station has been read,
+        ('field', (key, value)): a top level field other than message, e.g. status.
+
+    Raises:
+    -------
+        ValueError if the body is not valid JSON.
+    """
+    stream = _JSONStream(fileobj)
+    for key in stream.members():
+        if key != 'message' or stream.peek() != '[':
+            yield 'field', (key, stream.value())
+            continue
+        for _ in stream.items():
+            if stream.peek() != '{':
+                yield 'station', stream.value()
+                continue
+            station = {}
+            for station_key in stream.members():
+                if station_key != 'DATA' or stream.peek() != '[':
+                    station[station_key] = stream.value()
+                    continue
+                batch = []
+                for _ in stream.items():
+                    batch.append(stream.value())
+                    if len(batch) >= batch_size:
+                        yield 'records', batch
+                        batch = []
+                if batch:
+                    yield 'records', batch
+            yield 'station', station
+    if stream.next() != '':
+        raise ValueError('Extra data after JSON value')
+
+
+# ==================================================================================================================== #
+# Transport classes                                                                                                    #
+# Type: HTTP                                                                                                           #
+# Description: The transport is the only part of AWNPy that talks to the network. AWN hands it a fully formed request  #
+#              and gets back a TransportResponse. Any object with the same request()/close() methods can be passed to  #
+#              AWN(transport=...), e.g. to point the client at a local stand-in server in tests.                       #
+# ==================================================================================================================== #
+
+
+def _accept_encoding():
+    r""" Returns the Accept-Encoding header value listing the content codings AWNPy can decode. """
+    encodings = ['gzip', 'deflate']
+    try:
+        importlib.import_module('brotli')
+        encodings.append('br')
+    except ImportError:
+        pass
+    return ', '.join(encodings)
+
+
+class _Decompressor(object):
+    def __init__(self, encoding):
+        r""" Incrementally decodes a body sent with Content-Encoding gzip, deflate or br. """
+        if encoding not in ('gzip', 'x-gzip', 'deflate', 'br'):
+            raise httplib.HTTPException('Unsupported Content-Encoding %r' % encoding)
+        self.encoding = encoding
+        if encoding == 'br':
+            self._brotli = importlib.import_module('brotli').Decompressor()
+        else:
+            # deflate should be zlib wrapped, but some servers send it raw; that is detected from the first bytes
+            self._zlib = zlib.decompressobj(31 if encoding in ('gzip', 'x-gzip') else 15)
+            self._started = False
+
+    def decompress(self, data):
+        try:
+            if self.encoding == 'br':
+                return self._brotli.process(data)
+            if self.encoding == 'deflate' and not self._started and data:
+                self._started = True
+                try:
+                    return self._zlib.decompress(data)
+                except zlib.error:
+                    self._zlib = zlib.decompressobj(-15)
+            return self._zlib.decompress(data)
+        except Exception:
+            # reported like any other broken response, so that it can be retried
+            raise httplib.HTTPException('Could not decode %s response body' % self.encoding)
+
+    def flush(self):
+        return b'' if self.encoding == 'br' else self._zlib.flush()
+
+
+class _DecodedStream(object):
+    def __init__(self, raw, encoding, chunk_size=65536):
+        r""" A file-like object reading the decoded body of a compressed response from raw, a chunk at a time. The
+        number of bytes read from raw is kept in wire_bytes. Decoded bytes wait in a buffer from the read offset
+        on, so small reads do not copy what is left of it. """
+        self._raw = raw
+        self._decompressor = _Decompressor(encoding)
+        self._chunk_size = chunk_size
+        self._buffer = bytearray()
+        self._offset = 0
+        self._eof = False
+        self.wire_bytes = 0
+
+    def _next(self):
+        data = self._raw.read(self._chunk_size)
+        self.wire_bytes += len(data)
+        if data:
+            return self._decompressor.decompress(data)
+        self._eof = True
+        return self._decompressor.flush()
+
+    def read(self, amt=None):
+        if amt is None:
+            parts = [bytes(self._buffer[self._offset:])]
+            while not self._eof:
+                parts.append(self._next())
+            self._buffer, self._offset = bytearray(), 0
+            return b''.join(parts)
+        while not self._eof and len(self._buffer) - self._offset < amt:
+            self._buffer += self._next()
+        end = min(self._offset + amt, len(self._buffer))
+        data = bytes(self._buffer[self._offset:end])
+        self._offset = end
+        # drop the consumed front once it outweighs what is left, so each byte is moved a bounded number of times
+        if self._offset * 2 >= len(self._buffer):
+            del self._buffer[:self._offset]
+            self._offset = 0
+        return data
+
+
+def _decode_body(raw, encoding):
+    r""" Reads and decodes the whole compressed body of raw. Returns (body, wire bytes). """
+    stream = _DecodedStream(raw, encoding)
+    return stream.read(), stream.wire_bytes
+
+
+class TransportResponse(object):
+    def __init__(self, status, headers, body, reason='', stream=None, release=None, timings=None, wire_bytes=None):
+        r""" The result of a single HTTP exchange made by a transport.
+
+        Arguments:
+        ----------
+        status: int, mandatory
+            The HTTP status code.
+        headers: list of (name, value) tuples, mandatory
+            The response headers. Names are stored lower case.
+        body: bytes, mandatory
+            The full response body, or None for a streamed response.
+        reason: string, optional
+            The HTTP reason phrase.
+        stream: file-like object, optional
+            For a streamed response, the unread body.
+        release: callable, optional
+            For a streamed response, called once by close() to give the connection back to the transport.
+        timings: dict, optional
+            Seconds spent in each phase of the exchange, e.g. 'connect', 'wait' (sending the request until the
+            response headers arrive) and 'transfer' (reading the body).
+        wire_bytes: int, optional
+            The size of the body as sent, if it was compressed. Defaults to the size of body.
+        """
+
+        self.status = status
+        self.timings = timings or {}
+        self.wire_bytes = wire_bytes if wire_bytes is not None or body is None else len(body)
+        self.reason = reason
+        self.headers = dict((name.lower(), value) for name, value in headers)
+        self.body = body
+        self._stream = stream
+        self._release = release
+
+    def read(self, amt=None):
+        r""" Reads up to amt bytes of the body, or all that is left if amt is None. """
+        if self._stream is None:
+            self._stream = io.BytesIO(self.body)
+        return self._stream.read() if amt is None else self._stream.read(amt)
+
+    def close(self):
+        r""" Releases the connection of a streamed response. Safe to call more than once. """
+        if self._release is not None:
+            release, self._release = self._release, None
+            release()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class Transport(object):
+    r""" Interface for the objects AWN uses to send requests. Subclasses must implement request(). """
+
+    def request(self, method, url, body=None, headers=None, timeout=None, stream=False):
+        r""" Sends one HTTP request and returns a TransportResponse.
+
+        Arguments:
+        ----------
+        method: string, mandatory
+            The HTTP method, e.g. 'POST'.
+        url: string, mandatory
+            The absolute URL of the request.
+        body: bytes, optional
+            The request body.
+        headers: dict, optional
+            Extra request headers.
+        timeout: float, optional
+            Socket timeout in seconds for this request. If not given the transport default is used.
+        stream: bool, optional
+            If true, return as soon as the headers arrive and leave the body to be read from the response, which must
+            then be closed.
+
+        Returns:
+        --------
+            A TransportResponse.
+
+        Raises:
+        -------
+            socket.error (OSError) or httplib.HTTPException if the request could not be completed.
+        """
+        raise NotImplementedError
+
+    def close(self):
+        r""" Releases any resources (e.g. open connections) held by the transport. """
+        pass
+
+
+class PooledTransport(Transport):
+    def __init__(self, pool_size=10, max_per_host=None, idle_timeout=60., timeout=60., ssl_context=None,
+                 compress=True):
+        r""" A keep-alive transport that reuses HTTP(S) connections between requests, so that only the first request to
+        a host pays for the TCP and TLS handshake. It is safe to share between threads.
+
+        Arguments:
+        ----------
+        pool_size: int, optional
+            The maximum number of idle connections kept open per host. Connections returned beyond this are closed.
+        max_per_host: int, optional
+            The maximum number of connections open to one host at any time. Further requests block until a connection
+            is released. None (default) means no limit.
+        idle_timeout: float, optional
+            Idle connections older than this many seconds are closed instead of being reused.
+        timeout: float, optional
+            The default socket timeout in seconds.
+        ssl_context: ssl.SSLContext, optional
+            The context used for HTTPS connections. Defaults to _default_ssl_context().
+        compress: bool, optional
+            If true (default), ask for gzip or deflate compressed responses (and brotli, if the brotli package is
+            installed) and decode them as they are read. The bytes received before and after decoding are counted in
+            stats['wire_bytes'] and stats['body_bytes'], for responses that are not streamed.
+
+        Returns:
+        --------
+            None.
+
+        Raises:
+        -------
+            None.
+        """
+
+        self.pool_size = pool_size
+        self.max_per_host = max_per_host
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self.ssl_context = ssl_context
+        self.compress = compress
+        self.stats = collections.Counter()
+        self._idle = {}
+        self._slots = {}
+        self._lock = threading.Lock()
+
+    def _slot(self, key):
+        r""" Returns the semaphore limiting concurrent connections to a host, or None if there is no limit. """
+        if not self.max_per_host:
+            return None
+        with self._lock:
+            if key not in self._slots:
+                self._slots[key] = threading.BoundedSemaphore(self.max_per_host)
+            return self._slots[key]
+
+    def _checkout(self, key, timeout):
+        r""" Returns (connection, reused) for a host, preferring the most recently used idle connection. """
+        now = time.time()
+        expired = []
+        conn = None
+        with self._lock:
+            idle = self._idle.get(key, [])
+            while idle:
+                candidate, last_used = idle.pop()
+                if now - last_used <= self.idle_timeout:
+                    conn = candidate
+                    break
+                expired.append(candidate)
+        for stale in expired:
+            stale.close()
+        if conn is not None:
+            if conn.sock is not None:
+                conn.sock.settimeout(timeout)
+            return conn, True
+
+        scheme, host, port = key
+        if scheme == 'https':
+            if self.ssl_context is None:
+                self.ssl_context = _default_ssl_context()
+            return httplib.HTTPSConnection(host, port, timeout=timeout, context=self.ssl_context), False
+        return httplib.HTTPConnection(host, port, timeout=timeout), False
+
+    def _checkin(self, key, conn):
+        r""" Returns a connection to the idle pool, closing it if the pool for its host is full. """
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self.pool_size:
+                idle.append((conn, time.time()))
+                return
+        conn.close()
+
+    def _release(self, key, conn, resp, slot):
+        r""" Returns a connection to the idle pool once its response has been read to the end, or closes it. """
+        try:
+            if resp.will_close or not resp.isclosed():
+                conn.close()
+            else:
+                self._checkin(key, conn)
+        finally:
+            if slot is not None:
+                slot.release()
+
+    def request(self, method, url, body=None, headers=None, timeout=None, stream=False):
+        parts = urlsplit(url)
+        key = (parts.scheme, parts.hostname, parts.port)
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+        if timeout is None:
+            timeout = self.timeout
+        request_headers = {'User-Agent': 'AWNPy', 'Connection': 'keep-alive'}
+        if self.compress:
+            request_headers['Accept-Encoding'] = _accept_encoding()
+        request_headers.update(headers or {})
+
+        slot = self._slot(key)
+        if slot is not None:
+            slot.acquire()
+        try:
+            while True:
+                conn, reused = self._checkout(key, timeout)
+                timings = {}
+                try:
+                    started = time.perf_counter()
+                    if conn.sock is None:
+                        conn.connect()
+                        timings['connect'] = time.perf_counter() - started
+                        started = time.perf_counter()
+                    conn.request(method, path, body=body, headers=request_headers)
+                    resp = conn.getresponse()
+                    timings['wait'] = time.perf_counter() - started
+                    encoding = (resp.getheader('Content-Encoding') or '').strip().lower()
+                    if encoding in ('', 'identity'):
+                        encoding = None
+                    if not stream:
+                        started = time.perf_counter()
+                        if encoding:
+                            data, wire_bytes = _decode_body(resp, encoding)
+                        else:
+                            data = resp.read()
+                            wire_bytes = len(data)
+                        timings['transfer'] = time.perf_counter() - started
+                except (httplib.HTTPException, socket.error):
+                    conn.close()
+                    # the server may have dropped a kept-alive connection while it sat idle: try once more on a new one
+                    if reused:
+                        continue
+                    raise
+                break
+        except BaseException:
+            if slot is not None:
+                slot.release()
+            raise
+        if stream:
+            body_stream = _DecodedStream(resp, encoding) if encoding else resp
+            return TransportResponse(resp.status, resp.getheaders(), None, resp.reason, stream=body_stream,
+                                     release=lambda: self._release(key, conn, resp, slot), timings=timings)
+        self._release(key, conn, resp, slot)
+        with self._lock:
+            self.stats['wire_bytes'] += wire_bytes
+            self.stats['body_bytes'] += len(data)
+        return TransportResponse(resp.status, resp.getheaders(), data, resp.reason, timings=timings,
+                                 wire_bytes=wire_bytes)
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for conns in idle.values():
+            for conn, _ in conns:
+                conn.close()
+
+
+class AsyncTransport(object):
+    r""" Interface for the objects AsyncAWN uses to send requests. Subclasses must implement the request() coroutine,
+    which takes the same arguments as Transport.request(), except stream, and returns a TransportResponse. """
+
+    async def request(self, method, url, body=None, headers=None, timeout=None):
+        raise NotImplementedError
+
+    async def close(self):
+        pass
+
+
+class AsyncPooledTransport(AsyncTransport):
+    def __init__(self, pool_size=10, idle_timeout=60., timeout=60., ssl_context=None, compress=True):
+        r""" A keep-alive HTTP/1.1 transport built on asyncio streams, for use with AsyncAWN. Arguments are the same as
+        for PooledTransport; concurrency is limited by AsyncAWN rather than by the transport.
+        """
+
+        self.pool_size = pool_size
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self.ssl_context = ssl_context
+        self.compress = compress
+        self.stats = collections.Counter()
+        self._idle = {}
+
+    async def _checkout(self, key, timeout):
+        r""" Returns (reader, writer, reused) for a host, preferring the most recently used idle connection. """
+        now = time.time()
+        idle = self._idle.get(key, [])
+        while idle:
+            reader, writer, last_used = idle.pop()
+            if now - last_used <= self.idle_timeout and not reader.at_eof():
+                return reader, writer, True
+            writer.close()
+
+        scheme, host, port = key
+        context = None
+        if scheme == 'https':
+            if self.ssl_context is None:
+                self.ssl_context = _default_ssl_context()
+            context = self.ssl_context
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port, ssl=context), timeout)
+        return reader, writer, False
+
+    def _checkin(self, key, reader, writer):
+        idle = self._idle.setdefault(key, [])
+        if len(idle) < self.pool_size:
+            idle.append((reader, writer, time.time()))
+        else:
+            writer.close()
+
+    @staticmethod
+    async def _read_response(reader):
+        r""" Reads one HTTP/1.1 response. Returns (status, reason, headers, body, will_close). """
+        status_line = await reader.readline()
+        if not status_line:
+            raise httplib.RemoteDisconnected('Remote end closed connection without response')
+        try:
+            version, status, reason = (status_line.decode('latin-1').rstrip('\r\n').split(' ', 2) + [''])[:3]
+            status = int(status)
+        except ValueError:
+            raise httplib.BadStatusLine(status_line)
+
+        headers = []
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers.append((name.strip(), value.strip()))
+        lookup = dict((name.lower(), value.lower()) for name, value in headers)
+
+        will_close = lookup.get('connection') == 'close' or (version == 'HTTP/1.0' and
+                                                              lookup.get('connection') != 'keep-alive')
+        if lookup.get('transfer-encoding') == 'chunked':
+            chunks = []
+            while True:
+                size = int((await reader.readline()).split(b';')[0].strip(), 16)
+                if size == 0:
+                    # skip any trailers
+                    while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                        pass
+                    break
+                chunks.append(await reader.readexactly(size))
+                await reader.readexactly(2)
+            body = b''.join(chunks)
+        elif 'content-length' in lookup:
+            body = await reader.readexactly(int(lookup['content-length']))
+        else:
+            body = await reader.read()
+            will_close = True
+        return status, reason, headers, body, will_close
+
+    async def request(self, method, url, body=None, headers=None, timeout=None):
+        parts = urlsplit(url)
+        scheme = parts.scheme
+        port = parts.port or (443 if scheme == 'https' else 80)
+        key = (scheme, parts.hostname, port)
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+        if timeout is None:
+            timeout = self.timeout
+        body = body or b''
+
+        request_headers = {'Host': parts.netloc, 'User-Agent': 'AWNPy', 'Connection': 'keep-alive',
+                           'Content-Length': str(len(body))}
+        if self.compress:
+            request_headers['Accept-Encoding'] = _accept_encoding()
+        request_headers.update(headers or {})
+        head = '%s %s HTTP/1.1\r\n' % (method, path)
+        head += ''.join('%s: %s\r\n' % item for item in request_headers.items()) + '\r\n'
+
+        while True:
+            started = time.perf_counter()
+            reader, writer, reused = await self._checkout(key, timeout)
+            # the async transport reads headers and body together, so 'transfer' includes waiting for the response
+            timings = {} if reused else {'connect': time.perf_counter() - started}
+            try:
+                started = time.perf_counter()
+                writer.write(head.encode('latin-1') + body)
+                await writer.drain()
+                status, reason, response_headers, data, will_close = await asyncio.wait_for(
+                    self._read_response(reader), timeout)
+                timings['transfer'] = time.perf_counter() - started
+            except (httplib.HTTPException, asyncio.IncompleteReadError, socket.error):
+                writer.close()
+                # the server may have dropped a kept-alive connection while it sat idle: try once more on a new one
+                if reused:
+                    continue
+                raise
+            except BaseException:
+                writer.close()
+                raise
+            break
+        if will_close:
+            writer.close()
+        else:
+            self._checkin(key, reader, writer)
+        wire_bytes = len(data)
+        encoding = dict((name.lower(), value) for name, value in response_headers).get('content-encoding', '')
+        encoding = encoding.strip().lower()
+        if encoding not in ('', 'identity'):
+            data = _decode_body(io.BytesIO(data), encoding)[0]
+        self.stats['wire_bytes'] += wire_bytes
+        self.stats['body_bytes'] += len(data)
+        return TransportResponse(status, response_headers, data, reason, timings=timings, wire_bytes=wire_bytes)
+
+    async def close(self):
+        idle, self._idle = self._idle, {}
+        for conns in idle.values():
+            for _, writer, _ in conns:
+                writer.close()
+
+
+# ==================================================================================================================== #
+# Request scheduling classes                                                                                           #
+# Type: Transport                                                                                                      #
+# Description: RequestScheduler sits between AWN._get_response and the transport. It retries transient failures with #
+#              exponential backoff, spaces requests out with a token bucket shared by every thread, and stops sending  #
+#              requests for a while (a circuit breaker) when the API keeps failing.                                    #
+# ==================================================================================================================== #
+
+
+class TokenBucket(object):
+    def __init__(self, rate, burst=None):
+        r""" A rate limiter allowing rate requests per second on average, and bursts of up to burst requests.
+
+        Arguments:
+        ----------
+        rate: float, mandatory
+            Requests per second.
+        burst: int, optional
+            The number of requests that may be sent at once after a quiet period. Defaults to max(1, rate).
+
+        Returns:
+        --------
+            None.
+
+        Raises:
+        -------
+            None.
+        """
+
+        self.rate = float(rate)
+        self.burst = float(burst if burst is not None else max(1., self.rate))
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        r""" Takes a token and returns how many seconds the caller must wait before using it. """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1.
+            return max(0., -self._tokens / self.rate)
+
+
+class CircuitBreaker(object):
+    def __init__(self, failure_threshold=5, reset_timeout=30.):
+        r""" Opens after failure_threshold consecutive failures, rejecting requests until reset_timeout seconds have
+        passed. Then a single trial request is let through: if it succeeds the breaker closes, otherwise it opens again.
+
+        Arguments:
+        ----------
+        failure_threshold: int, optional
+            Consecutive failures that open the breaker. Default is 5.
+        reset_timeout: float, optional
+            Seconds the breaker stays open. Default is 30.
+
+        Returns:
+        --------
+            None.
+
+        Raises:
+        -------
+            None.
+        """
+
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self._opened_at = None
+        self._trial = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        r""" 'closed', 'open' or 'half-open'. """
+        if self._opened_at is None:
+            return 'closed'
+        if time.monotonic() - self._opened_at >= self.reset_timeout:
+            return 'half-open'
+        return 'open'
+
+    def allow(self):
+        r""" Returns True if a request may be sent now. """
+        return self._admit() is not None
+
+    def _admit(self):
+        r""" Returns None if a request may not be sent now, True if it is the half-open trial and False otherwise. """
+        with self._lock:
+            state = self.state
+            if state == 'closed':
+                return False
+            if state == 'half-open' and not self._trial:
+                self._trial = True
+                return True
+            return None
+
+    def release(self):
+        r""" Ends the half-open trial without an outcome, e.g. when it was interrupted, so that another can start. """
+        with self._lock:
+            self._trial = False
+
+    def record(self, success):
+        with self._lock:
+            self._trial = False
+            if success:
+                self.failures = 0
+                self._opened_at = None
+            else:
+                self.failures += 1
+                if self.failures >= self.failure_threshold or self._opened_at is not None:
+                    self._opened_at = time.monotonic()
+
+
+class RequestScheduler(object):
+    # the number of times each class of failure is retried by default
+    default_retries = {'connection': 3, 'timeout': 2, 'server': 3, 'throttled': 5}
+
+    def __init__(self, retries=None, backoff=0.5, max_backoff=30., rate=None, burst=None, failure_threshold=5,
+                 reset_timeout=30.):
+        r""" Decides when requests are sent and whether failed ones are sent again. One scheduler may be shared by
+        several AWN instances, so that their rate limit and circuit breaker are shared too.
+
+        Arguments:
+        ----------
+        retries: dict, optional
+            The number of retries for each class of failure: 'connection' (the connection failed or was dropped),
+            'timeout' (no response in time), 'server' (HTTP 5xx) and 'throttled' (HTTP 429). Given values replace the
+            defaults of 3, 2, 3 and 5. Other HTTP errors and API errors are not retried.
+        backoff: float, optional
+            Seconds before the first retry. Each further retry waits up to twice as long, with full random jitter, or
+            as long as the response's Retry-After header asks. Default is 0.5.
+        max_backoff: float, optional
+            The longest wait between retries, in seconds. Default is 30.
+        rate: float, optional
+            If supplied, requests (including retries) are limited to this many per second.
+        burst: int, optional
+            See TokenBucket.
+        failure_threshold: int, optional
+            Consecutive failed attempts after which requests are rejected without being sent. None disables the
+            circuit breaker. Default is 5.
+        reset_timeout: float, optional
+            Seconds before a rejected request is tried again. Default is 30.
+
+        Returns:
+        --------
+            None.
+
+        Raises:
+        -------
+            None.
+        """
+
+        self.retries = dict(self.default_retries)
+        self.retries.update(retries or {})
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.bucket = TokenBucket(rate, burst) if rate else None
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout) if failure_threshold else None
+        self._lock = threading.Lock()
+        self.stats = collections.Counter()
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self.stats[name] += amount
+
+    @staticmethod
+    def classify(error=None, resp=None):
+        r""" Returns the class of a failed attempt ('connection', 'timeout', 'server' or 'throttled'), or None if the
+        attempt succeeded or should not be retried. """
+        if error is not None:
+            return 'timeout' if isinstance(error, socket.timeout) else 'connection'
+        if resp.status == 429:
+            return 'throttled'
+        if resp.status >= 500:
+            return 'server'
+        return None
+
+    def _delay(self, attempt, resp):
+        delay = random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+        retry_after = resp.headers.get('retry-after') if resp is not None else None
+        if retry_after:
+            try:
+                delay = max(delay, min(self.max_backoff, float(retry_after)))
+            except ValueError:
+                pass
+        return delay
+
+    def _before(self, emit):
+        r""" Checks the circuit breaker and returns (seconds to wait for the rate limit, whether the attempt is the
+        breaker's half-open trial). A trial must end in _record() or the breaker's release(). """
+        trial = False
+        if self.breaker is not None:
+            trial = self.breaker._admit()
+            if trial is None:
+                self._count('rejected')
+                if emit is not None:
+                    emit('rejected', 1)
+                raise AWNPyError('Requests to the API are paused after %d failures in a row. Please try again in %g '
+                                 'seconds.' % (self.breaker.failures, self.breaker.reset_timeout))
+        try:
+            wait = self.bucket.reserve() if self.bucket is not None else 0.
+            if wait:
+                self._count('throttled')
+                self._count('throttle_seconds', wait)
+                if emit is not None:
+                    emit('throttle_seconds', wait)
+        except BaseException:
+            if trial:
+                self.breaker.release()
+            raise
+        self._count('requests')
+        return wait, trial
+
+    def _record(self, error, resp):
+        r""" Classifies an attempt's outcome and records it in the circuit breaker. Returns the failure class. """
+        failure = self.classify(error, resp)
+        if self.breaker is not None:
+            self.breaker.record(failure is None)
+        return failure
+
+    def _after(self, attempt, failure, resp, emit):
+        r""" Returns the seconds to wait before retrying after a failure, or None not to retry. """
+        if failure is None:
+            return None
+        self._count('failures_' + failure)
+        if attempt >= self.retries.get(failure, 0):
+            return None
+        delay = self._delay(attempt, resp)
+        self._count('retries')
+        self._count('retries_' + failure)
+        self._count('backoff_seconds', delay)
+        if emit is not None:
+            emit('retries', 1, reason=failure)
+            emit('backoff_seconds', delay, reason=failure)
+        return delay
+
+    def send(self, request, emit=None):
+        r""" Calls request(), which sends one attempt and returns a TransportResponse, retrying as configured. If
+        emit is given it is called as emit(event, value, **labels) for each retry, rejection and rate limit wait.
+        AWN passes its _emit(), which hands the events on to its hooks; see AWN(hooks=...).
+
+        Returns:
+        --------
+            The TransportResponse of the last attempt, which may still have an error status if retries ran out.
+
+        Raises:
+        -------
+            The transport's exception if the last attempt failed to connect, or AWNPyError if the circuit breaker is
+            open.
+        """
+        attempt = 0
+        while True:
+            wait, trial = self._before(emit)
+            try:
+                if wait:
+                    time.sleep(wait)
+                error = resp = None
+                try:
+                    resp = request()
+                except (httplib.HTTPException, socket.error, EOFError) as e:
+                    error = e
+                failure = self._record(error, resp)
+                trial = False
+            finally:
+                # anything else escaping the attempt must not leave the breaker waiting on its trial forever
+                if trial:
+                    self.breaker.release()
+            delay = self._after(attempt, failure, resp, emit)
+            if delay is None:
+                if error is not None:
+                    raise error
+                return resp
+            if resp is not None:
+                resp.close()
+            time.sleep(delay)
+            attempt += 1
+
+    async def send_async(self, request, emit=None):
+        r""" Coroutine version of send(), for a request() coroutine function. """
+        attempt = 0
+        while True:
+            wait, trial = self._before(emit)
+            try:
+                if wait:
+                    await asyncio.sleep(wait)
+                error = resp = None
+                try:
+                    resp = await request()
+                except (httplib.HTTPException, socket.error, EOFError) as e:
+                    error = e
+                failure = self._record(error, resp)
+                trial = False
+            finally:
+                if trial:
+                    self.breaker.release()
+            delay = self._after(attempt, failure, resp, emit)
+            if delay is None:
+                if error is not None:
+                    raise error
+                return resp
+            await asyncio.sleep(delay)
+            attempt += 1
+
+
+# ==================================================================================================================== #
+# Request coalescing                                                                                                   #
+# Type: Transport                                                                                                      #
+# Description: Lets concurrent identical calls share one request. The first caller for a key does the work and the   #
+#              others wait for it and receive a copy of its result, or the same exception.                            #
+# ==================================================================================================================== #
+
+
+class _Flight(object):
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.followers = 0
+        self.copies = None
+
+
+class SingleFlight(object):
+    def __init__(self):
+        r""" Coalesces concurrent calls with the same key into one. Counters of calls that did the work ('leaders')
+        and calls that shared it ('shared') are kept in stats. """
+        self._lock = threading.Lock()
+        self._flights = {}
+        self._async_flights = {}
+        self.stats = collections.Counter()
+
+    def do(self, key, func, copy=None):
+        r""" Returns func(), unless a call with the same key is already running, in which case its result is waited
+        for and returned passed through copy (if given), so that callers never share mutable objects. The copies are
+        made before the first caller gets the result back, so changes it makes never reach the others.
+
+        Raises:
+        -------
+            Whatever func() raised, in every caller that shared it.
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+            else:
+                flight.followers += 1
+            self.stats['leaders' if leader else 'shared'] += 1
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.copies.pop() if flight.copies is not None else flight.result
+        try:
+            flight.result = func()
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            # no one can join once the key is removed, so followers is final
+            with self._lock:
+                del self._flights[key]
+            if flight.error is None and copy is not None:
+                try:
+                    flight.copies = [copy(flight.result) for _ in range(flight.followers)]
+                except BaseException as e:
+                    flight.error = e
+            flight.done.set()
+        return flight.result
+
+    async def do_async(self, key, func, copy=None):
+        r""" Coroutine version of do(), for a coroutine function func. Calls are only coalesced within one event
+        loop. If the call doing the work is cancelled, only it is: the calls waiting for it run func() again, one of
+        them doing the work for the rest. """
+        flight = self._async_flights.get(key)
+        while flight is not None and not flight[0].done():
+            self.stats['shared'] += 1
+            flight[1] += 1
+            outcome = await asyncio.shield(flight[0])
+            if outcome is not None:
+                result, copies = outcome
+                return copies.pop() if copies is not None else result
+            flight = self._async_flights.get(key)
+        self.stats['leaders'] += 1
+        # [future of (result, copies), number of followers]
+        flight = self._async_flights[key] = [asyncio.get_running_loop().create_future(), 0]
+        future = flight[0]
+        try:
+            result = await func()
+            del self._async_flights[key]
+            copies = [copy(result) for _ in range(flight[1])] if copy is not None else None
+            future.set_result((result, copies))
+            return result
+        except asyncio.CancelledError:
+            # wake the followers with no result, so that they retry rather than share the cancellation
+            if not future.done():
+                future.set_result(None)
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            # mark the exception as retrieved in case nobody else was waiting
+            future.exception()
+            raise
+        finally:
+            if self._async_flights.get(key) is flight:
+                del self._async_flights[key]
+
+
+def _copy_frames(result):
+    r""" Copies a dataframe, or a dictionary of dataframes, returned by stationdata(). None is returned as is. """
+    if result is None:
+        return None
+    if isinstance(result, dict):
+        return dict((key, df.copy()) for key, df in result.items())
+    return result.copy()
+
+
+# ==================================================================================================================== #
+# MetricsRegistry class                                                                                                #
+# Type: Instrumentation                                                                                                #
+# Description: AWN reports what it does as events passed to hook callables, hook(event, value, labels). The registry #
+#              is one such hook, which aggregates events in process and writes them as Prometheus text or JSON.      #
+# ==================================================================================================================== #
+
+
+class MetricsRegistry(object):
+    def __init__(self, prefix='awnpy'):
+        r""" Aggregates AWN events. Events ending in _seconds are kept as summaries (count, sum and max); all others
+        are counters of the summed values. Pass the registry in AWN(hooks=[registry]).
+
+        Events:
+        -------
+            request_seconds: a request through the scheduler, including retries (labels endpoint, status)
+            connect_seconds, wait_seconds, transfer_seconds: phases of each attempt (label endpoint)
+            bytes_received, wire_bytes: response body bytes after and before decompression (label endpoint)
+            decode_seconds: JSON decoding and checking (label endpoint)
+            dataframe_seconds, rows: converting DATA records to dataframes
+            cache_hits, cache_misses: response cache lookups (label endpoint)
+            coalesced: calls that shared a request already in flight (label endpoint)
+            retries, backoff_seconds: retried attempts (label reason), rejected and throttle_seconds: see
+            RequestScheduler
+
+        Arguments:
+        ----------
+        prefix: string, optional
+            Prepended to metric names in to_prometheus(). Default is 'awnpy'.
+
+        Returns:
+        --------
+            None.
+
+        Raises:
+        -------
+            None.
+        """
+
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        # (event, sorted label items) -> [count, sum, max]
+        self._metrics = {}
+
+    def __call__(self, event, value, labels):
+        self.observe(event, value, labels)
+
+    def observe(self, event, value, labels=None):
+        key = (event, tuple(sorted((labels or {}).items())))
+        with self._lock:
+            metric = self._metrics.get(key)
+            if metric is None:
+                self._metrics[key] = [1, value, value]
+            else:
+                metric[0] += 1
+                metric[1] += value
+                metric[2] = max(metric[2], value)
+
+    def reset(self):
+        with self._lock:
+            self._metrics = {}
+
+    def snapshot(self):
+        r""" Returns the metrics as a list of dictionaries with event, labels, count, sum and max. """
+        with self._lock:
+            items = sorted(self._metrics.items(), key=lambda item: (item[0][0], [str(v) for v in item[0][1]]))
+            return [{'event': event, 'labels': dict(labels), 'count': count, 'sum': total, 'max': largest}
+                    for (event, labels), (count, total, largest) in items]
+
+    def to_json(self):
+        return json.dumps(self.snapshot(), indent=1)
+
+    def to_prometheus(self):
+        r""" Returns the metrics in the Prometheus text exposition format. """
+        lines = []
+        typed = set()
+        for metric in self.snapshot():
+            name = '%s_%s' % (self.prefix, metric['event'])
+            labels = ','.join('%s="%s"' % (key, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                              for key, value in sorted(metric['labels'].items()))
+            labels = '{%s}' % labels if labels else ''
+            if metric['event'].endswith('_seconds'):
+                if name not in typed:
+                    lines.append('# TYPE %s summary' % name)
+                lines.append('%s_count%s %d' % (name, labels, metric['count']))
+                lines.append('%s_sum%s %r' % (name, labels, float(metric['sum'])))
+            else:
+                if name not in typed:
+                    lines.append('# TYPE %s_total counter' % name)
+                lines.append('%s_total%s %r' % (name, labels, float(metric['sum'])))
+            typed.add(name)
+        return '\n'.join(lines) + '\n'
+
+
+# ==================================================================================================================== #
+# Cache classes                                                                                                        #
+# Type: Storage                                                                                                        #
+# Description: Response caches sit under AWN._get_response and store raw response bodies keyed on the endpoint and the #
+#              request parameters (without username and password). Any object with the same get()/set()/clear()       #
+#              methods can be passed to AWN(cache=...).                                                                #
+# ==================================================================================================================== #
+
+
+def _tmp_path(path):
+    r""" Returns a temporary path to write path's new contents to before replacing it. It names the process and the
+    thread, so that writers sharing a directory never write to the same temporary file. """
+    return '%s.%d.%d.tmp' % (path, os.getpid(), threading.current_thread().ident)
+
+
+def _request_key(endpoint, request_dict):
+    r""" Returns a string identifying an API request by its endpoint and parameters, ignoring the credentials. """
+    params = sorted((key, str(value)) for key, value in request_dict.items() if key not in ('uname', 'pass'))
+    return json.dumps([endpoint, params])
+
+
+class ResponseCache(object):
+    r""" Interface for response caches. Subclasses must implement get(), set() and clear(). """
+
+    def get(self, key):
+        r""" Returns the bytes stored under key, or None if there are none or they have expired. """
+        raise NotImplementedError
+
+    def set(self, key, value, ttl=None):
+        r""" Stores bytes under key for ttl seconds, or until evicted if ttl is None. """
+        raise NotImplementedError
+
+    def clear(self):
+        r""" Removes everything from the cache. """
+        raise NotImplementedError
+
+
+class DiskCache(ResponseCache):
+    def __init__(self, directory, max_bytes=512 * 1024 * 1024):
+        r""" A response cache kept as one file per entry in a directory, so that it lasts between runs. When the files
+        add up to more than max_bytes the least recently used entries are removed.
+
+        Arguments:
+        ----------
+        directory: string, mandatory
+            The directory to keep cache files in. It is created if it does not exist.
+        max_bytes: int, optional
+            The maximum total size of the cache files. Default is 512 MB.
+
+        Returns:
+        --------
+            None.
+
+        Raises:
+        -------
+            None.
+        """
+
+        self.directory = os.path.expanduser(directory)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        # file name -> size, least recently used first
+        self._entries = collections.OrderedDict()
+        files = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.cache'):
+                stat = os.stat(os.path.join(self.directory, name))
+                files.append((stat.st_mtime, name, stat.st_size))
+        for _, name, size in sorted(files):
+            self._entries[name] = size
+        self._size = sum(self._entries.values())
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    @staticmethod
+    def _name(key):
+        return hashlib.sha1(key.encode('utf-8')).hexdigest() + '.cache'
+
+    def _remove(self, name):
+        self._size -= self._entries.pop(name, 0)
+        try:
+            os.remove(self._path(name))
+        except OSError:
+            pass
+
+    def get(self, key):
+        name = self._name(key)
+        with self._lock:
+            try:
+                with open(self._path(name), 'rb') as f:
+                    expires = float(f.readline())
+                    value = f.read()
+            except (IOError, OSError, ValueError):
+                self._remove(name)
+                return None
+            if expires and expires < time.time():
+                self._remove(name)
+                return None
+            if name in self._entries:
+                self._entries[name] = self._entries.pop(name)
+            os.utime(self._path(name), None)
+            return value
+
+    def set(self, key, value, ttl=None):
+        name = self._name(key)
+        expires = time.time() + ttl if ttl is not None else 0
+        data = ('%r\n' % expires).encode('ascii') + value
+        with self._lock:
+            tmp_path = _tmp_path(self._path(name))
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, self._path(name))
+            self._size -= self._entries.pop(name, 0)
+            self._entries[name] = len(data)
+            self._size += len(data)
+            while self._size > self.max_bytes and len(self._entries) > 1:
+                self._remove(next(iter(self._entries)))
+
+    def clear(self):
+        with self._lock:
+            for name in list(self._entries):
+                self._remove(name)
+
+
+# ==================================================================================================================== #
+# StationRegistry class                                                                                                #
+# Type: Metadata                                                                                                       #
+# Description: An in-memory copy of the station metadata with dictionary lookups, so that stations can be found by    #
+#              ID or name and filtered without going back to the API.                                                  #
+# ==================================================================================================================== #
+
+
+NameMatch = collections.namedtuple('NameMatch', ['name', 'station_id', 'matched', 'score'])
+
+
+def _normalize_name(name):
+    r""" Lower case, with runs of anything other than letters and digits replaced by one space. """
+    return ' '.join(re.split(r'[^0-9a-z]+', str(name).lower())).strip()
+
+
+def _trigrams(key):
+    r""" The character trigrams of a normalized name, padded so that word starts and ends count. """
+    padded = ' %s ' % key
+    return [padded[i:i + 3] for i in range(len(padded) - 2)]
+
+
+class _NameIndex(object):
+    def __init__(self, records):
+        r""" Normalized STATION_NAMEs and OLD_LONG_NAMEs, with a unit-length trigram count vector for each, so that
+        a batch of names can be compared with all of them in one matrix product. """
+        self.keys = []
+        self.station_ids = []
+        self.names = []
+        self.exact = {}
+        for field in ('STATION_NAME', 'OLD_LONG_NAME'):
+            for record in records:
+                key = _normalize_name(record.get(field) or '')
+                if key and key not in self.exact:
+                    self.exact[key] = len(self.keys)
+                    self.keys.append(key)
+                    self.station_ids.append(str(record['STATION_ID']))
+                    self.names.append(record[field])
+        self.vocabulary = {}
+        for key in self.keys:
+            for trigram in _trigrams(key):
+                self.vocabulary.setdefault(trigram, len(self.vocabulary))
+        self.vectors = self._vectorize(self.keys)
+
+    def _vectorize(self, keys):
+        vectors = np.zeros((len(keys), len(self.vocabulary)), dtype='float32')
+        norms = np.zeros(len(keys), dtype='float32')
+        for i, key in enumerate(keys):
+            counts = collections.Counter(_trigrams(key))
+            for trigram, count in counts.items():
+                j = self.vocabulary.get(trigram)
+                if j is not None:
+                    vectors[i, j] = count
+            # trigrams missing from the vocabulary still count toward the length, and so lower the similarity
+            norms[i] = np.sqrt(sum(count * count for count in counts.values()))
+        return vectors / np.maximum(norms, 1)[:, None]
+
+    def candidates(self, keys, limit):
+        r""" Returns the positions of the limit most trigram-similar names for each key, one row per key. """
+        similarity = self._vectorize(keys).dot(self.vectors.T)
+        limit = min(limit, len(self.keys))
+        return np.argpartition(-similarity, limit - 1, axis=1)[:, :limit]
+
+
+class StationRegistry(object):
+    def __init__(self, awn, ttl=86400):
+        r""" Holds the metadata of every station, downloaded once with awn.metadata() and refreshed after ttl seconds.
+        Every AWN instance has one as AWN.stations.
+
+        Arguments:
+        ----------
+        awn: AWN, mandatory
+            The client used to download metadata.
+        ttl: float, optional
+            The number of seconds before the metadata is downloaded again. None keeps it until refresh() is called.
+
+        Returns:
+        --------
+            None.
+
+        Raises:
+        -------
+            None.
+        """
+
+        self.awn = awn
+        self.ttl = ttl
+        self.loaded_at = None
+        self._stations = {}
+        self._names = {}
+        self._old_names = {}
+        self._indexes = {}
+        self._lock = threading.Lock()
+
+    @property
+    def stale(self):
+        r""" True if the metadata has not been loaded yet or is older than ttl. """
+        if self.loaded_at is None:
+            return True
+        return self.ttl is not None and time.time() - self.loaded_at > self.ttl
+
+    def refresh(self, records=None):
+        r""" Rebuilds the registry from a list of metadata records, downloading them with metadata() if not given.
+
+        Raises:
+        -------
+            AWNPyError: if records are not given and awn is an AsyncAWN, which can't download them here.
+        """
+        if records is None:
+            records = self.awn.metadata()
+            if hasattr(records, '__await__'):
+                # an AsyncAWN: close the coroutine unawaited rather than leave it to warn
+                records.close()
+                raise AWNPyError('AsyncAWN.stations cannot download metadata by itself; '
+                                 'await refresh_stations() first')
+        stations = {}
+        names = {}
+        old_names = {}
+        for record in records:
+            station_id = str(record['STATION_ID'])
+            stations[station_id] = record
+            if record.get('STATION_NAME'):
+                names.setdefault(record['STATION_NAME'], station_id)
+            if record.get('OLD_LONG_NAME'):
+                old_names.setdefault(record['OLD_LONG_NAME'], station_id)
+        with self._lock:
+            self._stations, self._names, self._old_names, self._indexes = stations, names, old_names, {}
+            self.loaded_at = time.time()
+
+    def _current(self):
+        if self.stale:
+            self.refresh()
+        return self._stations
+
+    def __len__(self):
+        return len(self._current())
+
+    def __iter__(self):
+        return iter(list(self._current().values()))
+
+    def __contains__(self, station_id):
+        return str(station_id) in self._current()
+
+    def __getitem__(self, station_id):
+        return self._current()[str(station_id)]
+
+    def get(self, station_id, default=None):
+        r""" Returns the metadata record of a station ID, or default if there is no such station. """
+        return self._current().get(str(station_id), default)
+
+    def by_name(self, name, default=None):
+        r""" Returns the metadata record of the station with this STATION_NAME, or failing that this OLD_LONG_NAME. """
+        self._current()
+        station_id = self._names.get(name, self._old_names.get(name))
+        return self._stations[station_id] if station_id is not None else default
+
+    def station_id(self, name):
+        r""" Returns the STATION_ID of the station with this STATION_NAME or OLD_LONG_NAME.
+
+        Raises:
+        -------
+            ValueError if no station has that name.
+        """
+        record = self.by_name(name)
+        if record is None:
+            raise ValueError('STATION_NAME is not in list of AgWeatherNet stations')
+        return record['STATION_ID']
+
+    def _name_index(self):
+        r""" Returns the _NameIndex of the current metadata, building it on first use. """
+        stations = self._current()
+        with self._lock:
+            if _NameIndex not in self._indexes:
+                self._indexes[_NameIndex] = _NameIndex(sorted(stations.values(), key=lambda r: str(r['STATION_ID'])))
+            return self._indexes[_NameIndex]
+
+    def resolve(self, names, cutoff=0.75, candidates=5):
+        r""" Matches a list of station names to STATION_IDs, allowing for renamed stations (OLD_LONG_NAME), case,
+        punctuation and spacing differences, and typos. All names are resolved against the metadata held by the
+        registry, which is downloaded at most once.
+
+        Names are tried in turn as an exact STATION_NAME or OLD_LONG_NAME, then with case and punctuation ignored,
+        and then by fuzzy match: every remaining name is compared with every station name by trigram similarity in
+        one matrix product, and the closest few are scored with difflib.
+
+        Arguments:
+        ----------
+        names: list, mandatory
+            The names to resolve. Repeated names are only matched once.
+        cutoff: float, optional
+            The lowest fuzzy score, between 0 and 1, accepted as a match. Default is 0.75.
+        candidates: int, optional
+            How many of the most similar station names to score for each fuzzy match. Default is 5.
+
+        Returns:
+        --------
+            A list of NameMatch(name, station_id, matched, score) tuples in the order of names: the STATION_ID, the
+            station name it matched, and the score (1.0 for exact and case-insensitive matches). station_id and
+            matched are None, and score is the best score found, for names with no match at or above cutoff.
+
+        Raises:
+        -------
+            None.
+        """
+        index = self._name_index()
+        matches = {}
+        fuzzy = []
+        for name in collections.OrderedDict.fromkeys(names):
+            station_id = self._names.get(name, self._old_names.get(name))
+            if station_id is not None:
+                matches[name] = NameMatch(name, station_id, name, 1.0)
+                continue
+            key = _normalize_name(name)
+            if key in index.exact:
+                i = index.exact[key]
+                matches[name] = NameMatch(name, index.station_ids[i], index.names[i], 1.0)
+            else:
+                fuzzy.append((name, key))
+
+        if fuzzy and index.keys:
+            best = index.candidates([key for _, key in fuzzy], candidates)
+            for (name, key), row in zip(fuzzy, best):
+                matcher = difflib.SequenceMatcher(None, '', key)
+                score, i = 0., None
+                for j in row:
+                    matcher.set_seq1(index.keys[j])
+                    ratio = matcher.ratio()
+                    if ratio > score:
+                        score, i = ratio, j
+                if score >= cutoff:
+                    matches[name] = NameMatch(name, index.station_ids[i], index.names[i], score)
+                else:
+                    matches[name] = NameMatch(name, None, None, score)
+        for name, _ in fuzzy:
+            matches.setdefault(name, NameMatch(name, None, None, 0.))
+        return [matches[name] for name in names]
+
+    def _index(self, field):
+        r""" Returns a dictionary from each value of a metadata field to the set of station IDs that have it. """
+        stations = self._current()
+        with self._lock:
+            if field not in self._indexes:
+                index = {}
+                for station_id, record in stations.items():
+                    index.setdefault(str(record.get(field)), set()).add(station_id)
+                self._indexes[field] = index
+            return self._indexes[field]
+
+    def filter(self, **criteria):
+        r""" Returns the metadata records of the stations matching every criterion, in station ID order.
+
+        Arguments:
+        ----------
+        Any metadata field, e.g. COUNTY='King', TIER=1, ACTIVE_STATION='Y' or LW_UNITIY='Y'. A list or tuple matches
+        any of its values.
+
+        Returns:
+        --------
+            A list of metadata records.
+        """
+        matches = set(self._current())
+        for field, values in criteria.items():
+            if not isinstance(values, (list, tuple, set)):
+                values = [values]
+            index = self._index(field)
+            matches &= set().union(*[index.get(str(value), set()) for value in values])
+        return [self._stations[station_id] for station_id in sorted(matches)]
+
+    def to_dataframe(self):
+        r""" Returns the registry as a pandas dataframe, the same as metadata(return_dataframe=True). """
+        return pd.DataFrame.from_dict(list(self))
+
+
+# ==================================================================================================================== #
+# StationLocator class                                                                                                 #
+# Type: Metadata                                                                                                       #
+# Description: Answers stationlocator() queries from station coordinates held in memory, for one point or for arrays  #
+#              of many points at once.                                                                                 #
+# ==================================================================================================================== #
+
+
+class StationLocator(object):
+    earth_radius_miles = 3958.8
+
+    def __init__(self, records, block_size=8192):
+        r""" A nearest-station index over metadata records. Stations are stored as unit vectors so that the nearest
+        stations to a block of points are found with one matrix product; distances are great circle miles.
+
+        Arguments:
+        ----------
+        records: list, mandatory
+            Station metadata records with LATITUDE_DEGREE and LONGITUDE_DEGREE. Records without coordinates are left
+            out.
+        block_size: int, optional
+            The number of query points handled per matrix product, which bounds memory use for large queries.
+
+        Returns:
+        --------
+            None.
+
+        Raises:
+        -------
+            None.
+        """
+
+        self.records = []
+        coordinates = []
+        for record in records:
+            try:
+                coordinates.append((float(record['LATITUDE_DEGREE']), float(record['LONGITUDE_DEGREE'])))
+            except (KeyError, TypeError, ValueError):
+                continue
+            self.records.append(record)
+        self.block_size = block_size
+        self.station_ids = np.array([record['STATION_ID'] for record in self.records], dtype=object)
+        self._by_id = dict((record['STATION_ID'], record) for record in self.records)
+        coordinates = np.array(coordinates, dtype=float).reshape(-1, 2)
+        self._vectors = self._unit_vectors(coordinates[:, 0], coordinates[:, 1])
+
+    @staticmethod
+    def _unit_vectors(latitudes, longitudes):
+        latitudes = np.radians(np.asarray(latitudes, dtype=float))
+        longitudes = np.radians(np.asarray(longitudes, dtype=float))
+        cos_lat = np.cos(latitudes)
+        return np.stack([cos_lat * np.cos(longitudes), cos_lat * np.sin(longitudes), np.sin(latitudes)], axis=-1)
+
+    def query(self, latitudes, longitudes, QTY=10, MAX_MILES=None):
+        r""" Finds the nearest stations to each of many points.
+
+        Arguments:
+        ----------
+        latitudes: array-like, mandatory
+            Latitudes of the query points, in degrees.
+        longitudes: array-like, mandatory
+            Longitudes of the query points, in degrees.
+        QTY: int, optional
+            The number of stations to return per point. Default is 10.
+        MAX_MILES: float, optional
+            If specified, QTY is ignored and every station within this many miles is returned.
+
+        Returns:
+        --------
+            (station_ids, distances): arrays of shape (number of points, number of stations returned), nearest first.
+            When MAX_MILES is given, entries beyond it have a station ID of None and a distance of inf.
+        """
+        points = self._unit_vectors(np.ravel(latitudes), np.ravel(longitudes))
+        num_stations = len(self.records)
+        qty = num_stations if MAX_MILES is not None else min(int(QTY), num_stations)
+        indices = np.empty((len(points), qty), dtype=np.intp)
+        distances = np.empty((len(points), qty), dtype=float)
+
+        for start in range(0, len(points), self.block_size):
+            # the largest dot products are the smallest angles
+            dots = np.dot(points[start:start + self.block_size], self._vectors.T)
+            if qty <= 4 and qty < num_stations:
+                # for the usual handful of stations repeated argmax is several times faster than argpartition
+                work = dots.copy() if qty > 1 else dots
+                rows = np.arange(len(dots))
+                nearest = np.empty((len(dots), qty), dtype=np.intp)
+                for k in range(qty):
+                    nearest[:, k] = work.argmax(axis=1)
+                    if k < qty - 1:
+                        work[rows, nearest[:, k]] = -np.inf
+                dots = np.take_along_axis(dots, nearest, axis=1)
+            elif qty < num_stations:
+                nearest = np.argpartition(-dots, qty - 1, axis=1)[:, :qty]
+                dots = np.take_along_axis(dots, nearest, axis=1)
+            else:
+                nearest = np.broadcast_to(np.arange(num_stations), dots.shape)
+            order = np.argsort(-dots, axis=1)
+            indices[start:start + self.block_size] = np.take_along_axis(nearest, order, axis=1)
+            # chord length to great circle distance, which is accurate for nearby points unlike arccos
+            chords = np.sqrt(np.clip(2. - 2. * np.take_along_axis(dots, order, axis=1), 0., 4.))
+            distances[start:start + self.block_size] = 2. * self.earth_radius_miles * np.arcsin(chords / 2.)
+
+        station_ids = self.station_ids[indices]
+        if MAX_MILES is not None:
+            outside = distances > float(MAX_MILES)
+            station_ids[outside] = None
+            distances[outside] = np.inf
+        return station_ids, distances
+
+    def nearest(self, LATITUDE, LONGITUDE, QTY=10, MAX_MILES=None):
+        r""" Returns the nearest stations to one point as a list of dicts with the same fields as stationlocator():
+        STATION_ID, STATION_NAME, DISTANCE (miles), LATITUDE, LONGITUDE and ELEVATION. See query() for arguments. """
+        station_ids, distances = self.query([float(LATITUDE)], [float(LONGITUDE)], QTY=QTY, MAX_MILES=MAX_MILES)
+        stations = []
+        for station_id, distance in zip(station_ids[0], distances[0]):
+            if station_id is None:
+                break
+            record = self._by_id[station_id]
+            stations.append({'STATION_ID': station_id, 'STATION_NAME': record.get('STATION_NAME'),
+                             'DISTANCE': float(distance), 'LATITUDE': record.get('LATITUDE_DEGREE'),
+                             'LONGITUDE': record.get('LONGITUDE_DEGREE'), 'ELEVATION': record.get('ELEVATION_FEET')})
+        return stations
+
+
+# ==================================================================================================================== #
+# Incremental sync classes                                                                                             #
+# Type: Storage                                                                                                        #
+# Description: StationSync keeps a local copy of station data up to date by asking the API only for records newer     #
+#              than the last one it stored. Where the data and the watermarks live is up to the FrameStore and         #
+#              WatermarkStore objects it is given.                                                                     #
+# ==================================================================================================================== #
+
+
+class WatermarkStore(object):
+    def __init__(self, path=None):
+        r""" Remembers the last timestamp stored for each station and basis. If path is given the watermarks are kept
+        in that JSON file, so that they last between runs; otherwise they are only kept in memory.
+
+        Arguments:
+        ----------
+        path: string, optional
+            The JSON file to load watermarks from and save them to.
+
+        Returns:
+        --------
+            None.
+
+        Raises:
+        -------
+            None.
+        """
+
+        self.path = os.path.expanduser(path) if path else None
+        self._lock = threading.Lock()
+        self._marks = {}
+        if self.path and os.path.exists(self.path):
+            with open(self.path) as f:
+                self._marks = json.load(f)
+
+    @staticmethod
+    def _key(station_id, basis):
+        return '%s/%s' % (station_id, basis)
+
+    def get(self, station_id, basis):
+        r""" Returns the watermark of a station and basis as a datetime, or None if nothing has been stored. """
+        mark = self._marks.get(self._key(station_id, basis))
+        return datetime.datetime.strptime(mark, '%Y-%m-%d %H:%M:%S') if mark else None
+
+    def set(self, station_id, basis, timestamp):
+        with self._lock:
+            self._marks[self._key(station_id, basis)] = timestamp.strftime('%Y-%m-%d %H:%M:%S')
+
+    def save(self):
+        r""" Writes the watermarks to path, if there is one. """
+        if not self.path:
+            return
+        with self._lock:
+            tmp_path = _tmp_path(self.path)
+            with open(tmp_path, 'w') as f:
+                json.dump(self._marks, f, indent=1, sort_keys=True)
+            os.replace(tmp_path, self.path)
+
+
+class FrameStore(object):
+    r""" Interface for where StationSync keeps station data. Subclasses must implement read() and merge(). """
+
+    def read(self, station_id, basis):
+        r""" Returns the stored dataframe of a station and basis, or None if there is none. """
+        raise NotImplementedError
+
+    def merge(self, station_id, basis, df):
+        r""" Adds the rows of df to what is stored for a station and basis, replacing rows with the same timestamp.
+        Returns the number of rows whose timestamps were not stored before. """
+        raise NotImplementedError
+
+    @staticmethod
+    def _merge_frames(stored, df):
+        r""" Merges df into stored and returns (merged dataframe, number of new rows). """
+        if stored is None or stored.empty:
+            merged = df[~df.index.duplicated(keep='last')].sort_index()
+            return merged, len(merged)
+        new_rows = int((~df.index.isin(stored.index)).sum())
+        merged = pd.concat([stored, df])
+        merged = merged[~merged.index.duplicated(keep='last')]
+        if not merged.index.is_monotonic_increasing:
+            merged = merged.sort_index()
+        return merged, new_rows
+
+
+class MemoryFrameStore(FrameStore):
+    r""" A FrameStore that keeps dataframes in a dictionary. """
+
+    def __init__(self):
+        self.frames = {}
+        self._lock = threading.Lock()
+
+    def read(self, station_id, basis):
+        return self.frames.get((str(station_id), basis))
+
+    def merge(self, station_id, basis, df):
+        with self._lock:
+            key = (str(station_id), basis)
+            self.frames[key], new_rows = self._merge_frames(self.frames.get(key), df)
+        return new_rows
+
+
+class PickleFrameStore(FrameStore):
+    def __init__(self, directory):
+        r""" A FrameStore that keeps one pickled dataframe per station and basis in a directory.
+
+        Arguments:
+        ----------
+        directory: string, mandatory
+            The directory to keep the files in. It is created if it does not exist.
+
+        Returns:
+        --------
+            None.
+
+        Raises:
+        -------
+            None.
+        """
+
+        self.directory = os.path.expanduser(directory)
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+
+    def _path(self, station_id, basis):
+        return os.path.join(self.directory, '%s_%s.pkl' % (station_id, basis))
+
+    def read(self, station_id, basis):
+        path = self._path(station_id, basis)
+        return pd.read_pickle(path) if os.path.exists(path) else None
+
+    def merge(self, station_id, basis, df):
+        merged, new_rows = self._merge_frames(self.read(station_id, basis), df)
+        path = self._path(station_id, basis)
+        tmp_path = _tmp_path(path)
+        merged.to_pickle(tmp_path, compression=None)
+        os.replace(tmp_path, path)
+        return new_rows
+
+
+class StationSync(object):
+    def __init__(self, awn, store=None, watermarks=None, initial_start=datetime.timedelta(days=7), max_workers=8):
+        r""" Brings a FrameStore up to date with the API. Each sync() requests every station from its watermark (the
+        last timestamp stored for it) onward, merges the rows into the store and moves the watermark forward, so that
+        repeated syncs only download what is new.
+
+        Arguments:
+        ----------
+        awn: AWN, mandatory
+            The client used to request station data.
+        store: FrameStore, optional
+            Where the data is kept. Defaults to a new MemoryFrameStore.
+        watermarks: WatermarkStore, optional
+            Where the watermarks are kept. Defaults to a new in-memory WatermarkStore.
+        initial_start: datetime or timedelta, optional
+            Where to start stations that have no watermark yet: a datetime, or a timedelta before the END of the sync.
+            Default is 7 days.
+        max_workers: int, optional
+            The maximum number of stations requested at once. Default is 8.
+
+        Returns:
+        --------
+            None.
+
+        Raises:
+        -------
+            None.
+        """
+
+        self.awn = awn
+        self.store = store if store is not None else MemoryFrameStore()
+        self.watermarks = watermarks if watermarks is not None else WatermarkStore()
+        self.initial_start = initial_start
+        self.max_workers = max_workers
+
+    def _start(self, station_id, basis, end):
+        start = self.watermarks.get(station_id, basis)
+        if start is not None:
+            # the record at the watermark is requested again; merging it is a no-op
+            return start
+        if isinstance(self.initial_start, datetime.timedelta):
+            return end - self.initial_start
+        return self.initial_start
+
+    def sync_station(self, station_id, basis='15MIN', END=None):
+        r""" Syncs one station and returns the number of new rows stored. See sync(). """
+        end = END if END is not None else _api_now()
+        kwargs = {'STATION_ID': station_id, 'START': self._start(station_id, basis, end), 'END': end}
+        if basis == 'DAILY':
+            kwargs['BASIS'] = 'DAILY'
+        try:
+            df = self.awn.stationdata(return_dataframe=True, **kwargs)
+        except AWNPyNoResultsError:
+            return 0
+        if isinstance(df, dict):
+            df = df.get(int(station_id), pd.DataFrame())
+        if df.empty:
+            return 0
+        new_rows = self.store.merge(station_id, basis, df)
+        watermark = self.watermarks.get(station_id, basis)
+        latest = df.index.max().to_pydatetime()
+        if watermark is None or latest > watermark:
+            self.watermarks.set(station_id, basis, latest)
+        return new_rows
+
+    def sync(self, station_ids, basis='15MIN', END=None, raise_on_error=True):
+        r""" Syncs a list of stations, requesting them concurrently, and saves the watermarks.
+
+        Arguments:
+        ----------
+        station_ids: list, mandatory
+            The STATION_ID of each station to sync.
+        basis: string, optional
+            '15MIN' (default) for 15 minute data or 'DAILY' for daily data. Each basis has its own watermarks.
+        END: datetime, optional
+            The end of the range to sync, in PST. Defaults to now.
+        raise_on_error: bool, optional
+            If true (default), raise AWNPyBatchError if any station could not be synced. Stations that did sync keep
+            their new rows and watermarks either way.
 
-import json
-import datetime
-import pandas as pd
-import pdb
+        Returns:
+        --------
+            A dictionary of the number of new rows stored, labeled by station ID.
 
-import os, ssl
-if (not os.environ.get('PYTHONHTTPSVERIFY', '') and getattr(ssl, '_create_unverified_context', None)):
-    ssl._create_default_https_context = ssl._create_unverified_context
+        Raises:
+        -------
+            AWNPyBatchError: if any station failed and raise_on_error is true. Its results attribute holds the new row
+            counts of the stations that synced and its errors attribute maps each failed station ID to its exception.
+        """
+        if basis not in ('15MIN', 'DAILY'):
+            raise ValueError("Invalid basis. Must be '15MIN' or 'DAILY'")
+        end = END if END is not None else _api_now()
+        results, errors = _map_concurrently(lambda station_id: self.sync_station(station_id, basis, end),
+                                            station_ids, self.max_workers)
+        self.watermarks.save()
+        counts = dict((station_id, results[station_id]) for station_id in station_ids if station_id in results)
+        if errors and raise_on_error:
+            raise AWNPyBatchError('%d of %d stations failed to sync: %s' % (len(errors), len(station_ids),
+                                                                            ', '.join(str(k) for k in errors)),
+                                  counts, errors)
+        return counts
 
 
 # ==================================================================================================================== #
-# AWNPyError class                                                                                                    #
-# Type: Exception                                                                                                      #
-# Description: This class is simply the means for error handling when an exception is raised.                          #
+# StationArchive class                                                                                                 #
+# Type: Storage                                                                                                        #
+# Description: A columnar copy of station data on disk (Parquet or Feather, through pandas and pyarrow), partitioned  #
+#              by basis, station, year and month, that answers stationdata() queries locally.                          #
 # ==================================================================================================================== #
 
 
-class AWNPyError(Exception):
-    def __init__(self, error_message):
-        self.error_message = error_message
+def _merge_intervals(intervals):
+    r""" Sorts (start, end) intervals and joins the ones that overlap or touch. """
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def _subtract_intervals(start, end, covered):
+    r""" Returns the parts of the interval start to end that are not in the sorted, merged covered intervals. """
+    missing = []
+    for covered_start, covered_end in covered:
+        if covered_end < start or covered_start > end:
+            continue
+        if covered_start > start:
+            missing.append((start, covered_start))
+        start = max(start, covered_end)
+        if start >= end:
+            return missing
+    if start < end:
+        missing.append((start, end))
+    return missing
+
+
+class StationArchive(FrameStore):
+    _formats = {'parquet': '.parquet', 'feather': '.feather'}
+
+    def __init__(self, directory, awn=None, file_format='parquet'):
+        r""" An on-disk archive of station data, kept as one Parquet or Feather file per basis, station, year and
+        month (basis/STATION_ID/year/month). A manifest records which time ranges of each station are covered, so that
+        stationdata() can answer queries from the files and ask the API only for the ranges it does not have. The
+        archive is also a FrameStore, so it can be kept up to date with StationSync. Needs pyarrow installed.
+
+        Arguments:
+        ----------
+        directory: string, mandatory
+            The directory to keep the archive in. It is created if it does not exist.
+        awn: AWN, optional
+            The client used to fetch ranges that are not in the archive. If not given, only archived data is returned.
+        file_format: string, optional
+            'parquet' (default) or 'feather'.
+
+        Returns:
+        --------
+            None.
+
+        Raises:
+        -------
+            ValueError: if file_format is not supported.
+        """
+
+        if file_format not in self._formats:
+            raise ValueError("Invalid file_format. Must be 'parquet' or 'feather'")
+        self.directory = os.path.expanduser(directory)
+        self.awn = awn
+        self.file_format = file_format
+        self._lock = threading.RLock()
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        self._manifest_path = os.path.join(self.directory, 'manifest.json')
+        self._coverage = {}
+        if os.path.exists(self._manifest_path):
+            with open(self._manifest_path) as f:
+                for key, intervals in json.load(f).items():
+                    self._coverage[key] = [tuple(datetime.datetime.strptime(t, '%Y-%m-%d %H:%M:%S')
+                                                 for t in interval) for interval in intervals]
+
+    @staticmethod
+    def _time_field(basis):
+        return 'JULDATE_PST' if basis == 'DAILY' else 'TIMESTAMP_PST'
+
+    def _path(self, station_id, basis, year, month):
+        return os.path.join(self.directory, basis, str(station_id), '%04d' % year,
+                            '%02d%s' % (month, self._formats[self.file_format]))
+
+    def _read_file(self, path, basis, columns=None):
+        time_field = self._time_field(basis)
+        if columns is not None:
+            columns = [time_field] + [column for column in columns if column != time_field]
+        if self.file_format == 'parquet':
+            df = pd.read_parquet(path, columns=columns)
+        else:
+            df = pd.read_feather(path, columns=columns)
+        return df.set_index(time_field)
+
+    def _write_file(self, path, df):
+        directory = os.path.dirname(path)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        tmp_path = _tmp_path(path)
+        if self.file_format == 'parquet':
+            df.reset_index().to_parquet(tmp_path, index=False)
+        else:
+            df.reset_index().to_feather(tmp_path)
+        os.replace(tmp_path, path)
+
+    def _save_manifest(self):
+        manifest = dict((key, [[t.strftime('%Y-%m-%d %H:%M:%S') for t in interval] for interval in intervals])
+                        for key, intervals in self._coverage.items())
+        tmp_path = _tmp_path(self._manifest_path)
+        with open(tmp_path, 'w') as f:
+            json.dump(manifest, f, indent=1, sort_keys=True)
+        os.replace(tmp_path, self._manifest_path)
+
+    def coverage(self, station_id, basis='15MIN'):
+        r""" Returns the (start, end) ranges of a station that are in the archive, in order. """
+        return list(self._coverage.get('%s/%s' % (station_id, basis), []))
+
+    def missing(self, station_id, START, END, basis='15MIN'):
+        r""" Returns the (start, end) ranges between START and END that are not in the archive. """
+        return _subtract_intervals(START, END, self.coverage(station_id, basis))
+
+    def write(self, station_id, df, basis='15MIN', START=None, END=None):
+        r""" Adds station data to the archive, replacing archived rows with the same timestamp.
+
+        Arguments:
+        ----------
+        station_id: string, mandatory
+            The STATION_ID the data belongs to.
+        df: pandas dataframe, mandatory
+            Station data in PST, as returned by stationdata(return_dataframe=True).
+        basis: string, optional
+            '15MIN' (default) or 'DAILY'.
+        START: datetime, optional
+            The start of the range df is complete for, which is marked as covered. Defaults to its first timestamp.
+        END: datetime, optional
+            The end of the range df is complete for. Defaults to its last timestamp.
+
+        Returns:
+        --------
+            The number of rows whose timestamps were not archived before.
+
+        Raises:
+        -------
+            None.
+        """
+        with self._lock:
+            new_rows = self._store(station_id, df, basis)
+            start = START if START is not None else (df.index.min().to_pydatetime() if len(df) else None)
+            end = END if END is not None else (df.index.max().to_pydatetime() if len(df) else None)
+            if start is not None and end is not None:
+                self._cover(station_id, basis, start, end)
+        return new_rows
+
+    def _store(self, station_id, df, basis):
+        r""" Merges df into the monthly files of a station and returns the number of new rows. """
+        new_rows = 0
+        if not len(df):
+            return new_rows
+        df = df.copy()
+        df.index.name = self._time_field(basis)
+        for (year, month), part in df.groupby([df.index.year, df.index.month]):
+            path = self._path(station_id, basis, year, month)
+            stored = self._read_file(path, basis) if os.path.exists(path) else None
+            merged, part_new_rows = self._merge_frames(stored, part)
+            self._write_file(path, merged)
+            new_rows += part_new_rows
+        return new_rows
+
+    def _cover(self, station_id, basis, start, end):
+        r""" Marks start to end of a station as archived and saves the manifest. """
+        key = '%s/%s' % (station_id, basis)
+        self._coverage[key] = _merge_intervals(self._coverage.get(key, []) + [(start, end)])
+        self._save_manifest()
+
+    def read(self, station_id, basis='15MIN', START=None, END=None, columns=None):
+        r""" Returns archived data of a station as a dataframe, reading only the months between START and END and
+        only the given columns. Returns None if nothing is archived in the range. """
+        station_directory = os.path.join(self.directory, basis, str(station_id))
+        paths = []
+        for year in sorted(os.listdir(station_directory)) if os.path.isdir(station_directory) else []:
+            if (START is not None and int(year) < START.year) or (END is not None and int(year) > END.year):
+                continue
+            for name in sorted(os.listdir(os.path.join(station_directory, year))):
+                if not name.endswith(self._formats[self.file_format]):
+                    continue
+                month = (int(year), int(name[:2]))
+                if (START is not None and month < (START.year, START.month)) or \
+                        (END is not None and month > (END.year, END.month)):
+                    continue
+                paths.append(os.path.join(station_directory, year, name))
+        if not paths:
+            return None
+        parts = [self._read_file(path, basis, columns) for path in paths]
+        df = pd.concat(parts) if len(parts) > 1 else parts[0]
+        if START is not None:
+            df = df[df.index >= START]
+        if END is not None:
+            df = df[df.index <= END]
+        return df
+
+    def merge(self, station_id, basis, df):
+        return self.write(station_id, df, basis)
+
+    def stationdata(self, STATION_ID, START, END, BASIS=None, columns=None):
+        r""" Answers a stationdata(return_dataframe=True) query for one station from the archive. Ranges that are not
+        archived are fetched with the awn client (if there is one) and archived first; ranges newer than the client's
+        immutable_after are fetched again each time, since the API may still fill them in.
+
+        Arguments:
+        ----------
+        STATION_ID: string, mandatory
+            The station to return.
+        START: datetime, mandatory
+            See AWN.stationdata(). Times are PST.
+        END: datetime, mandatory
+            See AWN.stationdata().
+        BASIS: string, optional
+            See AWN.stationdata().
+        columns: list, optional
+            The sensor columns to return. Default is all of them.
+
+        Returns:
+        --------
+            A pandas dataframe indexed by TIMESTAMP_PST (JULDATE_PST for daily data).
+
+        Raises:
+        -------
+            AWNPyNoResultsError: if there is no data in the range.
+            AWNPyError: if fetching a missing range fails.
+        """
+        basis = 'DAILY' if BASIS == 'DAILY' else '15MIN'
+        if basis == 'DAILY':
+            START = datetime.datetime.combine(START, datetime.time())
+            END = datetime.datetime.combine(END, datetime.time())
+        if self.awn is not None:
+            cutoff = END
+            if self.awn.immutable_after is not None:
+                cutoff = min(END, _api_now() - self.awn.immutable_after)
+            for start, end in self.missing(STATION_ID, START, END, basis):
+                kwargs = {'STATION_ID': STATION_ID, 'START': start, 'END': end}
+                if basis == 'DAILY':
+                    kwargs['BASIS'] = 'DAILY'
+                try:
+                    df = self.awn.stationdata(return_dataframe=True, **kwargs)
+                except AWNPyNoResultsError:
+                    df = pd.DataFrame()
+                if isinstance(df, dict):
+                    df = df.get(int(STATION_ID), pd.DataFrame())
+                with self._lock:
+                    self._store(STATION_ID, df, basis)
+                    # only the part of the range old enough not to change is marked as covered
+                    if start < cutoff:
+                        self._cover(STATION_ID, basis, start, min(end, cutoff))
+        df = self.read(STATION_ID, basis, START, END, columns)
+        if df is None or df.empty:
+            raise AWNPyNoResultsError('No results were found matching your query. Try for a different START and END '
+                                      'range.')
+        return df
+
+
+# ==================================================================================================================== #
+# Array export                                                                                                         #
+# Type: Storage                                                                                                        #
+# Description: Reading back the station x time x variable arrays written by AWN.export_array().                       #
+# ==================================================================================================================== #
+
+
+def load_station_array(directory, mmap_mode='r'):
+    r""" Opens an array written by AWN.export_array() without reading it into memory. Slices of the array are read
+    from the file as they are used.
+
+    Arguments:
+    ----------
+    directory: string, mandatory
+        The directory the array was exported to.
+    mmap_mode: string, optional
+        Passed to numpy.load(). Default is 'r' (read only); use 'r+' to modify the file in place.
+
+    Returns:
+    --------
+        (array, coords): the float32 numpy memmap of shape (station, time, variable), and a dictionary with its
+        coordinates: station_ids, variables, times (a pandas DatetimeIndex in PST) and the latitude, longitude,
+        elevation and station_name of each station.
+
+    Raises:
+    -------
+        None.
+    """
+    directory = os.path.expanduser(directory)
+    array = np.load(os.path.join(directory, 'data.npy'), mmap_mode=mmap_mode)
+    with open(os.path.join(directory, 'coords.json')) as f:
+        coords = json.load(f)
+    coords['times'] = pd.date_range(coords['start'], periods=coords['periods'], freq=coords['freq'],
+                                    name=coords['time_field'])
+    return array, coords
+
+
+# ==================================================================================================================== #
+# StationColumns class                                                                                                 #
+# Type: Data                                                                                                           #
+# Description: A compact, column-oriented copy of one station's stationdata response, returned by                    #
+#              stationdata(return_compact=True) instead of a list of record dictionaries.                              #
+# ==================================================================================================================== #
+
+
+def _batch_to_columns(records, dtype):
+    r""" Converts a batch of DATA records to (time_field, times as int64 nanoseconds, columns, values). """
+    time_field, times, columns, values = _records_to_arrays(records, dtype)
+    times = np.asarray(_parse_times(times, time_field).values.astype('datetime64[ns]')).view('int64')
+    return time_field, times, columns, values
+
+
+def _join_columns(parts, dtype):
+    r""" Joins (time_field, times, columns, values) parts into one, sorted by time and keeping the last record of
+    each time. Returns None if there are no parts. """
+    parts = [part for part in parts if len(part[1])]
+    if not parts:
+        return None
+    time_field = parts[0][0]
+    columns = list(parts[0][2])
+    for part in parts[1:]:
+        columns.extend(column for column in part[2] if column not in columns)
+    blocks = []
+    for _, _, part_columns, values in parts:
+        if part_columns != columns:
+            block = np.full((len(values), len(columns)), np.nan, dtype=dtype)
+            block[:, [columns.index(column) for column in part_columns]] = values
+            values = block
+        blocks.append(values)
+    times = np.concatenate([part[1] for part in parts]) if len(parts) > 1 else parts[0][1]
+    values = np.concatenate(blocks) if len(blocks) > 1 else blocks[0]
+    if len(times) > 1 and not (times[1:] > times[:-1]).all():
+        order = np.argsort(times, kind='stable')
+        times = times[order]
+        values = values[order]
+        keep = np.append(times[1:] != times[:-1], True)
+        times = times[keep]
+        values = values[keep]
+    return time_field, times, columns, values
+
+
+class StationColumns(object):
+    def __init__(self, station, time_field, times, columns, values):
+        r""" One station's data as a time array and a 2D value array, with the station metadata held once. Values
+        can be read by field name like a record dictionary's, and to_dataframe() wraps the arrays without copying
+        them.
+
+        Arguments:
+        ----------
+        station: dict, mandatory
+            The station's fields from the response, other than DATA.
+        time_field: string, mandatory
+            TIMESTAMP_PST, or JULDATE_PST for daily data.
+        times: numpy array, mandatory
+            The time of each record as int64 nanoseconds since 1970-01-01 00:00, in PST (UTC-8).
+        columns: list, mandatory
+            The sensor field names.
+        values: numpy array, mandatory
+            The sensor values, one row per record and one column per field. Values that are not numbers are NaN.
+
+        Returns:
+        --------
+            None.
+
+        Raises:
+        -------
+            None.
+        """
+
+        self.station = station
+        self.time_field = time_field
+        self.times = times
+        self.columns = list(columns)
+        self.values = values
+        self._positions = dict((column, j) for j, column in enumerate(self.columns))
+
+    @property
+    def station_id(self):
+        return int(self.station['STATION_ID'])
+
+    @property
+    def nbytes(self):
+        r""" The memory held by the time and value arrays, in bytes. """
+        return self.times.nbytes + self.values.nbytes
+
+    def __len__(self):
+        return len(self.times)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __contains__(self, field):
+        return field == self.time_field or field in self._positions
+
+    def __getitem__(self, field):
+        r""" Returns the values of a field as an array (a view, not a copy). The time field is returned as
+        datetime64[ns]. """
+        if field == self.time_field:
+            return self.times.view('datetime64[ns]')
+        return self.values[:, self._positions[field]]
+
+    def get(self, field, default=None):
+        return self[field] if field in self else default
+
+    def keys(self):
+        return [self.time_field] + self.columns
+
+    def record(self, i):
+        r""" Returns record i as a dictionary of field name to value. """
+        record = dict(zip(self.columns, self.values[i].tolist()))
+        record[self.time_field] = self.times[i].view('datetime64[ns]')
+        return record
+
+    def to_dataframe(self, return_timezone='PST'):
+        r""" Returns the data as a pandas dataframe like stationdata(return_dataframe=True) returns, sharing memory
+        with the value array. """
+        index = pd.DatetimeIndex(self.times.view('datetime64[ns]'), name=self.time_field)
+        index = _convert_timezone(index, self.time_field, return_timezone)
+        return pd.DataFrame(self.values, index=index, columns=self.columns, copy=False)
+
+
+# ==================================================================================================================== #
+# Process pool conversion                                                                                              #
+# Type: Data                                                                                                           #
+# Description: Converts the stations of a large stationdata response to arrays in parallel worker processes. Workers  #
+#              are forked after the response is parsed, so they read the records from the parent's memory instead of #
+#              having them pickled, and write the numbers into a shared anonymous memory map per station, which the   #
+#              parent's arrays then use in place; only column names cross the pipe. Forking is only done from the     #
+#              main thread of a process with no other threads, since a child forked while another thread holds a     #
+#              lock can deadlock.                                                                                      #
+# ==================================================================================================================== #
+
+
+# (message, buffers, shapes, dtype) for the workers of the conversion in progress, inherited when they fork
+_FORK_STATE = None
+_FORK_LOCK = threading.Lock()
+
+
+def _can_fork():
+    r""" True if worker processes can be forked safely: on a POSIX system (not Windows), from the main thread, with
+    no other threads running. """
+    if not hasattr(os, 'fork') or threading.active_count() > 1:
+        return False
+    if threading.current_thread() is not threading.main_thread():
+        return False
+    return 'fork' in importlib.import_module('multiprocessing').get_all_start_methods()
+
+
+def _convert_forked(i):
+    r""" Converts station i of the forked message, writing its times and values into its shared buffer when they
+    fit the space reserved for them. Returns (time_field, columns, times, values); times and values are None when
+    they were written to the buffer. """
+    message, buffers, shapes, dtype = _FORK_STATE
+    rows, width = shapes[i]
+    if not rows:
+        return None, [], np.empty(0, dtype='int64'), None
+    time_field, times, columns, values = _batch_to_columns(message[i]['DATA'], dtype)
+    if values.shape != (rows, width):
+        # records with differing fields: send the arrays back the ordinary way
+        return time_field, columns, times, values
+    np.ndarray(rows, dtype='int64', buffer=buffers[i])[:] = times
+    np.ndarray((rows, width), dtype=dtype, buffer=buffers[i], offset=8 * rows)[:] = values
+    return time_field, columns, None, None
 
-    def __str__(self):
-        r""" This just returns one of the error messages listed in the checkresponse() function"""
-        return repr(self.error_message)
+
+def _process_count(processes, num_stations):
+    r""" The number of worker processes worth starting: no more than there are stations or CPUs. """
+    return min(processes, num_stations, os.cpu_count() or 1)
+
+
+def _convert_in_processes(message, dtype, processes):
+    r""" Converts every station of a stationdata message to (time_field, times, columns, values) arrays, using up to
+    processes forked workers. Call it only when _can_fork() is true. The times and values of each station are views
+    of that station's shared memory map, which stays mapped for as long as they are in use. """
+    global _FORK_STATE
+    itemsize = np.dtype(dtype).itemsize
+    shapes = []
+    buffers = []
+    for station in message:
+        rows = len(station['DATA'])
+        width = len(station['DATA'][0]) - 1 if rows else 0
+        shapes.append((rows, width))
+        # an anonymous map is shared with the children forked from this process
+        buffers.append(mmap.mmap(-1, max(8 * rows + itemsize * rows * width, 1)))
+    with _FORK_LOCK:
+        _FORK_STATE = (message, buffers, shapes, dtype)
+        try:
+            # imported here: multiprocessing would add to the import time of AWNPy
+            context = importlib.import_module('multiprocessing').get_context('fork')
+            executor_class = importlib.import_module('concurrent.futures.process').ProcessPoolExecutor
+            workers = _process_count(processes, len(message))
+            with executor_class(workers, mp_context=context) as executor:
+                results = list(executor.map(_convert_forked, range(len(message)),
+                                            chunksize=max(1, len(message) // (4 * workers))))
+        finally:
+            _FORK_STATE = None
+    converted = []
+    for (time_field, columns, times, values), (rows, width), buffer in zip(results, shapes, buffers):
+        if times is None:
+            times = np.frombuffer(buffer, dtype='int64', count=rows)
+            values = np.frombuffer(buffer, dtype=dtype, count=rows * width, offset=8 * rows).reshape(rows, width)
+        else:
+            buffer.close()
+        converted.append((time_field, times, columns, values))
+    return converted
+
+
+# ==================================================================================================================== #
+# Aggregation                                                                                                          #
+# Type: Data                                                                                                           #
+# Description: Resamples 15 minute station data to hourly, daily or other fixed-length bins, and accumulates growing  #
+#              degree days. All stations are reduced together: their records are laid end to end, ordered by station  #
+#              and bin, and each aggregate is a single numpy reduceat over the bin boundaries.                         #
+# ==================================================================================================================== #
+
+
+# aggregate_stationdata() uses 'mean' for variables not listed here
+AGGREGATIONS = {
+    'P_INCHES': 'sum',
+    'WS_MAX_MPH': 'max',
+    'WD_DEGREE': 'circmean',
+    'LW_UNITIY': 'wet_hours',
+}
+
+
+def _station_arrays(data, variables):
+    r""" Turns a DataFrame, a StationColumns, or a dict of either into ([key], [times], [values], tz, index name)
+    with times as sorted int64 nanoseconds (UTC for timezone-aware indexes) and values as float64 with one column per
+    variable. A single station is keyed None. """
+    stations = data if isinstance(data, dict) else {None: data}
+    keys, times, values = [], [], []
+    tz, name = None, None
+    for key, station in stations.items():
+        if isinstance(station, StationColumns):
+            station_times, index_name = station.times, station.time_field
+            block = np.full((len(station_times), len(variables)), np.nan)
+            for j, variable in enumerate(variables):
+                if variable in station.columns:
+                    block[:, j] = station[variable]
+        else:
+            index = station.index
+            if index.tz is not None:
+                tz = index.tz
+                index = index.tz_convert('UTC').tz_localize(None)
+            station_times, index_name = np.asarray(index.values.astype('datetime64[ns]')).view('int64'), index.name
+            block = station.reindex(columns=variables).to_numpy(dtype='float64')
+        if len(station_times) > 1 and not (station_times[1:] >= station_times[:-1]).all():
+            order = np.argsort(station_times, kind='stable')
+            station_times, block = station_times[order], block[order]
+        keys.append(key)
+        times.append(station_times)
+        values.append(block)
+        name = name or index_name
+    return keys, times, values, tz, name
+
+
+def _reduce_bins(how, values, starts, valid, counts, wet_threshold, interval_hours):
+    r""" Applies one aggregate to the columns of values, over the segments beginning at starts. """
+    if how in ('mean', 'sum', 'circmean', 'wet_hours'):
+        if how == 'circmean':
+            radians = np.deg2rad(values)
+            sines = np.add.reduceat(np.where(valid, np.sin(radians), 0.), starts, axis=0)
+            cosines = np.add.reduceat(np.where(valid, np.cos(radians), 0.), starts, axis=0)
+            result = np.rad2deg(np.arctan2(sines, cosines)) % 360.
+        elif how == 'wet_hours':
+            result = np.add.reduceat((values >= wet_threshold).astype('float64'), starts, axis=0) * interval_hours
+        else:
+            result = np.add.reduceat(np.where(valid, values, 0.), starts, axis=0)
+            if how == 'mean':
+                with np.errstate(invalid='ignore', divide='ignore'):
+                    result = result / counts
+        return np.where(counts > 0, result, np.nan)
+    if how == 'max':
+        return np.fmax.reduceat(values, starts, axis=0)
+    if how == 'min':
+        return np.fmin.reduceat(values, starts, axis=0)
+    if how == 'count':
+        return counts.astype('float64')
+    raise ValueError('Unknown aggregation %r' % (how,))
+
+
+def _aggregate(data, specs, freq, origin, label, wet_threshold, interval):
+    r""" Aggregates data (see aggregate_stationdata) by specs, a list of (output column, variable, how). Returns the
+    station keys, the output columns, the output block for all stations, the row offset of each station in it, its
+    bin times as int64 nanoseconds, and the timezone and name for the index. """
+    try:
+        step = pd.tseries.frequencies.to_offset(freq).nanos
+    except ValueError:
+        raise ValueError('freq must be a fixed length such as "h", "6h", "D" or "7D", not %r' % (freq,))
+    variables = []
+    for _, variable, _ in specs:
+        if variable not in variables:
+            variables.append(variable)
+    keys, times, values, tz, name = _station_arrays(data, variables)
+    lengths = np.array([len(station_times) for station_times in times], dtype='int64')
+    times = np.concatenate(times) if times else np.empty(0, dtype='int64')
+    values = np.concatenate(values) if values else np.empty((0, len(variables)))
+    columns = [column for column, _, _ in specs]
+    if not len(times):
+        return keys, columns, np.empty((0, len(specs))), np.zeros(len(keys) + 1, dtype='int64'), \
+            np.empty(0, dtype='int64'), tz, name
+
+    if origin is None:
+        # midnight before the first record, local time for timezone-aware data
+        origin = pd.Timestamp(int(times.min()))
+        if tz is not None:
+            origin = origin.tz_localize('UTC').tz_convert(tz)
+        origin = origin.normalize()
+    origin = pd.Timestamp(origin)
+    if origin.tz is None and tz is not None:
+        origin = origin.tz_localize(tz)
+    if origin.tz is not None:
+        origin = origin.tz_convert('UTC').tz_localize(None)
+    origin = origin.value
+
+    # records sorted by station then time give bin keys that never decrease, so every bin is one contiguous segment
+    bins = (times - origin) // step
+    station = np.repeat(np.arange(len(keys)), lengths)
+    span = int(bins.max() - bins.min()) + 1
+    segment_keys = station * span + (bins - bins.min())
+    starts = np.flatnonzero(np.r_[True, segment_keys[1:] != segment_keys[:-1]])
+    valid = ~np.isnan(values)
+    counts = np.add.reduceat(valid, starts, axis=0, dtype='int64')
+
+    reduced = np.empty((len(starts), len(specs)))
+    interval_hours = pd.Timedelta(interval).value / 3.6e12
+    for how in set(how for _, _, how in specs):
+        spec_columns = [j for j, spec in enumerate(specs) if spec[2] == how]
+        source = [variables.index(specs[j][1]) for j in spec_columns]
+        reduced[:, spec_columns] = _reduce_bins(how, values[:, source], starts, valid[:, source],
+                                                counts[:, source], wet_threshold, interval_hours)
+
+    # lay the reduced bins onto a gapless grid per station, from its first bin to its last
+    segment_station = station[starts]
+    segment_bins = bins[starts]
+    first_bin = np.full(len(keys), 0, dtype='int64')
+    last_bin = np.full(len(keys), -1, dtype='int64')
+    has_data = lengths > 0
+    first_bin[has_data] = segment_bins[np.r_[0, np.flatnonzero(np.diff(segment_station)) + 1]]
+    last_bin[has_data] = segment_bins[np.r_[np.flatnonzero(np.diff(segment_station)), len(starts) - 1]]
+    offsets = np.r_[0, np.cumsum(last_bin - first_bin + 1)]
+    block = np.full((offsets[-1], len(specs)), np.nan)
+    block[:, [j for j, spec in enumerate(specs) if spec[2] == 'count']] = 0.
+    block[offsets[segment_station] + segment_bins - first_bin[segment_station]] = reduced
+    grid = np.concatenate([np.arange(first_bin[i], last_bin[i] + 1) for i in range(len(keys))])
+    grid_times = origin + (grid + (1 if label == 'right' else 0)) * step
+    return keys, columns, block, offsets, grid_times, tz, name
+
+
+def _split_aggregate(keys, columns, block, offsets, grid_times, tz, name):
+    r""" Splits _aggregate() output into a DataFrame per station, keyed like the input. """
+    index = pd.DatetimeIndex(grid_times.view('datetime64[ns]'), name=name)
+    if tz is not None:
+        index = index.tz_localize('UTC').tz_convert(tz)
+    frames = collections.OrderedDict()
+    for i, key in enumerate(keys):
+        frames[key] = pd.DataFrame(block[offsets[i]:offsets[i + 1]], index=index[offsets[i]:offsets[i + 1]],
+                                   columns=columns)
+    if keys == [None]:
+        return frames[None]
+    return frames
+
+
+def aggregate_stationdata(data, freq='h', how=None, variables=None, origin=None, label='left', wet_threshold=0.4,
+                          interval=datetime.timedelta(minutes=15)):
+    r""" Resamples station data to fixed-length bins, with an aggregate suited to each variable: totals for
+    precipitation, maxima for gusts, a circular mean for wind direction, hours of leaf wetness, and means for the
+    rest (see AGGREGATIONS). All stations are aggregated in one pass, which is much faster than resampling each
+    station's DataFrame.
+
+    Arguments:
+    ----------
+    data: DataFrame, StationColumns or dict, mandatory
+        stationdata() output: one station's DataFrame (return_dataframe=True) or StationColumns (return_compact=True),
+        or a dictionary of them keyed by station ID.
+    freq: string or timedelta, optional
+        The bin length, e.g. 'h', '3h', 'D' or '7D'. Lengths that vary, like months, are not supported. Default is
+        hourly.
+    how: dict, optional
+        Aggregate by variable, overriding AGGREGATIONS. One of 'mean', 'sum', 'min', 'max', 'count', 'circmean'
+        (the mean direction of angles in degrees) or 'wet_hours' (the hours in which the value was at least
+        wet_threshold).
+    variables: list, optional
+        The variables to aggregate. Default is every column of the data.
+    origin: datetime, optional
+        A bin boundary. Default is midnight before the first record.
+    label: string, optional
+        Label bins by their 'left' (default) or 'right' edge.
+    wet_threshold: float, optional
+        The leaf wetness reading at and above which a leaf counts as wet. Default is 0.4.
+    interval: timedelta, optional
+        The time each record covers, used for 'wet_hours'. Default is 15 minutes.
+
+    Returns:
+    --------
+        A DataFrame of aggregates per bin for one station, or a dictionary of them keyed like data. Bins without
+        records are NaN (0 for 'count'). Timezone-aware data is binned on absolute time, so daily bins of PDT data
+        keep the first day's offset across a daylight saving change; use PST or UTC data for fixed days.
+
+    Raises:
+    -------
+        ValueError: if freq is not a fixed length or an aggregate is unknown.
+    """
+
+    if variables is None:
+        variables = []
+        for station in (data.values() if isinstance(data, dict) else [data]):
+            variables.extend(column for column in station.columns if column not in variables)
+    how = dict(AGGREGATIONS, **(how or {}))
+    specs = [(variable, variable, how.get(variable, 'mean')) for variable in variables]
+    return _split_aggregate(*_aggregate(data, specs, freq, origin, label, wet_threshold, interval))
+
+
+def growing_degree_days(data, base=50., upper=86., variable='AT_F', cumulative=True, origin=None):
+    r""" Growing degree days from 15 minute air temperature, by the modified average method: each day's high is
+    capped at upper and its low raised to base before averaging, and GDD is the average less base.
+
+    Arguments:
+    ----------
+    data: DataFrame, StationColumns or dict, mandatory
+        As for aggregate_stationdata().
+    base: float, optional
+        The base (lower threshold) temperature in degrees F. Default is 50.
+    upper: float, optional
+        The upper threshold temperature in degrees F. Default is 86.
+    variable: string, optional
+        The temperature field. Default is AT_F.
+    cumulative: bool, optional
+        If true (default), also return the running total from the first day, GDD_CUMULATIVE.
+    origin: datetime, optional
+        As for aggregate_stationdata().
+
+    Returns:
+    --------
+        A DataFrame with daily MIN, MAX and GDD (and GDD_CUMULATIVE) columns for one station, or a dictionary of them
+        keyed like data. Days without temperatures have a NaN GDD and add nothing to the total.
+
+    Raises:
+    -------
+        None.
+    """
+
+    specs = [('MIN', variable, 'min'), ('MAX', variable, 'max')]
+    keys, columns, block, offsets, grid_times, tz, name = _aggregate(data, specs, 'D', origin, 'left', 0.4,
+                                                                     datetime.timedelta(minutes=15))
+    high = np.minimum(block[:, 1], upper)
+    low = np.clip(block[:, 0], base, upper)
+    gdd = np.maximum((high + low) / 2. - base, 0.)
+    block = np.column_stack([block, gdd])
+    columns = columns + ['GDD']
+    if cumulative:
+        # one running total over every station, less the total at the start of each station
+        total = np.cumsum(np.nan_to_num(gdd))
+        before = np.r_[0., total][offsets[:-1]]
+        block = np.column_stack([block, total - np.repeat(before, np.diff(offsets))])
+        columns.append('GDD_CUMULATIVE')
+    return _split_aggregate(keys, columns, block, offsets, grid_times, tz, name)
+
+
+# ==================================================================================================================== #
+# LatestObservations class                                                                                             #
+# Type: Data                                                                                                           #
+# Description: Keeps the newest 15 minute record of every station in memory for frequent "current conditions"         #
+#              lookups. A background thread refreshes it with one stationdata request per interval, shortly after     #
+#              each :00/:15/:30/:45 report, so reads never reach the API.                                              #
+# ==================================================================================================================== #
+
+
+class Observation(object):
+    __slots__ = ('station_id', 'time', 'values', 'station', 'refreshed', 'stale_after')
+
+    def __init__(self, station_id, time, values, station, refreshed, stale_after):
+        r""" One station's newest record, as held by LatestObservations. Values are read by field name, e.g.
+        observation['AT_F'].
+
+        Arguments:
+        ----------
+        station_id: int, mandatory
+            The station's STATION_ID.
+        time: datetime, mandatory
+            The record's TIMESTAMP_PST.
+        values: dict, mandatory
+            The record's sensor values as floats (NaN where the station reported none).
+        station: dict, mandatory
+            The station's fields from the response, other than DATA.
+        refreshed: datetime, mandatory
+            When (in PST) the record was fetched.
+        stale_after: timedelta, mandatory
+            The age past which the record counts as stale.
+
+        Returns:
+        --------
+            None.
+
+        Raises:
+        -------
+            None.
+        """
+
+        self.station_id = station_id
+        self.time = time
+        self.values = values
+        self.station = station
+        self.refreshed = refreshed
+        self.stale_after = stale_after
+
+    @property
+    def age(self):
+        r""" The time since the record was observed, as a timedelta. """
+        return _api_now() - self.time
+
+    @property
+    def stale(self):
+        r""" True if the station has missed reports: the record is older than stale_after. """
+        return self.age > self.stale_after
+
+    def __getitem__(self, field):
+        return self.values[field]
+
+    def get(self, field, default=None):
+        return self.values.get(field, default)
+
+    def __repr__(self):
+        return 'Observation(station_id=%d, time=%s)' % (self.station_id, self.time)
+
+
+class LatestObservations(object):
+    def __init__(self, awn, station_ids=None, interval=datetime.timedelta(minutes=15),
+                 delay=datetime.timedelta(minutes=2), window=datetime.timedelta(hours=2),
+                 retry_interval=datetime.timedelta(minutes=1), stale_after=None):
+        r""" The newest record of every station, refreshed in the background. Lookups are dictionary reads and never
+        call the API; upstream load is one stationdata request per interval however often the data is read.
+
+        Arguments:
+        ----------
+        awn: AWN, mandatory
+            The client used to request station data.
+        station_ids: list, optional
+            The STATION_IDs to keep. Default is every station. Either way all stations are fetched in one request.
+        interval: timedelta, optional
+            The reporting interval. Refreshes are aligned to multiples of it in PST. Default is 15 minutes.
+        delay: timedelta, optional
+            How long after each report to refresh, giving the API time to publish it. Default is 2 minutes.
+        window: timedelta, optional
+            How far back each request reaches, so that stations reporting late keep their newest record. Default is
+            2 hours.
+        retry_interval: timedelta, optional
+            When a refresh fails or doesn't have the expected report yet, how soon to try again before the next
+            scheduled refresh. Default is 1 minute.
+        stale_after: timedelta, optional
+            The age past which an Observation counts as stale. Default is twice the interval plus the delay.
+
+        Returns:
+        --------
+            None.
+
+        Raises:
+        -------
+            AWNPyError: if awn is an AsyncAWN. The background thread needs a synchronous client.
+        """
+
+        if isinstance(awn, AsyncAWN):
+            raise AWNPyError('LatestObservations needs an AWN client; AsyncAWN is not supported')
+        self.awn = awn
+        self.station_ids = None if station_ids is None else set(int(station_id) for station_id in station_ids)
+        self.interval = interval
+        self.delay = delay
+        self.window = window
+        self.retry_interval = retry_interval
+        self.stale_after = stale_after if stale_after is not None else 2 * interval + delay
+        # replaced whole on each refresh, so readers need no lock
+        self._observations = {}
+        self.refreshed = None
+        self.expected = None
+        self.behind = True
+        self.last_error = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _report_time(self, now):
+        r""" The newest report time published by now: the last multiple of interval at least delay before now. """
+        since = (now - self.delay) - datetime.datetime(1970, 1, 1)
+        return now - self.delay - (since % self.interval)
+
+    def refresh(self):
+        r""" Fetches the newest record of every station now and replaces the held records. Stations missing from the
+        response keep their previous record.
+
+        Returns:
+        --------
+            The number of stations updated.
+
+        Raises:
+        -------
+            AWNPyError: if the request failed. The held records are left as they were.
+        """
+        started = time.time()
+        now = _api_now()
+        expected = self._report_time(now)
+        try:
+            data = self.awn.stationdata(return_compact=True, START=expected - self.window, END=now)
+        except AWNPyNoResultsError:
+            data = {}
+        if isinstance(data, StationColumns):
+            data = {data.station_id: data}
+        refreshed = _api_now()
+
+        observations = dict(self._observations)
+        updated = 0
+        for station_id, columns in data.items():
+            if not len(columns) or (self.station_ids is not None and station_id not in self.station_ids):
+                continue
+            last = len(columns) - 1
+            record_time = datetime.datetime(1970, 1, 1) + datetime.timedelta(microseconds=int(columns.times[last])
+                                                                            // 1000)
+            observations[station_id] = Observation(station_id, record_time,
+                                                   dict(zip(columns.columns, columns.values[last].tolist())),
+                                                   columns.station, refreshed, self.stale_after)
+            updated += 1
+        self._observations = observations
+        self.refreshed = refreshed
+        self.expected = expected
+        self.behind = not observations or max(observation.time for observation in observations.values()) < expected
+        self.awn._emit('latest_refresh_seconds', time.time() - started)
+        return updated
+
+    def _wait_seconds(self):
+        r""" Seconds until the next refresh: just after the next report, or sooner to retry. """
+        now = _api_now()
+        following = self._report_time(now) + self.interval + self.delay
+        seconds = (following - now).total_seconds()
+        if (self.behind or self.last_error is not None) and self.retry_interval.total_seconds() < seconds:
+            return self.retry_interval.total_seconds()
+        return seconds
+
+    def _run(self):
+        while not self._stop.wait(self._wait_seconds()):
+            try:
+                self.refresh()
+                self.last_error = None
+            except Exception as e:
+                # keep serving the last good records; last_error and refreshed show how old they are
+                self.last_error = e
+                self.awn._emit('latest_refresh_errors', 1)
+
+    def start(self, refresh=True):
+        r""" Starts refreshing in a background thread.
+
+        Arguments:
+        ----------
+        refresh: bool, optional
+            If true (default), refresh once first in the calling thread, so the records are ready on return and a
+            failure raises here.
+
+        Returns:
+        --------
+            self
+
+        Raises:
+        -------
+            AWNPyError: if the first refresh failed.
+        """
+        if refresh:
+            self.refresh()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='AWNPy-LatestObservations')
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self, timeout=None):
+        r""" Stops the background thread. """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def get(self, station_id, default=None):
+        r""" Returns the newest Observation of a station, or default if none is held. """
+        return self._observations.get(int(station_id), default)
+
+    def __getitem__(self, station_id):
+        return self._observations[int(station_id)]
+
+    def __contains__(self, station_id):
+        return int(station_id) in self._observations
+
+    def __len__(self):
+        return len(self._observations)
+
+    def snapshot(self):
+        r""" Returns a dictionary of every held Observation, labeled by station ID. """
+        return dict(self._observations)
 
 
 # ==================================================================================================================== #
-# AWN class                                                                                                           #
+# AWN class                                                                                                 #
 # Type: Main                                                                                                           #
 # Description: This class defines an instance of AWNPy and takes in the user's token                                  #
 # ==================================================================================================================== #
 
 
 class AWN(object):
-    def __init__(self, username, password):
+    _http_error = 'Could not connect to the API. This could be because you have no internet connection, a parameter' \
+                  ' was input incorrectly, or the API is currently down. Please try again.'
+    _json_error = 'Could not retrieve JSON values. Try again with a shorter date range.'
+
+    def __init__(self, username, password, transport=None, chunk_window=datetime.timedelta(days=30),
+                 daily_chunk_window=datetime.timedelta(days=1826), max_workers=8, cache=None, cache_ttl=None,
+                 immutable_after=datetime.timedelta(days=7), station_ttl=86400, float_dtype='float64', scheduler=None,
+                 hooks=None, processes=None, process_min_rows=200000):
         r""" Instantiates an instance of AWNPy.
 
         Arguments:
         ----------
-        token: string, mandatory
-            Your API token that authenticates you for requests against AWN.mes
+        username: string, mandatory
+            Your AgWeatherNet username.
+        password: string, mandatory
+            Your AgWeatherNet password.
+        transport: Transport, optional
+            The object used to send HTTP requests. Defaults to a PooledTransport, which keeps connections to
+            weather.wsu.edu open between calls.
+        chunk_window: timedelta, optional
+            stationdata() requests for 15 minute data spanning more than this are split into windows of this length,
+            fetched concurrently and joined. Default is 30 days. None disables splitting.
+        daily_chunk_window: timedelta, optional
+            The same as chunk_window, for BASIS='DAILY' requests. Default is 5 years.
+        max_workers: int, optional
+            The maximum number of windows of one stationdata() call fetched at once. Default is 8.
+        cache: ResponseCache, optional
+            If supplied, API responses are stored in and served from this cache, e.g. DiskCache('~/.awnpy').
+        cache_ttl: dict, optional
+            Seconds to cache responses for, by endpoint. Given values replace the defaults of one day for 'metadata'
+            and 'stationlocator' and 15 minutes for 'stationdata'.
+        immutable_after: timedelta, optional
+            stationdata responses whose END is older than this are cached until evicted. Default is 7 days. None
+            disables this.
+        station_ttl: float, optional
+            Seconds before the station metadata held in AWN.stations is downloaded again. Default is one day.
+        float_dtype: string, optional
+            The dtype of the data columns in returned dataframes, 'float64' (default) or 'float32' to halve memory.
+        scheduler: RequestScheduler, optional
+            Retries, rate limiting and circuit breaking for requests. Defaults to a RequestScheduler that retries
+            transient failures, with no rate limit. Pass the same scheduler to several instances to share its limits.
+        hooks: list, optional
+            Callables called as hook(event, value, labels), with labels a dictionary such as
+            {'endpoint': 'metadata'}, for timings, sizes, cache lookups and the scheduler's retries and waits, e.g. a
+            MetricsRegistry. See MetricsRegistry for the events. Exceptions raised by a hook are logged to the 'AWNPy'
+            logger and do not fail the request.
+        processes: int, optional
+            The number of worker processes that convert multi-station responses to dataframes, for machines with
+            many cores. Default is None, converting in this process. Needs fork (not available on Windows); elsewhere
+            conversion stays in this process.
+        process_min_rows: int, optional
+            Responses with fewer records than this are converted in this process even when processes is set, since
+            starting workers would cost more than it saves. Default is 200000.
 
         Returns:
         --------
@@ -91,6 +3333,32 @@ class AWN(object):
         self.password = password
         self.geo_criteria = ['stid', 'state', 'country', 'county', 'radius', 'bbox', 'cwa', 'nwsfirezone', 'gacc',
                              'subgacc']
+        self.transport = transport if transport is not None else PooledTransport()
+        self.chunk_window = chunk_window
+        self.daily_chunk_window = daily_chunk_window
+        self.max_workers = max_workers
+        self.cache = cache
+        self.cache_ttl = {'metadata': 86400, 'stationlocator': 86400, 'stationdata': 900}
+        self.cache_ttl.update(cache_ttl or {})
+        self.immutable_after = immutable_after
+        self.stations = StationRegistry(self, ttl=station_ttl)
+        self._locator = None
+        self.float_dtype = float_dtype
+        self.scheduler = scheduler if scheduler is not None else RequestScheduler()
+        self.flights = SingleFlight()
+        self.hooks = list(hooks or [])
+        self.processes = processes
+        self.process_min_rows = process_min_rows
+
+    def close(self):
+        r""" Closes any connections held open by the transport. """
+        self.transport.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
 
     # ================================================================================================================ #
     # Functions:                                                                                                       #
@@ -129,17 +3397,17 @@ class AWN(object):
                 response['message']
                 return response
             except:
-                raise AWNPyError(results_error)
+                raise AWNPyNoResultsError(results_error)
         elif response['status'] == 401:
             raise AWNPyError(auth_error)
         elif response['status'] == -1:
             raise AWNPyError(rule_error)
         elif response['status'] == 0:
-            raise AWNPyError(results_error)
+            raise AWNPyNoResultsError(results_error)
         else:
             raise AWNPyError(catch_error)
 
-    def _get_response(self, endpoint, request_dict):
+    def _get_response(self, endpoint, request_dict, timeout=None):
         """ Returns a dictionary of data requested by each function.
 
         Arguments:
@@ -148,6 +3416,8 @@ class AWN(object):
             Set in all other methods, this is the API endpoint specific to each function.
         request_dict: string, mandatory
             A dictionary of parameters that are formatted into the API call.
+        timeout: float, optional
+            Socket timeout in seconds for this request. Defaults to the transport's timeout.
 
         Returns:
         --------
@@ -159,33 +3429,132 @@ class AWN(object):
             Connection_error occurs if no internet connection exists. Timeout_error occurs if the request takes too
             long and redirect_error is shown if the url is formatted incorrectly.
 
-        """
-        http_error = 'Could not connect to the API. This could be because you have no internet connection, a parameter' \
-                     ' was input incorrectly, or the API is currently down. Please try again.'
-                     
-        json_error = 'Could not retrieve JSON values. Try again with a shorter date range.'
+        """
+        key = self._cache_key(endpoint, request_dict)
+        body = self._cache_lookup(key, endpoint)
+        if body is not None:
+            return self._parse_response(TransportResponse(200, [], body), endpoint)
+
+        def fetch():
+            resp = self._send(endpoint, request_dict, timeout)
+            json_data = self._parse_response(resp, endpoint)
+            if key is not None:
+                self._cache_store(key, endpoint, request_dict, resp.body)
+            return resp.body, json_data
+
+        # identical requests already in flight are shared; the others each parse their own copy of the body
+        body, json_data = self.flights.do(_request_key(endpoint, request_dict), fetch,
+                                          copy=lambda result: self._coalesced(endpoint, result))
+        if json_data is None:
+            json_data = self._parse_response(TransportResponse(200, [], body), endpoint)
+        return json_data
+
+    def _send(self, endpoint, request_dict, timeout=None, stream=False):
+        """ POSTs a request through the scheduler and transport and returns the TransportResponse. """
+        data = urlencode(request_dict).encode()
+        # stream is only passed when needed, so that transports written before it existed still work
+        options = {'stream': True} if stream else {}
+
+        def attempt():
+            resp = self.transport.request('POST', self.base_url + endpoint + '/', body=data,
+                                          headers={'Content-Type': 'application/x-www-form-urlencoded'},
+                                          timeout=timeout, **options)
+            self._record_attempt(endpoint, resp)
+            return resp
+
+        started = time.perf_counter()
+        try:
+            resp = self.scheduler.send(attempt, emit=self._emit if self.hooks else None)
+        except (httplib.HTTPException, socket.error, EOFError):
+            raise AWNPyError(self._http_error)
+        if self.hooks:
+            self._emit('request_seconds', time.perf_counter() - started, endpoint=endpoint, status=resp.status)
+        return resp
+
+    def _emit(self, event, value, **labels):
+        """ Passes an event to every hook. A hook that raises is logged rather than failing the call it observes. """
+        for hook in self.hooks:
+            try:
+                hook(event, value, labels)
+            except Exception:
+                _logger.exception('AWNPy hook %r failed on the %s event', hook, event)
+
+    def _record_attempt(self, endpoint, resp):
+        """ Emits the phase timings and size of the response to one attempt. """
+        if not self.hooks:
+            return
+        for phase, phase_seconds in resp.timings.items():
+            self._emit(phase + '_seconds', phase_seconds, endpoint=endpoint)
+        if resp.body is not None:
+            self._emit('bytes_received', len(resp.body), endpoint=endpoint)
+            self._emit('wire_bytes', resp.wire_bytes, endpoint=endpoint)
+
+    def _coalesced(self, endpoint, result):
+        """ The copy of a shared _get_response() result given to a caller that waited for it: just the body. """
+        if self.hooks:
+            self._emit('coalesced', 1, endpoint=endpoint)
+        return result[0], None
+
+    def _cache_lookup(self, key, endpoint):
+        """ Returns the cached body of a request, or None. """
+        if key is None:
+            return None
+        body = self.cache.get(key)
+        if self.hooks:
+            self._emit('cache_hits' if body is not None else 'cache_misses', 1, endpoint=endpoint)
+        return body
+
+    def _cache_key(self, endpoint, request_dict):
+        """ Returns the cache key of a request, or None if this instance has no cache. """
+        if self.cache is None:
+            return None
+        return _request_key(endpoint, request_dict)
+
+    def _cache_store(self, key, endpoint, request_dict, body):
+        """ Stores a response body in the cache, unless its endpoint has a TTL of 0. """
+        ttl = self._cache_ttl(endpoint, request_dict)
+        if ttl != 0:
+            self.cache.set(key, body, ttl)
+
+    def _cache_ttl(self, endpoint, request_dict):
+        """ Returns how long in seconds a response may be cached, or None to cache it until evicted. stationdata
+        windows that ended more than immutable_after ago will not change, so they are kept until evicted. """
+        if endpoint == 'stationdata' and self.immutable_after is not None:
+            end = request_dict.get('END')
+            if isinstance(end, datetime.date):
+                if not isinstance(end, datetime.datetime):
+                    # a daily END covers the whole day
+                    end = datetime.datetime.combine(end, datetime.time()) + datetime.timedelta(days=1)
+                if end.replace(tzinfo=None) < _api_now() - self.immutable_after:
+                    return None
+        return self.cache_ttl.get(endpoint, 0)
 
-        # For python 3.4+, using POST
-        try:
-            #qsp = urllib.parse.urlencode(request_dict, doseq=True)
-            #resp = urllib.request.urlopen(self.base_url + endpoint + '/?' + qsp).read()
-            data = urllib.parse.urlencode(request_dict).encode()
-            req = urllib.request.Request(self.base_url + endpoint + '/', data=data)  # this will make the method "POST"
-            resp = urllib.request.urlopen(req).read()
-        # For python 2.7 -- uses GET -- best practice should be to use Python 3
-        except AttributeError or NameError:
-            try:
-                qsp = urllib.urlencode(request_dict, doseq=True)
-                resp = urllib2.urlopen(self.base_url + endpoint + '?' + qsp).read()
+    def _get_stream(self, endpoint, request_dict, timeout=None):
+        """ Sends a request without reading its body and returns the streaming TransportResponse. The cache is not
+        used. """
+        resp = self._send(endpoint, request_dict, timeout, stream=True)
+        if resp.status >= 400:
+            resp.close()
+            raise AWNPyError(self._http_error)
+        return resp
+
+    def _parse_response(self, resp, endpoint=None):
+        """ Decodes the JSON body of a TransportResponse and checks it with _checkresponse().
 
-            except urllib2.URLError:
-                raise AWNPyError(http_error)
-        except urllib.error.URLError:
-            raise AWNPyError(http_error)
+        Raises:
+        -------
+            AWNPyError: if the HTTP status is an error or the body is not valid JSON.
+        """
+        if resp.status >= 400:
+            raise AWNPyError(self._http_error)
+        started = time.perf_counter()
         try:
-            json_data = json.loads(resp.decode('utf-8'))
+            json_data = json.loads(resp.body.decode('utf-8'))
         except ValueError:
-            raise AWNPyError(json_error)
+            raise AWNPyError(self._json_error)
+        finally:
+            if self.hooks:
+                self._emit('decode_seconds', time.perf_counter() - started, endpoint=endpoint)
 
         return self._checkresponse(json_data)
     
@@ -211,7 +3580,7 @@ class AWN(object):
 
         """
 
-        acceptable_kwargs = ['STATION_ID', 'INSTALLATION_DATE', 'STATE', 'COUNTY', 'START', 'END', 'FORMAT', 'BASIS',
+        acceptable_kwargs = ['STATION_ID', 'STATION_NAME', 'INSTALLATION_DATE', 'STATE', 'COUNTY', 'START', 'END', 'FORMAT', 'BASIS',
                              'AT', 'RH', 'P', 'WS', 'WD', 'LW', 'SR', 'ST2', 'ST8', 'SM8', 'MSLP', 'LATITUDE',
                              'LONGITUDE', 'QTY', 'MAX_MILES', 'SHOWAT1', 'SHOWEXTRA']
 
@@ -234,12 +3603,7 @@ class AWN(object):
         kwargs with a STATION_ID specified
         """
 
-        metadata = self.metadata(return_dataframe=True)
-        if kwargs['STATION_NAME'] not in metadata['STATION_NAME'].values:
-            raise ValueError('STATION_NAME is not in list of AgWeatherNet stations')
-        station_id = metadata.loc[metadata['STATION_NAME'][metadata['STATION_NAME'] ==
-                                                           kwargs['STATION_NAME']].index[0]]['STATION_ID']
-        kwargs['STATION_ID'] = station_id
+        kwargs['STATION_ID'] = self.stations.station_id(kwargs['STATION_NAME'])
         kwargs.pop('STATION_NAME', None)
         return kwargs
 
@@ -248,37 +3612,127 @@ class AWN(object):
         """
         Converts returned DATA dictionaries into pandas dataframes
         """
-        df = pd.DataFrame.from_dict(data_dict)
         # if no data simply return the empty dataframe
-        if df.empty:
-            return df
-        try:
-            df.set_index('TIMESTAMP_PST', inplace=True)
-        except:
-            # this is what returns for 'DAILY' data
-            df.set_index('JULDATE_PST', inplace=True)
-        df.index = pd.to_datetime(df.index)
-        # if daily data, return
-        if df.index.name == 'JULDATE_PST':
+        if not data_dict:
+            return pd.DataFrame.from_dict(data_dict)
+        started = time.perf_counter()
+        time_field, times, columns, values = _records_to_arrays(data_dict, self.float_dtype)
+        index = _convert_timezone(_parse_times(times, time_field), time_field, return_timezone)
+        df = pd.DataFrame(values, index=index, columns=columns, copy=False)
+        # the API normally returns records in order, so only sort when needed
+        if not df.index.is_monotonic_increasing:
             df.sort_index(inplace=True)
-            return df
-        # if not daily data convert timestamps
-        if return_timezone == 'UTC':
-            df.index = df.index.tz_localize('UTC') + pd.Timedelta(hours=8)
-        elif return_timezone == 'PDT':
-            df.index = df.index.tz_localize('America/Los_Angeles')
-        elif return_timezone == 'PST':
-            pass
-        else:
-            raise ValueError('Invalid return_timezone. Must be UTC, PDT, or PST')
-        # convert columns to proper variable type:
-        for column in df.columns:
-            df[column] = pd.to_numeric(df[column], errors='coerce')
-        # sort by index to get correct order of things
-        df.sort_index(inplace=True)
+        if self.hooks:
+            self._emit('dataframe_seconds', time.perf_counter() - started)
+            self._emit('rows', len(df))
         return df
 
 
+    def _station_dataframes(self, message, return_timezone):
+        """
+        Converts each station in a stationdata response message into a dataframe, labeled by integer station ID
+        """
+        if self._use_processes(message):
+            return self._station_dataframes_in_processes(message, return_timezone)
+        df_dict = {}
+        for station in message:
+            df_dict[int(station['STATION_ID'])] = self._data_dict_to_dataframe(station['DATA'], return_timezone)
+        return df_dict
+
+
+    def _use_processes(self, message=None):
+        """
+        Whether to convert message (or, if None, the next stationdata() response) in worker processes
+        """
+        if not self.processes or self.processes < 2:
+            return False
+        if message is not None and (_process_count(self.processes, len(message)) < 2 or
+                                    sum(len(station['DATA']) for station in message) < self.process_min_rows):
+            return False
+        return _can_fork()
+
+
+    def _station_dataframes_in_processes(self, message, return_timezone):
+        """
+        _station_dataframes(), with the records converted to arrays by a pool of forked worker processes
+        """
+        started = time.perf_counter()
+        converted = _convert_in_processes(message, self.float_dtype, self.processes)
+        df_dict = {}
+        for station, (time_field, times, columns, values) in zip(message, converted):
+            if not len(times):
+                df_dict[int(station['STATION_ID'])] = pd.DataFrame.from_dict(station['DATA'])
+                continue
+            index = pd.DatetimeIndex(times.view('datetime64[ns]'), name=time_field)
+            index = _convert_timezone(index, time_field, return_timezone)
+            df = pd.DataFrame(values, index=index, columns=columns, copy=False)
+            if not df.index.is_monotonic_increasing:
+                df.sort_index(inplace=True)
+            df_dict[int(station['STATION_ID'])] = df
+            if self.hooks:
+                self._emit('rows', len(df))
+        if self.hooks:
+            self._emit('dataframe_seconds', time.perf_counter() - started)
+        return df_dict
+
+
+    def _split_stationdata_kwargs(self, kwargs):
+        """
+        Splits prepared stationdata() kwargs into one set of kwargs per date window (see chunk_window)
+        """
+        start = kwargs.get('START')
+        end = kwargs.get('END')
+        window = self.daily_chunk_window if kwargs.get('BASIS') == 'DAILY' else self.chunk_window
+        if not window or not isinstance(start, datetime.date) or type(start) is not type(end):
+            return [kwargs]
+        return [dict(kwargs, START=window_start, END=window_end)
+                for window_start, window_end in _date_windows(start, end, window)]
+
+
+    def _fetch_stationdata_window(self, kwargs, return_dataframe, return_timezone, timeout=None):
+        """
+        Fetches one date window of a split stationdata() call, returning its dataframes or its raw message
+        """
+        response_data = self._get_response('stationdata', kwargs, timeout=timeout)
+        if return_dataframe:
+            return self._station_dataframes(response_data['message'], return_timezone)
+        return response_data['message']
+
+
+    def _join_stationdata_windows(self, parts, return_dataframe):
+        """
+        Joins the per-window results of a split stationdata() call into what an unsplit call would return
+        """
+        if return_dataframe:
+            df_dict = _merge_station_dataframes(parts)
+            if len(df_dict) == 1:
+                return list(df_dict.values())[0]
+            return df_dict
+        return {'status': 1, 'message': _merge_station_messages(parts)}
+
+
+    def _prepare_stationdata_kwargs(self, kwargs):
+        """
+        Checks stationdata() kwargs and converts them to the form sent to the API
+        """
+        self._check_kwargs(kwargs)
+        kwargs['uname'] = self.username
+        kwargs['pass'] = self.password
+        # if start/end are passed as strings, convert to datetime
+        #self._string_date_to_datetime(kwargs)
+        # if STATION_NAME specified, convert to STATION_ID
+        if 'STATION_NAME' in kwargs:
+            kwargs = self._station_name_to_station_id(kwargs)
+        # if BASIS='DAILY' in kwargs, convert the datetimes to dates
+        if 'BASIS' in kwargs:
+            if kwargs['BASIS'] == 'DAILY':
+                if 'START' in kwargs:
+                    kwargs['START'] = kwargs['START'].date()
+                if 'END' in kwargs:
+                    kwargs['END'] = kwargs['END'].date()
+        return kwargs
+
+
     def _string_date_to_datetime(self, kwargs):
         """
         Converts string dates to datetimes
@@ -401,7 +3855,7 @@ class AWN(object):
             return response_data['message']
 
 
-    def stationdata(self, return_dataframe=False, return_timezone='PST', **kwargs):
+    def stationdata(self, return_dataframe=False, return_timezone='PST', return_compact=False, **kwargs):
         r""" Returns station data station or stations. Specifying no kwargs will return data for all stations.
         See below for optional parameters.
 
@@ -409,12 +3863,20 @@ class AWN(object):
         return_dataframe: bool, optional
             If true, return results as a Pandas Dataframe. If false, return results as a dict. Note that if multiple
             stations are returned, True will return a dictionary of DataFrames labeled by station ID.
+        return_compact: bool, optional
+            If true, return results as a StationColumns object (a dictionary of them labeled by station ID for
+            multiple stations), which holds the data as arrays and takes far less memory than the dict. The response
+            is parsed as it downloads and is not cached.
         return_timezone: string, optional
             Timezone of returned timestamps. Default is PST (UTC-8). 'UTC' returns UTC. 'PDT' returns timezone-aware
-            timestamps (either UTC-7 or UTC-8 depending on daylight savings time).
+            timestamps (either UTC-7 or UTC-8 depending on daylight savings time). Any IANA time zone name, such as
+            'America/Denver', is also accepted.
         ----------
         STATION_ID: string, optional
             You may supply a single station id value if you would like metadata for a specific station.
+        STATION_NAME: string, optional
+            The current STATION_NAME or OLD_LONG_NAME of a station, used instead of STATION_ID. Names are looked up in
+            AWN.stations.
         INSTALLATION_DATE: string, optional
             If supplied, only stations installed before the date will be returned.
             Dates should be in YYYYmmdd format.
@@ -539,26 +4001,83 @@ class AWN(object):
             mean sea level pressure (i.e. adjusted for elevation) reported in hPa to 0 digits of precision.  If no
             sensor is installed, then the value will be NA.
 
+        If START and END span more than chunk_window (daily_chunk_window for BASIS='DAILY'), the range is fetched as
+        several shorter requests in parallel and the results are joined, sorted and de-duplicated before returning.
+
         Raises:
         -------
             None.
 
         """
-        self._check_kwargs(kwargs)
-        kwargs['uname'] = self.username
-        kwargs['pass'] = self.password
-        # if start/end are passed as strings, convert to datetime
-        #self._string_date_to_datetime(kwargs)
-        # if STATION_NAME specified, convert to STATION_ID
-        if 'STATION_NAME' in kwargs:
-            kwargs = self._station_name_to_station_id(kwargs)
-        # if BASIS='DAILY' in kwargs, convert the datetimes to dates
-        if 'BASIS' in kwargs:
-            if kwargs['BASIS'] == 'DAILY':
-                if 'START' in kwargs:
-                    kwargs['START'] = kwargs['START'].date()
-                if 'END' in kwargs:
-                    kwargs['END'] = kwargs['END'].date()
+        kwargs = self._prepare_stationdata_kwargs(kwargs)
+        if return_compact:
+            return self._stationdata_compact(kwargs)
+        if return_dataframe:
+            # concurrent identical calls share one conversion as well as one request, and each get their own copy
+            key = (_request_key('stationdata', kwargs), return_timezone)
+            return self.flights.do(key, lambda: self._stationdata(kwargs, return_dataframe, return_timezone),
+                                   copy=_copy_frames)
+        return self._stationdata(kwargs, return_dataframe, return_timezone)
+
+
+    def _fetch_compact_window(self, kwargs):
+        """
+        Streams one date window of a return_compact stationdata() call, returning {station ID: (station, parts)}
+        """
+        stations = collections.OrderedDict()
+        convert = lambda batch: _batch_to_columns(batch, self.float_dtype)
+        for station, parts in self._stream_stations(kwargs, convert, 5000):
+            stations[int(station['STATION_ID'])] = (station, parts)
+        return stations
+
+
+    def _stationdata_compact(self, kwargs):
+        """
+        Fetches prepared stationdata() kwargs as StationColumns
+        """
+        windows = self._split_stationdata_kwargs(kwargs)
+        if len(windows) > 1:
+            results, errors = _map_concurrently(lambda i: self._fetch_compact_window(windows[i]), range(len(windows)),
+                                                self.max_workers)
+            outcomes = [results[i] if i in results else errors[i] for i in range(len(windows))]
+            window_parts = _collect_window_parts(outcomes)
+        else:
+            window_parts = [self._fetch_compact_window(kwargs)]
+
+        merged = collections.OrderedDict()
+        for stations in window_parts:
+            for station_id, (station, parts) in stations.items():
+                merged.setdefault(station_id, (station, []))[1].extend(parts)
+        compact = collections.OrderedDict()
+        for station_id, (station, parts) in merged.items():
+            joined = _join_columns(parts, self.float_dtype)
+            if joined is None:
+                time_field = 'JULDATE_PST' if kwargs.get('BASIS') == 'DAILY' else 'TIMESTAMP_PST'
+                joined = (time_field, np.empty(0, dtype='int64'), [], np.empty((0, 0), dtype=self.float_dtype))
+            compact[station_id] = StationColumns(station, *joined)
+        if len(compact) == 1:
+            return list(compact.values())[0]
+        return compact
+
+
+    def _stationdata(self, kwargs, return_dataframe, return_timezone):
+        """
+        Fetches prepared stationdata() kwargs, split into windows if needed
+        """
+        windows = self._split_stationdata_kwargs(kwargs)
+        if len(windows) > 1 and return_dataframe and self._use_processes():
+            # convert in this thread once the window threads are done, where worker processes can be forked
+            joined = self._stationdata(kwargs, False, return_timezone)['message']
+            if len(joined) == 1:
+                return self._data_dict_to_dataframe(joined[0]['DATA'], return_timezone)
+            return self._station_dataframes(joined, return_timezone)
+        if len(windows) > 1:
+            def fetch(i):
+                return self._fetch_stationdata_window(windows[i], return_dataframe, return_timezone)
+
+            results, errors = _map_concurrently(fetch, range(len(windows)), self.max_workers)
+            outcomes = [results[i] if i in results else errors[i] for i in range(len(windows))]
+            return self._join_stationdata_windows(_collect_window_parts(outcomes), return_dataframe)
 
         response_data = self._get_response('stationdata', kwargs)
         num_stations = len(response_data['message'])
@@ -568,18 +4087,296 @@ class AWN(object):
                 df = self._data_dict_to_dataframe(response_data['message'][0]['DATA'], return_timezone)
                 return df
             if num_stations > 1:
-                df_dict = {}
-                for i in range(0, num_stations):
-                    df = self._data_dict_to_dataframe(response_data['message'][i]['DATA'], return_timezone)
-                    station_id = int(response_data['message'][i]['STATION_ID'])
-                    df_dict[station_id] = df
-                return df_dict
+                return self._station_dataframes(response_data['message'], return_timezone)
 
         else:
             return response_data
 
 
-    def stationlocator(self, return_dataframe=False, **kwargs):
+    def stationdata_many(self, station_ids, START=None, END=None, return_timezone='PST', max_workers=8, timeout=None,
+                         raise_on_error=True, **kwargs):
+        r""" Returns station data for a list of stations, fetching each station in its own request over a pool of
+        threads. All other kwargs are passed to stationdata() for every station.
+
+        Arguments:
+        ----------
+        station_ids: list, mandatory
+            The STATION_ID of each station to fetch.
+        START: datetime, optional
+            See stationdata().
+        END: datetime, optional
+            See stationdata().
+        return_timezone: string, optional
+            See stationdata().
+        max_workers: int, optional
+            The maximum number of requests in flight at once. Default is 8.
+        timeout: float, optional
+            Socket timeout in seconds for each request. Defaults to the transport's timeout.
+        raise_on_error: bool, optional
+            If true (default), raise AWNPyBatchError if any station could not be fetched. If false, stations that
+            failed are left out of the result.
+
+        Returns:
+        --------
+        A dictionary of pandas dataframes labeled by integer station ID, the same as stationdata(return_dataframe=True)
+        returns for multiple stations.
+
+        Raises:
+        -------
+            AWNPyBatchError: if any station failed and raise_on_error is true. Its results attribute holds the
+            dataframes that were fetched and its errors attribute maps each failed station ID to its exception.
+
+        """
+        if START is not None:
+            kwargs['START'] = START
+        if END is not None:
+            kwargs['END'] = END
+        self._check_kwargs(kwargs)
+
+        def fetch(station_id):
+            station_kwargs = self._prepare_stationdata_kwargs(dict(kwargs, STATION_ID=station_id))
+            outcomes = []
+            for window in self._split_stationdata_kwargs(station_kwargs):
+                try:
+                    outcomes.append(self._fetch_stationdata_window(window, True, return_timezone, timeout))
+                except AWNPyError as e:
+                    outcomes.append(e)
+            return _merge_station_dataframes(_collect_window_parts(outcomes))
+
+        results, errors = _map_concurrently(fetch, station_ids, max_workers)
+        df_dict = {}
+        for station_id in station_ids:
+            if station_id in results:
+                df_dict.update(results[station_id])
+        if errors and raise_on_error:
+            raise AWNPyBatchError('%d of %d station requests failed: %s' % (len(errors), len(station_ids),
+                                                                            ', '.join(str(k) for k in errors)),
+                                  df_dict, errors)
+        return df_dict
+
+
+    def stationdata_stream(self, return_timezone='PST', batch_size=5000, timeout=None, **kwargs):
+        r""" Returns station data as a generator of (station ID, dataframe) pairs, parsing the response while it is
+        downloaded. Only one station, and batch_size of its records, is held as Python objects at a time, so whole
+        network requests can be read in far less memory than stationdata() needs. Takes the same kwargs as
+        stationdata(). The request is sent as a single call (chunk_window does not apply) and is never cached.
+
+        Arguments:
+        ----------
+        return_timezone: string, optional
+            See stationdata().
+        batch_size: int, optional
+            The number of DATA records converted to a dataframe at a time. Default is 5000.
+        timeout: float, optional
+            Socket timeout in seconds. Defaults to the transport's timeout.
+
+        Returns:
+        --------
+            A generator of (integer station ID, pandas dataframe) tuples, in the order the API returns the stations.
+
+        Raises:
+        -------
+            AWNPyError: on the same conditions as stationdata(). Errors in the body may be raised after some stations
+            have been yielded.
+
+        """
+        kwargs = self._prepare_stationdata_kwargs(kwargs)
+        return self._stream_stationdata_window(kwargs, return_timezone, batch_size, timeout)
+
+
+    def _stream_stationdata_window(self, kwargs, return_timezone, batch_size, timeout=None):
+        """
+        Sends prepared stationdata() kwargs as one streaming request and yields (station ID, dataframe) pairs
+        """
+        for station, frames in self._stream_stations(kwargs, lambda batch: self._data_dict_to_dataframe(
+                batch, return_timezone), batch_size, timeout):
+            df = pd.concat(frames) if len(frames) > 1 else (frames[0] if frames else pd.DataFrame())
+            if not df.index.is_monotonic_increasing:
+                df.sort_index(inplace=True)
+            yield int(station['STATION_ID']), df
+
+
+    def _stream_stations(self, kwargs, convert, batch_size, timeout=None):
+        """
+        Sends prepared stationdata() kwargs as one streaming request and yields (station, parts) for each station,
+        where station is its metadata and parts is convert() applied to each batch of its DATA records
+        """
+        resp = self._get_stream('stationdata', kwargs, timeout=timeout)
+        with resp:
+            status = None
+            found = False
+            parts = []
+            try:
+                for event, value in _iter_stationdata_events(resp, batch_size):
+                    if event == 'records':
+                        parts.append(convert(value))
+                    elif event == 'station':
+                        found = True
+                        station_parts, parts = parts, []
+                        yield value, station_parts
+                    elif value[0] == 'status':
+                        status = value[1]
+                        if status != 1:
+                            self._checkresponse({'status': status})
+            except ValueError:
+                raise AWNPyError(self._json_error)
+            except (httplib.HTTPException, socket.error):
+                raise AWNPyError(self._http_error)
+            if not found:
+                self._checkresponse({'status': status})
+
+
+    def iter_stationdata(self, station_ids=None, return_timezone='PST', batch_size=5000, timeout=None, **kwargs):
+        r""" Returns station data as a generator of (station ID, window, dataframe) tuples. The request is split by
+        station (if station_ids is given) and by date window (see chunk_window), and each window is fetched only
+        when the previous one has been consumed and is parsed as it downloads, so memory use does not grow with the
+        number of stations or the length of the date range. All other kwargs are the same as for stationdata().
+
+        Arguments:
+        ----------
+        station_ids: list, optional
+            The STATION_ID of each station to fetch, one station at a time. If not given, each window is fetched for
+            every station matching kwargs in a single request.
+        return_timezone: string, optional
+            See stationdata().
+        batch_size: int, optional
+            See stationdata_stream().
+        timeout: float, optional
+            Socket timeout in seconds for each request. Defaults to the transport's timeout.
+
+        Returns:
+        --------
+            A generator of (integer station ID, (START, END), pandas dataframe) tuples, where (START, END) is the
+            window the dataframe was fetched for. Records on the boundary of two windows are only yielded with the
+            first of them, and windows without data are skipped.
+
+        Raises:
+        -------
+            AWNPyError: if a request fails for any reason other than having no results.
+
+        """
+        self._check_kwargs(kwargs)
+        for station_id in [None] if station_ids is None else station_ids:
+            station_kwargs = dict(kwargs) if station_id is None else dict(kwargs, STATION_ID=station_id)
+            station_kwargs = self._prepare_stationdata_kwargs(station_kwargs)
+            # the last time yielded for each station, to drop records repeated on window boundaries
+            last = {}
+            for window in self._split_stationdata_kwargs(station_kwargs):
+                bounds = (window.get('START'), window.get('END'))
+                try:
+                    for window_station_id, df in self._stream_stationdata_window(window, return_timezone, batch_size,
+                                                                                 timeout):
+                        if window_station_id in last:
+                            df = df[df.index > last[window_station_id]]
+                        if len(df):
+                            last[window_station_id] = df.index[-1]
+                        yield window_station_id, bounds, df
+                except AWNPyNoResultsError:
+                    continue
+
+
+    def export_array(self, directory, START, END, station_ids=None, variables=None, BASIS=None, batch_size=5000):
+        r""" Writes station data on a common time grid to a float32 array of shape (station, time, variable) in
+        directory/data.npy, with its coordinates in directory/coords.json. Stations are fetched one window at a time
+        with iter_stationdata() and written straight into the memory-mapped file, so the array can be larger than
+        memory. Open it with load_station_array().
+
+        Arguments:
+        ----------
+        directory: string, mandatory
+            The directory to write to. It is created if it does not exist.
+        START: datetime, mandatory
+            The first time on the grid, in PST.
+        END: datetime, mandatory
+            The last time on the grid, in PST.
+        station_ids: list, optional
+            The stations to export, in order. Defaults to all active stations in AWN.stations.
+        variables: list, optional
+            The sensor columns to export, in order. Defaults to the columns of the first data returned.
+        BASIS: string, optional
+            'DAILY' for a daily grid. Default is a 15 minute grid.
+        batch_size: int, optional
+            See stationdata_stream().
+
+        Returns:
+        --------
+            The coordinates dictionary, as load_station_array() returns it. Times with no record are NaN.
+
+        Raises:
+        -------
+            AWNPyNoResultsError: if none of the stations had data in the range.
+            AWNPyError: if a request fails for any reason other than having no results.
+        """
+        directory = os.path.expanduser(directory)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        if station_ids is None:
+            station_ids = [record['STATION_ID'] for record in self.stations.filter(ACTIVE_STATION='Y')]
+        station_ids = [str(station_id) for station_id in station_ids]
+        daily = BASIS == 'DAILY'
+        freq = 'D' if daily else '15min'
+        times = pd.date_range(pd.Timestamp(START).floor(freq), pd.Timestamp(END), freq=freq)
+        kwargs = {'START': START, 'END': END}
+        if daily:
+            kwargs['BASIS'] = 'DAILY'
+
+        path = os.path.join(directory, 'data.npy')
+        tmp_path = _tmp_path(path)
+        array = None
+        rows = dict((station_id, i) for i, station_id in enumerate(station_ids))
+        try:
+            for station_id, _, df in self.iter_stationdata(station_ids, batch_size=batch_size, **kwargs):
+                if df.empty or str(station_id) not in rows:
+                    continue
+                if array is None:
+                    # the file is only created once the variables are known
+                    variables = list(variables) if variables is not None else list(df.columns)
+                    array = np.lib.format.open_memmap(tmp_path, mode='w+', dtype='float32',
+                                                      shape=(len(station_ids), len(times), len(variables)))
+                    for i in range(len(station_ids)):
+                        array[i] = np.nan
+                positions = times.get_indexer(df.index)
+                on_grid = positions >= 0
+                array[rows[str(station_id)], positions[on_grid]] = \
+                    df.reindex(columns=variables).to_numpy(dtype='float32')[on_grid]
+            if array is None:
+                raise AWNPyNoResultsError('No results were found matching your query. Try for a different START and '
+                                          'END range.')
+            array.flush()
+            del array
+        except BaseException:
+            # a partly written array can be large, so it is not left behind
+            array = None
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        os.replace(tmp_path, path)
+
+        records = [self.stations.get(station_id, {}) for station_id in station_ids]
+
+        def coordinate(field):
+            values = []
+            for record in records:
+                try:
+                    values.append(float(record[field]))
+                except (KeyError, TypeError, ValueError):
+                    values.append(None)
+            return values
+
+        coords = {
+            'dims': ['station', 'time', 'variable'], 'station_ids': station_ids, 'variables': variables,
+            'time_field': 'JULDATE_PST' if daily else 'TIMESTAMP_PST', 'start': str(times[0]), 'freq': freq,
+            'periods': len(times), 'latitude': coordinate('LATITUDE_DEGREE'),
+            'longitude': coordinate('LONGITUDE_DEGREE'), 'elevation': coordinate('ELEVATION_FEET'),
+            'station_name': [record.get('STATION_NAME') for record in records],
+        }
+        with open(os.path.join(directory, 'coords.json'), 'w') as f:
+            json.dump(coords, f, indent=1)
+        coords['times'] = times.rename(coords['time_field'])
+        return coords
+
+
+    def stationlocator(self, return_dataframe=False, offline=False, **kwargs):
         r""" Returns the closest stations to a specificed lat/lon. Specifying a lat/lon is required. Qty and max_miles
         are optional parameters.
         See below for optional parameters.
@@ -587,6 +4384,9 @@ class AWN(object):
         Arguments:
         return_dataframe: bool, optional
             If true, return results as a Pandas Dataframe. If false, return results as a dict.
+        offline: bool, optional
+            If true, search the active stations in AWN.stations instead of calling the API. QTY defaults to 10 and
+            NETWORK is not returned.
         ----------
         LATITUDE: string, required
             Latitude of the point to search from
@@ -618,6 +4418,9 @@ class AWN(object):
         """
 
         self._check_kwargs(kwargs)
+        if offline:
+            stations = self._stationlocator_offline(kwargs)
+            return pd.DataFrame.from_dict(stations) if return_dataframe else stations
         try:
             kwargs['uname'] = self.username
             kwargs['pass'] = self.password
@@ -632,7 +4435,278 @@ class AWN(object):
             return response_data['stations']
 
 
+    def stationlocator_many(self, latitudes, longitudes, QTY=1, MAX_MILES=None):
+        r""" Finds the closest active stations to each of many lat/lon points without calling the API. See
+        StationLocator.query().
+
+        Arguments:
+        ----------
+        latitudes: array-like, mandatory
+            Latitudes of the points to search from.
+        longitudes: array-like, mandatory
+            Longitudes of the points to search from.
+        QTY: int, optional
+            Number of stations to return per point. Default is 1.
+        MAX_MILES: float, optional
+            If specified, every station within this many miles is returned and QTY is ignored.
+
+        Returns:
+        --------
+            (station_ids, distances): arrays with one row per point, nearest station first. Distances are in miles.
+
+        Raises:
+        -------
+            None.
+
+        """
+        return self.locator.query(latitudes, longitudes, QTY=QTY, MAX_MILES=MAX_MILES)
+
+
+    @property
+    def locator(self):
+        r""" A StationLocator over the active stations in AWN.stations, rebuilt whenever they are refreshed. """
+        if self.stations.stale:
+            self.stations.refresh()
+        if self._locator is None or self._locator[0] != self.stations.loaded_at:
+            self._locator = (self.stations.loaded_at, StationLocator(self.stations.filter(ACTIVE_STATION='Y')))
+        return self._locator[1]
+
+
+    def _stationlocator_offline(self, kwargs):
+        """
+        Answers a stationlocator() call from the locator
+        """
+        if 'LATITUDE' not in kwargs or 'LONGITUDE' not in kwargs:
+            raise AWNPyError('LATITUDE and LONGITUDE are required')
+        return self.locator.nearest(kwargs['LATITUDE'], kwargs['LONGITUDE'], QTY=kwargs.get('QTY', 10),
+                                    MAX_MILES=kwargs.get('MAX_MILES'))
+
+
+# ==================================================================================================================== #
+# AsyncAWN class                                                                                                       #
+# Type: Main                                                                                                           #
+# Description: An asyncio version of AWN. metadata(), stationdata(), stationdata_many() and stationlocator() are       #
+#              coroutines; kwarg checking, response checking and dataframe conversion are shared with AWN.             #
+# ==================================================================================================================== #
+
+
+class AsyncAWN(AWN):
+    def __init__(self, username, password, transport=None, max_concurrency=20, **kwargs):
+        r""" Instantiates an asyncio instance of AWNPy. Use it with "async with" or await close() when done.
+
+        Arguments:
+        ----------
+        username: string, mandatory
+            Your AgWeatherNet username.
+        password: string, mandatory
+            Your AgWeatherNet password.
+        transport: AsyncTransport, optional
+            The object used to send HTTP requests. Defaults to an AsyncPooledTransport.
+        max_concurrency: int, optional
+            The maximum number of requests this client has in flight at once. Default is 20.
+
+        Other kwargs (chunk_window, ...) are the same as for AWN.
+
+        Returns:
+        --------
+            None.
+
+        Raises:
+        -------
+            None.
+        """
+
+        AWN.__init__(self, username, password,
+                     transport=transport if transport is not None else AsyncPooledTransport(), **kwargs)
+        self.max_concurrency = max_concurrency
+        self._semaphore = None
+
+    async def close(self):
+        r""" Closes any connections held open by the transport. """
+        await self.transport.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    async def _get_response(self, endpoint, request_dict, timeout=None):
+        """ Coroutine version of AWN._get_response(). At most max_concurrency requests are sent at once. """
+        # created here rather than in __init__ so that it belongs to the running event loop
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        key = self._cache_key(endpoint, request_dict)
+        # the cache may read and write files, so it is used from the loop's executor instead of blocking the loop
+        loop = asyncio.get_running_loop()
+        if key is not None:
+            body = await loop.run_in_executor(None, self._cache_lookup, key, endpoint)
+            if body is not None:
+                return self._parse_response(TransportResponse(200, [], body), endpoint)
+
+        async def fetch():
+            data = urlencode(request_dict).encode()
+            async with self._semaphore:
+                async def attempt():
+                    resp = await self.transport.request('POST', self.base_url + endpoint + '/', body=data,
+                                                        headers={'Content-Type': 'application/x-www-form-urlencoded'},
+                                                        timeout=timeout)
+                    self._record_attempt(endpoint, resp)
+                    return resp
+
+                started = time.perf_counter()
+                try:
+                    resp = await self.scheduler.send_async(attempt, emit=self._emit if self.hooks else None)
+                except (httplib.HTTPException, asyncio.IncompleteReadError, asyncio.TimeoutError, socket.error):
+                    raise AWNPyError(self._http_error)
+                if self.hooks:
+                    self._emit('request_seconds', time.perf_counter() - started, endpoint=endpoint,
+                               status=resp.status)
+            json_data = self._parse_response(resp, endpoint)
+            if key is not None:
+                await loop.run_in_executor(None, self._cache_store, key, endpoint, request_dict, resp.body)
+            return resp.body, json_data
+
+        body, json_data = await self.flights.do_async(_request_key(endpoint, request_dict), fetch,
+                                                      copy=lambda result: self._coalesced(endpoint, result))
+        if json_data is None:
+            json_data = self._parse_response(TransportResponse(200, [], body), endpoint)
+        return json_data
+
+    async def _station_name_to_station_id(self, kwargs):
+        """ Coroutine version of AWN._station_name_to_station_id(). """
+        await self.refresh_stations(force=False)
+        return AWN._station_name_to_station_id(self, kwargs)
+
+    async def refresh_stations(self, force=True):
+        r""" Downloads the metadata held in AsyncAWN.stations. AsyncAWN.stations cannot download it by itself, so call
+        this before using it directly. If force is false it is only downloaded if stale. """
+        if force or self.stations.stale:
+            self.stations.refresh(await self.metadata())
+
+    async def _prepare_stationdata_kwargs_async(self, kwargs):
+        """ Resolves STATION_NAME without blocking, then prepares kwargs as AWN._prepare_stationdata_kwargs() does. """
+        self._check_kwargs(kwargs)
+        if 'STATION_NAME' in kwargs:
+            kwargs = await self._station_name_to_station_id(kwargs)
+        return self._prepare_stationdata_kwargs(kwargs)
+
+    async def _fetch_stationdata_window(self, kwargs, return_dataframe, return_timezone, timeout=None):
+        """ Coroutine version of AWN._fetch_stationdata_window(). """
+        response_data = await self._get_response('stationdata', kwargs, timeout=timeout)
+        if return_dataframe:
+            return self._station_dataframes(response_data['message'], return_timezone)
+        return response_data['message']
+
+    async def metadata(self, return_dataframe=False, **kwargs):
+        r""" Coroutine version of AWN.metadata(). See AWN.metadata() for arguments and return values. """
+
+        self._check_kwargs(kwargs)
+        kwargs['uname'] = self.username
+        kwargs['pass'] = self.password
 
+        response_data = await self._get_response('metadata', kwargs)
+        if return_dataframe:
+            return pd.DataFrame.from_dict(response_data['message'])
+        else:
+            return response_data['message']
+
+    async def stationdata(self, return_dataframe=False, return_timezone='PST', return_compact=False, **kwargs):
+        r""" Coroutine version of AWN.stationdata(). See AWN.stationdata() for arguments and return values.
+        return_compact is not supported, as the transport reads each response whole. """
+
+        if return_compact:
+            raise AWNPyError('stationdata(return_compact=True) is not supported by AsyncAWN; use AWN instead')
+        kwargs = await self._prepare_stationdata_kwargs_async(kwargs)
+        windows = self._split_stationdata_kwargs(kwargs)
+        if len(windows) > 1:
+            outcomes = await asyncio.gather(*[self._fetch_stationdata_window(window, return_dataframe, return_timezone)
+                                              for window in windows], return_exceptions=True)
+            return self._join_stationdata_windows(_collect_window_parts(outcomes), return_dataframe)
+
+        response_data = await self._get_response('stationdata', kwargs)
+        num_stations = len(response_data['message'])
+
+        if return_dataframe:
+            if num_stations == 1:
+                return self._data_dict_to_dataframe(response_data['message'][0]['DATA'], return_timezone)
+            if num_stations > 1:
+                return self._station_dataframes(response_data['message'], return_timezone)
+
+        else:
+            return response_data
+
+    async def stationdata_many(self, station_ids, START=None, END=None, return_timezone='PST', timeout=None,
+                               raise_on_error=True, **kwargs):
+        r""" Coroutine version of AWN.stationdata_many(). All stations are requested at once and the number in flight
+        is limited by max_concurrency. See AWN.stationdata_many() for arguments and return values. """
 
+        if START is not None:
+            kwargs['START'] = START
+        if END is not None:
+            kwargs['END'] = END
+        self._check_kwargs(kwargs)
+
+        async def fetch(station_id):
+            station_kwargs = await self._prepare_stationdata_kwargs_async(dict(kwargs, STATION_ID=station_id))
+            outcomes = await asyncio.gather(*[self._fetch_stationdata_window(window, True, return_timezone, timeout)
+                                              for window in self._split_stationdata_kwargs(station_kwargs)],
+                                            return_exceptions=True)
+            return _merge_station_dataframes(_collect_window_parts(outcomes))
+
+        results = await asyncio.gather(*[fetch(station_id) for station_id in station_ids], return_exceptions=True)
+        df_dict = {}
+        errors = {}
+        for station_id, result in zip(station_ids, results):
+            if isinstance(result, Exception):
+                errors[station_id] = result
+            else:
+                df_dict.update(result)
+        if errors and raise_on_error:
+            raise AWNPyBatchError('%d of %d station requests failed: %s' % (len(errors), len(station_ids),
+                                                                            ', '.join(str(k) for k in errors)),
+                                  df_dict, errors)
+        return df_dict
+
+    def stationdata_stream(self, return_timezone='PST', batch_size=5000, timeout=None, **kwargs):
+        """ Not available on AsyncAWN, whose transport reads each response whole. """
+        raise AWNPyError('stationdata_stream() is not supported by AsyncAWN; use AWN instead')
+
+    def iter_stationdata(self, station_ids=None, return_timezone='PST', batch_size=5000, timeout=None, **kwargs):
+        """ Not available on AsyncAWN, whose transport reads each response whole. """
+        raise AWNPyError('iter_stationdata() is not supported by AsyncAWN; use AWN instead')
+
+    def export_array(self, directory, START, END, station_ids=None, variables=None, BASIS=None, batch_size=5000):
+        """ Not available on AsyncAWN, as it is built on iter_stationdata(). """
+        raise AWNPyError('export_array() is not supported by AsyncAWN; use AWN instead')
+
+    @property
+    def locator(self):
+        r""" See AWN.locator. AsyncAWN can't download the station metadata here, so call refresh_stations() first
+        (stationlocator_many() and stationlocator(offline=True) do). """
+        if self.stations.stale:
+            raise AWNPyError('AsyncAWN.locator needs the station metadata; await refresh_stations() first')
+        return AWN.locator.fget(self)
+
+    async def stationlocator_many(self, latitudes, longitudes, QTY=1, MAX_MILES=None):
+        r""" Coroutine version of AWN.stationlocator_many(). See AWN.stationlocator_many() for arguments and return
+        values. """
+        await self.refresh_stations(force=False)
+        return self.locator.query(latitudes, longitudes, QTY=QTY, MAX_MILES=MAX_MILES)
 
+    async def stationlocator(self, return_dataframe=False, offline=False, **kwargs):
+        r""" Coroutine version of AWN.stationlocator(). See AWN.stationlocator() for arguments and return values. """
 
+        self._check_kwargs(kwargs)
+        if offline:
+            await self.refresh_stations(force=False)
+            stations = self._stationlocator_offline(kwargs)
+            return pd.DataFrame.from_dict(stations) if return_dataframe else stations
+        kwargs['uname'] = self.username
+        kwargs['pass'] = self.password
+
+        response_data = await self._get_response('stationlocator', kwargs)
+        if return_dataframe:
+            return pd.DataFrame.from_dict(response_data['stations'])
+        else:
+            return response_data['stations']
@@ -0,0 +1,76 @@
+"""
+Compares aggregate_stationdata() with resampling each station's DataFrame, over a network of synthetic stations.
+
+    python benchmarks/bench_aggregate.py [--stations N] [--days N] [--freq h]
+"""
+import argparse
+import os
+import sys
+import timeit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'tests'))
+
+import numpy as np
+import pandas as pd
+
+from AWNPy import aggregate_stationdata, growing_degree_days
+from standin import SENSORS
+
+
+def make_frames(stations, days):
+    rng = np.random.default_rng(0)
+    frames = {}
+    for i in range(stations):
+        index = pd.date_range('2020-01-01', periods=days * 96, freq='15min', name='TIMESTAMP_PST')
+        values = rng.normal(50., 10., (len(index), len(SENSORS)))
+        values[rng.random(values.shape) < 0.01] = np.nan
+        frames[330000 + i] = pd.DataFrame(values, index=index, columns=SENSORS)
+    return frames
+
+
+def per_station(frames, freq):
+    # the per-station, per-aggregate resample loop aggregate_stationdata() replaces
+    results = {}
+    for station_id, df in frames.items():
+        resampled = df.resample(freq)
+        out = resampled.mean()
+        out['P_INCHES'] = resampled['P_INCHES'].sum(min_count=1)
+        out['WS_MAX_MPH'] = resampled['WS_MAX_MPH'].max()
+        radians = np.deg2rad(df['WD_DEGREE'])
+        out['WD_DEGREE'] = np.rad2deg(np.arctan2(np.sin(radians).resample(freq).sum(),
+                                                 np.cos(radians).resample(freq).sum())) % 360.
+        out['LW_UNITIY'] = (df['LW_UNITIY'] >= 0.4).resample(freq).sum() * 0.25
+        results[station_id] = out
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--stations', type=int, default=180)
+    parser.add_argument('--days', type=int, default=30)
+    parser.add_argument('--freq', default='h')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    frames = make_frames(args.stations, args.days)
+    expected = per_station(frames, args.freq)
+    actual = aggregate_stationdata(frames, args.freq)
+    for station_id in frames:
+        numeric = [column for column in SENSORS if column not in ('WD_DEGREE', 'LW_UNITIY')]
+        assert np.allclose(expected[station_id][numeric], actual[station_id][numeric], equal_nan=True)
+
+    print('%d stations x %d days of 15 minute records (%d rows), freq %s' % (
+        args.stations, args.days, args.stations * args.days * 96, args.freq))
+    results = {}
+    for name, func in [('resample', lambda: per_station(frames, args.freq)),
+                       ('aggregate', lambda: aggregate_stationdata(frames, args.freq)),
+                       ('gdd', lambda: growing_degree_days(frames))]:
+        results[name] = min(timeit.repeat(func, number=1, repeat=args.repeat))
+        print('%-10s %8.3f s' % (name, results[name]))
+    print('speedup    %8.1fx' % (results['resample'] / results['aggregate']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,174 @@
+"""
+Runs AWN calls end to end against the local stand-in webservice (tests/standin.py) and reports latency percentiles,
+throughput, peak memory and where the time went, for each scenario.
+
+    python benchmarks/bench_api.py [--stations N] [--days N] [--repeat N] [--only NAME ...]
+    python benchmarks/bench_api.py --save baseline.json
+    python benchmarks/bench_api.py --baseline baseline.json [--tolerance 0.2]
+
+Payloads are synthetic unless --recorded DIR is given, in which case DIR/<endpoint>.json (metadata.json,
+stationdata.json, stationlocator.json) are served as recorded. With --baseline the script exits non-zero if any
+scenario's median latency is more than tolerance slower than in the baseline file.
+"""
+import argparse
+import datetime
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'tests'))
+
+from AWNPy import AWN, MetricsRegistry
+from standin import StandInAPI, make_metadata, make_stationdata, make_stationlocator
+
+START = datetime.datetime(2020, 1, 1)
+
+
+def stationdata_handler(num_stations):
+    """ Serves stationdata for the requested range and stations, encoding each distinct payload once. """
+    encoded = {}
+
+    def handle(params):
+        key = tuple(sorted(params.items()))
+        if key not in encoded:
+            daily = params.get('BASIS') == 'DAILY'
+            fmt = '%Y-%m-%d' if daily else '%Y-%m-%d %H:%M:%S'
+            start = datetime.datetime.strptime(params['START'], fmt)
+            end = datetime.datetime.strptime(params['END'], fmt)
+            step = datetime.timedelta(days=1) if daily else datetime.timedelta(minutes=15)
+            if 'STATION_ID' in params:
+                station_ids = params['STATION_ID'].split(',')
+            else:
+                station_ids = [str(330000 + i) for i in range(num_stations)]
+            payload = make_stationdata(station_ids, start, int((end - start) // step) + 1, daily)
+            encoded[key] = json.dumps(payload).encode('utf-8')
+        return encoded[key]
+
+    return handle
+
+
+def recorded_handlers(directory):
+    handlers = {}
+    for endpoint in ('metadata', 'stationdata', 'stationlocator'):
+        path = os.path.join(directory, endpoint + '.json')
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                handlers[endpoint] = f.read()
+    return handlers
+
+
+def scenarios(args):
+    end = START + datetime.timedelta(days=args.days)
+    daily_end = START + datetime.timedelta(days=365 * args.years)
+    return [
+        ('metadata', lambda m: m.metadata()),
+        ('stationdata_15min_single', lambda m: m.stationdata(STATION_ID='330000', START=START, END=end,
+                                                             return_dataframe=True)),
+        ('stationdata_15min_multi', lambda m: m.stationdata(START=START, END=end, return_dataframe=True)),
+        ('stationdata_15min_raw', lambda m: m.stationdata(STATION_ID='330000', START=START, END=end)),
+        ('stationdata_daily_single', lambda m: m.stationdata(STATION_ID='330000', START=START, END=daily_end,
+                                                             BASIS='DAILY', return_dataframe=True)),
+        ('stationdata_daily_multi', lambda m: m.stationdata(START=START, END=daily_end, BASIS='DAILY',
+                                                            return_dataframe=True)),
+        ('stationlocator', lambda m: m.stationlocator(LATITUDE='46.0', LONGITUDE='-120.0', QTY='10')),
+    ]
+
+
+def count_rows(result):
+    if hasattr(result, 'shape'):
+        return len(result)
+    if isinstance(result, dict) and 'message' in result:
+        return sum(len(station.get('DATA', [])) for station in result['message'])
+    if isinstance(result, dict):
+        return sum(count_rows(value) for value in result.values())
+    return len(result) if isinstance(result, list) else 0
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(fraction * (len(values) - 1))))]
+
+
+def run(name, call, m, metrics, repeat):
+    call(m)  # warm up connections and lazy imports
+    metrics.reset()
+    latencies = []
+    rows = 0
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = call(m)
+        latencies.append(time.perf_counter() - started)
+        rows = count_rows(result)
+    stages = dict((metric['event'], metric['sum'] / repeat) for metric in metrics.snapshot()
+                  if metric['event'].endswith('_seconds') and not metric['labels'].get('status'))
+    tracemalloc.start()
+    call(m)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    total = sum(latencies)
+    return {
+        'p50': percentile(latencies, 0.5), 'p90': percentile(latencies, 0.9), 'p99': percentile(latencies, 0.99),
+        'calls_per_second': repeat / total, 'rows': rows, 'rows_per_second': rows * repeat / total,
+        'peak_mb': peak / 1e6, 'stages': stages,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--stations', type=int, default=20)
+    parser.add_argument('--days', type=int, default=30, help='days of 15 minute data')
+    parser.add_argument('--years', type=int, default=5, help='years of daily data')
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--only', nargs='*', help='scenarios to run')
+    parser.add_argument('--recorded', help='directory of recorded <endpoint>.json payloads')
+    parser.add_argument('--save', help='write the results to this JSON file')
+    parser.add_argument('--baseline', help='compare with results saved by --save')
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    args = parser.parse_args()
+
+    handlers = {'metadata': make_metadata(args.stations), 'stationdata': stationdata_handler(args.stations),
+                'stationlocator': make_stationlocator(10)}
+    if args.recorded:
+        handlers.update(recorded_handlers(args.recorded))
+
+    results = {}
+    with StandInAPI(handlers) as api:
+        metrics = MetricsRegistry()
+        m = AWN(username='bench', password='bench', hooks=[metrics], chunk_window=None, daily_chunk_window=None)
+        m.base_url = api.url
+        print('%-26s %9s %9s %9s %9s %12s %9s  %s' % ('scenario', 'p50 ms', 'p90 ms', 'p99 ms', 'calls/s',
+                                                     'rows/s', 'peak MB', 'stages (ms per call)'))
+        for name, call in scenarios(args):
+            if args.only and name not in args.only:
+                continue
+            result = results[name] = run(name, call, m, metrics, args.repeat)
+            stages = ' '.join('%s=%.1f' % (stage[:-len('_seconds')], seconds * 1000.)
+                              for stage, seconds in sorted(result['stages'].items()))
+            print('%-26s %9.1f %9.1f %9.1f %9.1f %12.0f %9.1f  %s' % (
+                name, result['p50'] * 1000., result['p90'] * 1000., result['p99'] * 1000.,
+                result['calls_per_second'], result['rows_per_second'], result['peak_mb'], stages))
+        m.close()
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=1, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = []
+        for name, result in sorted(results.items()):
+            if name in baseline and result['p50'] > baseline[name]['p50'] * (1. + args.tolerance):
+                regressions.append('%s: p50 %.1f ms, baseline %.1f ms' % (name, result['p50'] * 1000.,
+                                                                          baseline[name]['p50'] * 1000.))
+        for line in regressions:
+            print('REGRESSION ' + line)
+        sys.exit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+"""
+Compares AWN._data_dict_to_dataframe with the implementation it replaced, on synthetic stationdata records.
+
+    python benchmarks/bench_dataframe.py [--stations N] [--days N] [--processes N]
+"""
+import argparse
+import datetime
+import os
+import sys
+import timeit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'tests'))
+
+import pandas as pd
+
+from AWNPy import AWN
+from standin import make_records
+
+
+def legacy_data_dict_to_dataframe(data_dict, return_timezone):
+    df = pd.DataFrame.from_dict(data_dict)
+    if df.empty:
+        return df
+    try:
+        df.set_index('TIMESTAMP_PST', inplace=True)
+    except:
+        df.set_index('JULDATE_PST', inplace=True)
+    df.index = pd.to_datetime(df.index)
+    if df.index.name == 'JULDATE_PST':
+        df.sort_index(inplace=True)
+        return df
+    if return_timezone == 'UTC':
+        df.index = df.index.tz_localize('UTC') + pd.Timedelta(hours=8)
+    elif return_timezone == 'PDT':
+        df.index = df.index.tz_localize('America/Los_Angeles')
+    for column in df.columns:
+        df[column] = pd.to_numeric(df[column], errors='coerce')
+    df.sort_index(inplace=True)
+    return df
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--stations', type=int, default=5)
+    parser.add_argument('--days', type=int, default=365)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--processes', type=int, default=0,
+                        help='also time conversion in 1, 2, 4, ... up to N worker processes')
+    args = parser.parse_args()
+
+    stations = []
+    for i in range(args.stations):
+        records = make_records(datetime.datetime(2020, 1, 1), args.days * 96)
+        # sensors that are not installed report NA
+        for record in records[i::97]:
+            record['LW_UNITIY'] = 'NA'
+        stations.append(records)
+    m = AWN(username='', password='')
+
+    legacy = legacy_data_dict_to_dataframe(stations[0], 'UTC')
+    current = m._data_dict_to_dataframe(stations[0], 'UTC')
+    pd.testing.assert_frame_equal(legacy, current)
+
+    print('%d stations x %d days of 15 minute records (%d rows)' % (args.stations, args.days,
+                                                                     args.stations * args.days * 96))
+    results = {}
+    for name, func in [('legacy', legacy_data_dict_to_dataframe), ('current', m._data_dict_to_dataframe)]:
+        seconds = min(timeit.repeat(lambda: [func(records, 'PST') for records in stations], number=1,
+                                    repeat=args.repeat))
+        results[name] = seconds
+        print('%-10s %8.3f s' % (name, seconds))
+    m.float_dtype = 'float32'
+    seconds = min(timeit.repeat(lambda: [m._data_dict_to_dataframe(records, 'PST') for records in stations],
+                                number=1, repeat=args.repeat))
+    print('%-10s %8.3f s' % ('float32', seconds))
+    if args.processes:
+        # worker processes are capped at os.cpu_count(), so only a multi-core machine shows the scaling
+        message = [{'STATION_ID': str(330000 + i), 'DATA': records} for i, records in enumerate(stations)]
+        m.float_dtype, m.process_min_rows = 'float64', 0
+        print('%d cpus' % (os.cpu_count() or 1))
+        counts = [1]
+        while counts[-1] * 2 < args.processes:
+            counts.append(counts[-1] * 2)
+        if args.processes > 1:
+            counts.append(args.processes)
+        serial = None
+        for count in counts:
+            m.processes = count
+            seconds = min(timeit.repeat(lambda: m._station_dataframes(message, 'PST'), number=1,
+                                        repeat=args.repeat))
+            serial = serial or seconds
+            print('%-10s %8.3f s %6.2fx' % ('%d procs' % count, seconds, serial / seconds))
+    print('speedup    %8.1fx' % (results['legacy'] / results['current']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+"""
+Measures how long `import AWNPy` takes in a fresh interpreter, and fails if it is over budget or pulls in modules that
+should only be imported when used.
+
+    python benchmarks/bench_import.py [--repeat N] [--budget-ms MS]
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# modules AWNPy imports lazily; none of them should be loaded by the import itself
+LAZY_MODULES = ['pandas', 'numpy', 'asyncio', 'pdb']
+
+SCRIPT = '''
+import sys, time
+start = time.perf_counter()
+import AWNPy
+elapsed = time.perf_counter() - start
+print(elapsed)
+print(','.join(name for name in %r if name in sys.modules))
+''' % LAZY_MODULES
+
+
+def import_once():
+    output = subprocess.check_output([sys.executable, '-c', SCRIPT], cwd=ROOT, universal_newlines=True)
+    elapsed, loaded = output.splitlines()
+    return float(elapsed), [name for name in loaded.split(',') if name]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--budget-ms', type=float, default=150.)
+    args = parser.parse_args()
+
+    times = []
+    loaded = set()
+    for _ in range(args.repeat):
+        elapsed, modules = import_once()
+        times.append(elapsed * 1000.)
+        loaded.update(modules)
+    times.sort()
+    median = times[len(times) // 2]
+    print('import AWNPy, %d runs' % args.repeat)
+    print('%-10s %8.1f ms' % ('min', times[0]))
+    print('%-10s %8.1f ms' % ('median', median))
+    print('%-10s %8.1f ms' % ('budget', args.budget_ms))
+
+    failed = False
+    if loaded:
+        print('imported eagerly: %s' % ', '.join(sorted(loaded)))
+        failed = True
+    if median > args.budget_ms:
+        print('median import time is over budget')
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,208 @@
+"""
+A local stand-in for the AgWeatherNet webservice, used to run AWNPy offline.
+
+StandInAPI serves canned or generated JSON over HTTP/1.1 on 127.0.0.1. Each endpoint ('metadata', 'stationdata',
+'stationlocator') maps to either a dict, which is returned as JSON, or a callable taking the POSTed parameters and
+returning a dict, a (status, dict/bytes) or (status, dict/bytes, headers) tuple, or DROP to close the connection
+without answering. faulty() wraps a handler to inject failures. Responses are compressed with the first of
+StandInAPI.encodings ('gzip', 'deflate') that the request accepts.
+"""
+import datetime
+import gzip
+import json
+import socket
+import threading
+import zlib
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import parse_qsl
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urlparse import parse_qsl
+
+
+# returned by a handler to drop the connection without a response
+DROP = object()
+
+SENSORS = ['AT_F', 'RH_PCNT', 'DEWPT_F', 'P_INCHES', 'WS_MPH', 'WS_MAX_MPH', 'WD_DEGREE', 'LW_UNITIY', 'SR_WM2',
+           'ST2_F', 'ST8_F', 'STM8_PCNT', 'MSLP_HPA']
+
+
+class _Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        # headers and body are written separately; without this small responses wait on delayed ACKs
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        with self.server.api.lock:
+            self.server.api.connections += 1
+            self.server.api.open_connections.append((self.connection, threading.current_thread()))
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        api = self.server.api
+        length = int(self.headers.get('Content-Length') or 0)
+        params = dict(parse_qsl(self.rfile.read(length).decode('utf-8')))
+        endpoint = self.path.strip('/').split('/')[-1]
+        with api.lock:
+            api.requests.append((endpoint, params))
+
+        handler = api.handlers.get(endpoint)
+        headers = {}
+        if handler is None:
+            status, payload = 404, {'status': 0}
+        elif callable(handler):
+            payload = handler(params)
+            status = 200
+            if payload is DROP:
+                self.close_connection = True
+                return
+            if isinstance(payload, tuple):
+                if len(payload) > 2:
+                    headers = payload[2]
+                status, payload = payload[:2]
+        else:
+            status, payload = 200, handler
+        body = payload if isinstance(payload, bytes) else json.dumps(payload).encode('utf-8')
+        accepted = [coding.strip() for coding in (self.headers.get('Accept-Encoding') or '').split(',')]
+        for encoding in api.encodings:
+            if encoding in accepted:
+                if encoding == 'gzip':
+                    body = gzip.compress(body)
+                else:
+                    body = zlib.compress(body)
+                headers = dict(headers, **{'Content-Encoding': encoding})
+                break
+
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def faulty(handler, *faults):
+    """
+    Returns a handler that answers the first requests with faults, in order, and the rest with handler (a dict or a
+    callable). Each fault is DROP, an HTTP status code, or a (status, headers) tuple.
+    """
+    faults = list(faults)
+    lock = threading.Lock()
+
+    def handle(params):
+        with lock:
+            fault = faults.pop(0) if faults else None
+        if fault is None:
+            return handler(params) if callable(handler) else handler
+        if fault is DROP:
+            return DROP
+        if isinstance(fault, tuple):
+            return fault[0], {'status': 0}, fault[1]
+        return fault, {'status': 0}
+
+    return handle
+
+
+class StandInAPI(object):
+    def __init__(self, handlers=None, encodings=()):
+        self.handlers = dict(handlers or {})
+        self.encodings = list(encodings)
+        self.requests = []
+        self.connections = 0
+        self.open_connections = []
+        self.lock = threading.Lock()
+        self._server = None
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:%d/webservice/' % self._server.server_address[1]
+
+    def start(self):
+        self._server = _Server(('127.0.0.1', 0), _Handler)
+        self._server.api = self
+        thread = threading.Thread(target=self._server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        # end the handler threads still waiting on kept-alive connections, so none outlive the server
+        for connection, thread in self.open_connections:
+            try:
+                connection.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            thread.join(5)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+
+# ==================================================================================================================== #
+# Payload generators                                                                                                   #
+# ==================================================================================================================== #
+
+
+def make_station(station_id, index=0):
+    return {
+        'STATE': 'WA', 'COUNTY': ['Benton', 'Yakima', 'King'][index % 3], 'CITY': 'Town %d' % index, 'ZIPCODE': '99350',
+        'LATITUDE_DEGREE': '%.4f' % (46.0 + 0.02 * index), 'LONGITUDE_DEGREE': '%.4f' % (-120.0 - 0.03 * index),
+        'ELEVATION_FEET': str(500 + index), 'INSTALLATION_DATE': '1990-01-01', 'STATION_ID': str(station_id),
+        'STATION_NAME': 'Station %d' % index, 'OLD_LONG_NAME': 'Old Station %d' % index, 'STATION_SPONSOR': '',
+        'TIER': str(1 + index % 3), 'ACTIVE_STATION': 'N' if index % 10 == 9 else 'Y',
+        'AT_F': 'Y', 'RH_PCNT': 'Y', 'P_INCHES': 'Y', 'WS_MPH': 'Y', 'WD_DEGREE': 'Y',
+        'LW_UNITIY': 'Y' if index % 2 else 'N', 'SR_WM2': 'Y', 'ST2_F': 'Y', 'ST8_F': 'Y', 'STM8_PCNT': 'N',
+        'MSLP_HPA': 'N',
+    }
+
+
+def make_metadata(num_stations=5, first_id=330000):
+    return {'status': 1, 'message': [make_station(first_id + i, i) for i in range(num_stations)]}
+
+
+def make_records(start, periods, daily=False):
+    step = datetime.timedelta(days=1) if daily else datetime.timedelta(minutes=15)
+    records = []
+    for i in range(periods):
+        t = start + i * step
+        record = dict((sensor, '%.1f' % (50 + (i + j) % 30)) for j, sensor in enumerate(SENSORS))
+        if daily:
+            record['JULDATE_PST'] = t.strftime('%Y-%m-%d')
+        else:
+            record['TIMESTAMP_PST'] = t.strftime('%Y-%m-%d %H:%M:%S')
+        records.append(record)
+    return records
+
+
+def make_stationdata(station_ids, start, periods, daily=False):
+    message = []
+    for i, station_id in enumerate(station_ids):
+        station = make_station(station_id, i)
+        station['DATA'] = make_records(start, periods, daily)
+        message.append(station)
+    return {'status': 1, 'message': message}
+
+
+def make_stationlocator(num_stations=3, first_id=330000):
+    stations = [{'STATION_ID': str(first_id + i), 'STATION_NAME': 'Station %d' % i, 'DISTANCE': str(1.5 * i),
+                 'LATITUDE': '46.0', 'LONGITUDE': '-120.0', 'ELEVATION': '500', 'NETWORK': 'AWN'}
+                for i in range(num_stations)]
+    return {'status': 1, 'message': 'OK', 'stations': stations}
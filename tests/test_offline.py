@@ -0,0 +1,935 @@
+"""
+Tests that run AWNPy against the local stand-in webservice in standin.py instead of weather.wsu.edu.
+"""
+import asyncio
+import datetime
+import json
+import sys
+
+from AWNPy import (AWN, AsyncAWN, AWNPyError, AWNPyBatchError, DiskCache, LatestObservations, PickleFrameStore,
+                   PooledTransport, MetricsRegistry, RequestScheduler, StationArchive, StationSync, WatermarkStore,
+                   aggregate_stationdata, growing_degree_days, load_station_array)
+from standin import DROP, StandInAPI, faulty, make_metadata, make_stationdata, make_stationlocator
+
+
+def client(api, **kwargs):
+    m = AWN(username='user', password='pass', **kwargs)
+    m.base_url = api.url
+    return m
+
+
+# Transport Tests
+def testkeepalive():
+    with StandInAPI({'metadata': make_metadata(3)}) as api:
+        with client(api) as m:
+            for _ in range(5):
+                assert len(m.metadata()) == 3
+        assert len(api.requests) == 5
+        assert api.connections == 1
+        assert api.requests[0][1]['uname'] == 'user'
+
+
+def testidletimeout():
+    with StandInAPI({'metadata': make_metadata(3)}) as api:
+        m = client(api, transport=PooledTransport(idle_timeout=0))
+        m.metadata()
+        m.metadata()
+        assert api.connections == 2
+
+
+def testpooledthreads():
+    import threading
+    with StandInAPI({'metadata': make_metadata(3)}) as api:
+        m = client(api, transport=PooledTransport(pool_size=2, max_per_host=2))
+        # distinct requests, so that they are not coalesced
+        threads = [threading.Thread(target=m.metadata, kwargs={'COUNTY': str(i)}) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert len(api.requests) == 8
+        assert api.connections <= 2
+
+
+def testcompression():
+    payload = make_stationdata(['330001', '330002'], datetime.datetime(2020, 5, 1), 96)
+    for encoding in ('gzip', 'deflate'):
+        with StandInAPI({'stationdata': payload}, encodings=[encoding]) as api:
+            m = client(api)
+            data = m.stationdata()
+            assert data['message'][1]['DATA'][95] == payload['message'][1]['DATA'][95]
+            stats = m.transport.stats
+            assert stats['wire_bytes'] * 5 < stats['body_bytes']
+            streamed = dict(m.stationdata_stream(batch_size=10))
+            assert len(streamed[330002]) == 96
+            assert api.connections == 1
+
+
+def testdecodedstream():
+    import gzip
+    import io
+    from AWNPy import _DecodedStream
+    body = json.dumps(make_stationdata(['330001'], datetime.datetime(2020, 5, 1), 2000)).encode()
+    stream = _DecodedStream(io.BytesIO(gzip.compress(body)), 'gzip', chunk_size=4096)
+    parts = [stream.read(7), stream.read(100000)]
+    while True:
+        part = stream.read(13)
+        parts.append(part)
+        if not part:
+            break
+    assert b''.join(parts) == body
+    assert stream.read() == b''
+    stream = _DecodedStream(io.BytesIO(gzip.compress(body)), 'gzip', chunk_size=4096)
+    assert stream.read(10) + stream.read() == body
+
+
+def testhttperror():
+    with StandInAPI({'metadata': lambda params: (500, {'status': 0})}) as api:
+        try:
+            client(api, scheduler=RequestScheduler(backoff=0)).metadata()
+        except AWNPyError:
+            pass
+        else:
+            raise AssertionError('AWNPyError not raised')
+
+
+def testlazyimports():
+    import os
+    import subprocess
+    import sys
+    code = 'import sys, AWNPy; print(sorted(set(["pandas", "numpy", "asyncio", "pdb"]) & set(sys.modules)))'
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    assert subprocess.check_output([sys.executable, '-c', code], cwd=root).strip() == b'[]'
+
+
+# Scheduler Tests
+def testretry():
+    handler = faulty(make_metadata(3), DROP, 503, (429, {'Retry-After': '0'}))
+    with StandInAPI({'metadata': handler}) as api:
+        m = client(api, scheduler=RequestScheduler(backoff=0.01))
+        assert len(m.metadata()) == 3
+        assert len(api.requests) == 4
+        stats = m.scheduler.stats
+        assert stats['retries'] == 3 and stats['requests'] == 4
+        assert stats['retries_connection'] == stats['retries_server'] == stats['retries_throttled'] == 1
+
+    # 4xx errors other than 429 are not retried
+    with StandInAPI({'metadata': faulty(make_metadata(3), 404)}) as api:
+        m = client(api, scheduler=RequestScheduler(backoff=0.01))
+        try:
+            m.metadata()
+        except AWNPyError:
+            pass
+        else:
+            raise AssertionError('AWNPyError not raised')
+        assert len(api.requests) == 1
+
+
+def testcircuitbreaker():
+    with StandInAPI({'metadata': lambda params: (500, {'status': 0})}) as api:
+        scheduler = RequestScheduler(retries={'server': 0}, failure_threshold=2, reset_timeout=60)
+        m = client(api, scheduler=scheduler)
+        for _ in range(3):
+            try:
+                m.metadata()
+            except AWNPyError:
+                pass
+        assert len(api.requests) == 2
+        assert scheduler.breaker.state == 'open' and scheduler.stats['rejected'] == 1
+
+    # a half-open trial that is interrupted lets the next request be the trial instead
+    def interrupted():
+        raise KeyboardInterrupt
+
+    scheduler.breaker.reset_timeout = 0
+    for send in (scheduler.send, lambda request: asyncio.run(scheduler.send_async(request))):
+        try:
+            send(interrupted)
+        except KeyboardInterrupt:
+            pass
+        else:
+            raise AssertionError('KeyboardInterrupt not raised')
+        assert scheduler.breaker.allow()
+        scheduler.breaker.release()
+
+    async def cancelled():
+        raise asyncio.CancelledError
+
+    try:
+        asyncio.run(scheduler.send_async(cancelled))
+    except asyncio.CancelledError:
+        pass
+    assert scheduler.breaker.allow()
+
+
+def testratelimit():
+    import time
+    with StandInAPI({'metadata': make_metadata(3)}) as api:
+        m = client(api, scheduler=RequestScheduler(rate=20, burst=1))
+        started = time.monotonic()
+        for _ in range(5):
+            m.metadata()
+        assert time.monotonic() - started >= 0.19
+        assert m.scheduler.stats['throttled'] >= 4
+
+
+def testsingleflight():
+    import threading
+    import time
+
+    def slow_metadata(params):
+        time.sleep(0.2)
+        return make_metadata(3)
+
+    def slow_stationdata(params):
+        time.sleep(0.2)
+        return make_stationdata(['330001'], datetime.datetime(2020, 5, 1), 8)
+
+    with StandInAPI({'metadata': slow_metadata, 'stationdata': slow_stationdata}) as api:
+        m = client(api)
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(m.metadata())) for _ in range(8)]
+        threads += [threading.Thread(target=lambda: results.append(m.stationdata(return_dataframe=True)))
+                    for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert len(api.requests) == 2
+        assert m.flights.stats['shared'] >= 14
+        records = [r for r in results if isinstance(r, list)]
+        frames = [r for r in results if not isinstance(r, list)]
+        assert len(records) == len(frames) == 8
+        assert all(r == records[0] and r is not records[0] for r in records[1:])
+        frames[0]['AT_F'] = 0.
+        assert all(df['AT_F'].iloc[0] == 50. for df in frames[1:])
+
+    def slow_empty(params):
+        time.sleep(0.2)
+        return {'status': 1, 'message': []}
+
+    with StandInAPI({'stationdata': slow_empty}) as api:
+        m = client(api)
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(m.stationdata(return_dataframe=True)))
+                   for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert results == [None, None, None]
+
+
+def testsingleflightmutation():
+    import threading
+    import time
+    from AWNPy import SingleFlight
+    flights = SingleFlight()
+    joined = threading.Event()
+
+    def leader_func():
+        joined.wait(5)
+        return [1, 2, 3]
+
+    def leader():
+        result = flights.do('key', leader_func, copy=list)
+        # the leader's caller changes its result while the follower is still waking up
+        result.append(4)
+        result[0] = 0
+
+    def follower():
+        while not flights._flights:
+            time.sleep(0.001)
+        results.append(flights.do('key', lambda: None, copy=list))
+
+    results = []
+    leading = threading.Thread(target=leader)
+    leading.start()
+    waiter = threading.Thread(target=follower)
+    waiter.start()
+    while not flights.stats['shared']:
+        time.sleep(0.001)
+    joined.set()
+    leading.join()
+    waiter.join()
+    assert results == [[1, 2, 3]]
+
+
+def testsingleflightcancel():
+    from AWNPy import SingleFlight
+    flights = SingleFlight()
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return [len(calls)]
+
+    async def run():
+        leader = asyncio.ensure_future(flights.do_async('key', fetch, copy=list))
+        await asyncio.sleep(0)
+        followers = [asyncio.ensure_future(flights.do_async('key', fetch, copy=list)) for _ in range(2)]
+        await asyncio.sleep(0)
+        # only the leader is cancelled; its followers carry on with one new call between them
+        leader.cancel()
+        return await asyncio.gather(leader, *followers, return_exceptions=True)
+
+    results = asyncio.run(run())
+    assert isinstance(results[0], asyncio.CancelledError)
+    assert results[1:] == [[2], [2]] and len(calls) == 2
+    assert flights._async_flights == {}
+
+
+def testmetrics(tmp_path):
+    events = []
+    registry = MetricsRegistry()
+    payload = make_stationdata(['330001'], datetime.datetime(2020, 5, 1), 8)
+    with StandInAPI({'stationdata': faulty(payload, 503)}) as api:
+        m = client(api, hooks=[registry, lambda event, value, labels: events.append(event)],
+                   cache=DiskCache(str(tmp_path)), scheduler=RequestScheduler(backoff=0.01))
+        m.stationdata(STATION_ID='330001', return_dataframe=True)
+        m.stationdata(STATION_ID='330001', return_dataframe=True)
+    for event in ['connect_seconds', 'wait_seconds', 'transfer_seconds', 'request_seconds', 'decode_seconds',
+                  'dataframe_seconds', 'rows', 'bytes_received', 'cache_hits', 'cache_misses', 'retries']:
+        assert event in events
+    metrics = dict(((metric['event'], tuple(sorted(metric['labels'].items()))), metric)
+                   for metric in registry.snapshot())
+    assert metrics[('rows', ())]['sum'] == 16
+    assert metrics[('cache_hits', (('endpoint', 'stationdata'),))]['sum'] == 1
+    assert metrics[('retries', (('reason', 'server'),))]['count'] == 1
+    text = registry.to_prometheus()
+    assert '# TYPE awnpy_request_seconds summary' in text
+    assert 'awnpy_request_seconds_count{endpoint="stationdata",status="200"} 1' in text
+    assert 'awnpy_rows_total 16.0' in text
+    assert json.loads(registry.to_json())
+
+
+def testfailinghook(caplog):
+    def broken(event, value, labels):
+        raise ValueError('broken hook')
+
+    payload = make_stationdata(['330001'], datetime.datetime(2020, 5, 1), 8)
+    with StandInAPI({'stationdata': faulty(payload, 503)}) as api:
+        m = client(api, hooks=[broken], scheduler=RequestScheduler(backoff=0.01))
+        assert len(m.stationdata(STATION_ID='330001', return_dataframe=True)) == 8
+    messages = [record.getMessage() for record in caplog.records if record.name == 'AWNPy']
+    assert any('request_seconds' in message for message in messages)
+    assert any('retries' in message for message in messages)
+
+
+# Basic Function Tests
+def teststationdata():
+    payload = make_stationdata(['330092'], datetime.datetime(2020, 5, 1), 8)
+    with StandInAPI({'stationdata': payload}) as api:
+        df = client(api).stationdata(STATION_ID='330092', START=datetime.datetime(2020, 5, 1),
+                                     END=datetime.datetime(2020, 5, 1, 2), return_dataframe=True)
+        assert len(df) == 8
+        assert df.index.is_monotonic_increasing
+
+
+def teststationlocator():
+    with StandInAPI({'stationlocator': make_stationlocator(3)}) as api:
+        stations = client(api).stationlocator(LATITUDE='46.0', LONGITUDE='-120.0', QTY='3')
+        assert len(stations) == 3
+
+
+def stationdata_by_id(params):
+    if params['STATION_ID'] == '999':
+        return {'status': 0}
+    return make_stationdata([params['STATION_ID']], datetime.datetime(2020, 5, 1), 4)
+
+
+def teststationdatamany():
+    with StandInAPI({'stationdata': stationdata_by_id}) as api:
+        data = client(api).stationdata_many(['330001', '330002', '330003'], START=datetime.datetime(2020, 5, 1),
+                                            END=datetime.datetime(2020, 5, 1, 1), max_workers=3)
+        assert sorted(data) == [330001, 330002, 330003]
+        assert all(len(df) == 4 for df in data.values())
+        assert len(api.requests) == 3
+
+
+def teststationdatamanypartialfailure():
+    with StandInAPI({'stationdata': stationdata_by_id}) as api:
+        m = client(api)
+        try:
+            m.stationdata_many(['330001', '999'])
+        except AWNPyBatchError as e:
+            assert list(e.results) == [330001]
+            assert list(e.errors) == ['999']
+        else:
+            raise AssertionError('AWNPyBatchError not raised')
+        assert list(m.stationdata_many(['330001', '999'], raise_on_error=False)) == [330001]
+
+
+def teststationdatastream():
+    payload = make_stationdata(['330001', '330002', '330003'], datetime.datetime(2020, 5, 1), 50)
+    with StandInAPI({'stationdata': payload}) as api:
+        m = client(api)
+        expected = m.stationdata(return_dataframe=True)
+        streamed = list(m.stationdata_stream(batch_size=7))
+        assert [station_id for station_id, _ in streamed] == [330001, 330002, 330003]
+        for station_id, df in streamed:
+            assert df.equals(expected[station_id])
+        assert api.connections == 1
+
+    with StandInAPI({'stationdata': {'status': 0}}) as api:
+        try:
+            list(client(api).stationdata_stream())
+        except AWNPyError:
+            pass
+        else:
+            raise AssertionError('AWNPyError not raised')
+
+
+def teststationdatacompact():
+    import numpy as np
+    payload = make_stationdata(['330001', '330002'], datetime.datetime(2020, 5, 1), 400)
+    payload['message'][0]['DATA'][3]['AT_F'] = 'NA'
+    with StandInAPI({'stationdata': payload}) as api:
+        m = client(api)
+        expected = m.stationdata(return_dataframe=True)
+        raw = m.stationdata()
+        compact = m.stationdata(return_compact=True)
+        assert sorted(compact) == [330001, 330002]
+        for station_id, sc in compact.items():
+            assert sc.station_id == station_id
+            assert len(sc) == len(expected[station_id])
+            assert sc.to_dataframe().equals(expected[station_id])
+            assert np.shares_memory(sc['AT_F'], sc.values)
+            assert sc['TIMESTAMP_PST'][0] == np.datetime64('2020-05-01T00:00:00')
+        sc = compact[330001]
+        assert np.isnan(sc['AT_F'][3]) and 'AT_F' in sc and 'NOPE' not in sc
+        assert sc.record(0)['RH_PCNT'] == float(raw['message'][0]['DATA'][0]['RH_PCNT'])
+        assert sc.station['STATION_NAME'] == 'Station 0'
+        records = raw['message'][0]['DATA']
+        dict_bytes = sum(sys.getsizeof(r) + sum(sys.getsizeof(v) for v in r.values()) for r in records)
+        assert sc.nbytes * 10 < dict_bytes
+
+
+def stationdata_range(params):
+    daily = params.get('BASIS') == 'DAILY'
+    fmt = '%Y-%m-%d' if daily else '%Y-%m-%d %H:%M:%S'
+    start = datetime.datetime.strptime(params['START'], fmt)
+    end = datetime.datetime.strptime(params['END'], fmt)
+    step = datetime.timedelta(days=1) if daily else datetime.timedelta(minutes=15)
+    periods = int((end - start) // step) + 1
+    station_ids = params.get('STATION_ID', '330001,330002').split(',')
+    return make_stationdata(station_ids, start, periods, daily)
+
+
+# DataFrame Conversion Tests
+def testdatadicttodataframe():
+    from standin import make_records
+    m = AWN(username='user', password='pass', float_dtype='float32')
+    records = make_records(datetime.datetime(2020, 5, 1), 6)
+    records[2]['AT_F'] = 'NA'
+    records[4]['RH_PCNT'] = None
+    df = m._data_dict_to_dataframe(list(reversed(records)), 'PST')
+    assert df.index.name == 'TIMESTAMP_PST'
+    assert df.index.is_monotonic_increasing
+    assert df.index[0] == datetime.datetime(2020, 5, 1)
+    assert str(df['AT_F'].dtype) == 'float32'
+    assert df['AT_F'].isna().sum() == 1 and df['RH_PCNT'].isna().sum() == 1
+    assert df['WD_DEGREE'].iloc[0] == float(records[0]['WD_DEGREE'])
+
+    daily = m._data_dict_to_dataframe(make_records(datetime.datetime(2020, 5, 1), 3, daily=True), 'PST')
+    assert daily.index.name == 'JULDATE_PST'
+    assert str(daily['AT_F'].dtype) == 'float32'
+    assert m._data_dict_to_dataframe([], 'PST').empty
+
+
+def testprocessconversion(monkeypatch):
+    import os
+    import threading
+    import AWNPy
+    payload = make_stationdata(['330001', '330002', '330003'], datetime.datetime(2020, 5, 1), 300)
+    payload['message'][0]['DATA'][5]['AT_F'] = 'NA'
+    del payload['message'][1]['DATA'][7]['RH_PCNT']
+    payload['message'][2]['DATA'].reverse()
+    expected = AWN(username='user', password='pass')._station_dataframes(payload['message'], 'UTC')
+
+    forked = []
+    convert = AWNPy._convert_in_processes
+    monkeypatch.setattr(AWNPy, '_convert_in_processes', lambda *args: forked.append(1) or convert(*args))
+    monkeypatch.setattr(os, 'cpu_count', lambda: 4)
+    m = AWN(username='user', password='pass', processes=2, process_min_rows=1)
+    converted = m._station_dataframes(payload['message'], 'UTC')
+    assert forked == [1]
+    assert list(converted) == list(expected)
+    for station_id, df in expected.items():
+        assert converted[station_id].equals(df)
+
+    # never forked from a thread other than the main one
+    results = []
+    thread = threading.Thread(target=lambda: results.append(m._station_dataframes(payload['message'], 'UTC')))
+    thread.start()
+    thread.join()
+    assert forked == [1] and all(results[0][key].equals(df) for key, df in expected.items())
+
+    # nor with a single CPU
+    monkeypatch.setattr(os, 'cpu_count', lambda: 1)
+    m._station_dataframes(payload['message'], 'UTC')
+    assert forked == [1]
+
+
+# Aggregation Tests
+def testaggregatestationdata():
+    import numpy as np
+    payload = make_stationdata(['330001', '330002'], datetime.datetime(2020, 5, 1), 400)
+    with StandInAPI({'stationdata': payload}) as api:
+        m = client(api)
+        frames = m.stationdata(return_dataframe=True)
+        compact = m.stationdata(return_compact=True)
+    frames[330002] = frames[330002].iloc[list(range(20)) + list(range(60, 400))]
+    frames[330002].iloc[3, 0] = np.nan
+    hourly = aggregate_stationdata(frames, 'h')
+    for station_id, df in frames.items():
+        resampled = df.resample('h')
+        assert hourly[station_id].index.equals(resampled.mean().index)
+        assert np.allclose(hourly[station_id]['AT_F'], resampled['AT_F'].mean(), equal_nan=True)
+        assert np.allclose(hourly[station_id]['P_INCHES'], resampled['P_INCHES'].sum(min_count=1), equal_nan=True)
+        assert np.allclose(hourly[station_id]['WS_MAX_MPH'], resampled['WS_MAX_MPH'].max(), equal_nan=True)
+    assert hourly[330002]['AT_F'].isna().sum() == 10
+    assert aggregate_stationdata(compact[330001], 'h').equals(hourly[330001])
+
+    index = frames[330001].index[:4]
+    df = frames[330001].iloc[:4].assign(WD_DEGREE=[350., 10., 20., 340.], LW_UNITIY=[0.1, 0.4, 0.9, np.nan])
+    hour = aggregate_stationdata(df, 'h', variables=['WD_DEGREE', 'LW_UNITIY'])
+    direction = hour['WD_DEGREE'].iloc[0]
+    assert min(direction, 360. - direction) < 1e-9
+    assert hour['LW_UNITIY'].iloc[0] == 0.5
+    assert list(hour.index) == [index[0]]
+    try:
+        aggregate_stationdata(df, 'MS')
+    except ValueError:
+        pass
+    else:
+        raise AssertionError('ValueError not raised')
+
+
+def testgrowingdegreedays():
+    import pandas as pd
+    index = pd.date_range('2020-05-01', periods=3 * 96, freq='15min', name='TIMESTAMP_PST')
+    temperatures = [40., 60.] * 48 + [60., 95.] * 48 + [30., 45.] * 48
+    gdd = growing_degree_days({1: pd.DataFrame({'AT_F': temperatures}, index=index)})[1]
+    assert list(gdd.columns) == ['MIN', 'MAX', 'GDD', 'GDD_CUMULATIVE']
+    assert list(gdd['GDD']) == [5., 23., 0.]
+    assert list(gdd['GDD_CUMULATIVE']) == [5., 28., 28.]
+
+
+# Latest Observation Tests
+def testlatestobservations():
+    import time
+    payload = make_stationdata(['330001', '330002', '330003'], datetime.datetime(2020, 5, 1), 8)
+    del payload['message'][2]['DATA'][-3:]
+    with StandInAPI({'stationdata': payload}) as api:
+        latest = LatestObservations(client(api), station_ids=['330001', '330003'])
+        assert latest.refresh() == 2
+        assert sorted(latest.snapshot()) == [330001, 330003] and '330002' not in latest
+        observation = latest.get('330001')
+        assert observation.time == datetime.datetime(2020, 5, 1, 1, 45)
+        assert observation['AT_F'] == float(payload['message'][0]['DATA'][-1]['AT_F'])
+        assert latest[330003].time == datetime.datetime(2020, 5, 1, 1)
+        assert observation.stale and latest.behind
+        assert latest.get(330002) is None
+
+        # reads don't reach the API; refreshes follow the interval
+        latest = LatestObservations(client(api), interval=datetime.timedelta(seconds=0.1),
+                                    delay=datetime.timedelta(0), retry_interval=datetime.timedelta(hours=1),
+                                    stale_after=datetime.timedelta(days=365 * 100))
+        before = len(api.requests)
+        with latest:
+            assert len(latest) == 3
+            deadline = time.time() + 0.5
+            reads = 0
+            while time.time() < deadline:
+                reads += latest[330002]['RH_PCNT'] > 0
+        assert reads > 1000
+        assert 3 <= len(api.requests) - before <= 8
+        assert not latest[330002].stale and latest.last_error is None
+
+    try:
+        LatestObservations(AsyncAWN(username='user', password='pass'))
+    except AWNPyError:
+        pass
+    else:
+        raise AssertionError('AWNPyError not raised')
+
+
+def testtimezones():
+    import pandas as pd
+    from standin import make_records
+    m = AWN(username='user', password='pass')
+    # the API's fixed UTC-8 times run straight through both of 2020's daylight saving changes
+    records = make_records(datetime.datetime(2020, 3, 8, 0), 16) + make_records(datetime.datetime(2020, 11, 1, 0), 16)
+    utc = m._data_dict_to_dataframe(records, 'UTC').index
+    pdt = m._data_dict_to_dataframe(records, 'PDT').index
+    assert utc[0] == pd.Timestamp('2020-03-08 08:00', tz='UTC')
+    assert (pdt == utc).all() and pdt.is_unique and pdt.is_monotonic_increasing
+    assert pdt[12] == pd.Timestamp('2020-03-08 04:00', tz='America/Los_Angeles')
+    assert str(pdt[-1].tz) == 'America/Los_Angeles' and pdt[-1].utcoffset() == datetime.timedelta(hours=-8)
+    assert pdt[16].utcoffset() == datetime.timedelta(hours=-7) and pdt[20].utcoffset() == datetime.timedelta(hours=-8)
+    denver = m._data_dict_to_dataframe(records, 'America/Denver').index
+    assert (denver == utc).all()
+    # a cached conversion is reused, but every frame gets its own index
+    again = m._data_dict_to_dataframe(records, 'PDT')
+    assert again.index.equals(pdt) and again.index is not pdt
+    frames = m._station_dataframes([{'STATION_ID': '330001', 'DATA': records},
+                                    {'STATION_ID': '330002', 'DATA': records}], 'PDT')
+    frames[330001].index.name = 'renamed'
+    assert frames[330002].index.name == 'TIMESTAMP_PST'
+    assert m._data_dict_to_dataframe(records, 'PDT').index.name == 'TIMESTAMP_PST'
+    try:
+        m._data_dict_to_dataframe(records, 'Nowhere/Land')
+    except ValueError:
+        pass
+    else:
+        raise AssertionError('ValueError not raised')
+
+
+# Date Window Tests
+def testchunkedstationdata():
+    start, end = datetime.datetime(2020, 1, 1), datetime.datetime(2020, 3, 1)
+    with StandInAPI({'stationdata': stationdata_range}) as api:
+        m = client(api)
+        df = m.stationdata(STATION_ID='330092', START=start, END=end, return_dataframe=True)
+        assert len(api.requests) == 2
+        assert len(df) == (end - start) // datetime.timedelta(minutes=15) + 1
+        assert df.index.is_monotonic_increasing and df.index.is_unique
+
+        raw = m.stationdata(STATION_ID='330092', START=start, END=end)
+        times = [record['TIMESTAMP_PST'] for record in raw['message'][0]['DATA']]
+        assert times == sorted(set(times))
+        assert len(times) == len(df)
+
+
+def testchunkeddaily():
+    with StandInAPI({'stationdata': stationdata_range}) as api:
+        m = client(api, daily_chunk_window=datetime.timedelta(days=365))
+        data = m.stationdata(BASIS='DAILY', START=datetime.datetime(2015, 1, 1), END=datetime.datetime(2019, 12, 31),
+                             return_dataframe=True)
+        assert len(api.requests) == 5
+        assert sorted(data) == [330001, 330002]
+        assert all(len(df) == 1826 for df in data.values())
+
+
+def testiterstationdata():
+    import pandas as pd
+    start, end = datetime.datetime(2020, 1, 1), datetime.datetime(2020, 1, 3)
+    with StandInAPI({'stationdata': stationdata_range}) as api:
+        m = client(api, chunk_window=datetime.timedelta(days=1))
+        chunks = list(m.iter_stationdata(['330001', '330002'], START=start, END=end))
+        assert len(api.requests) == 4
+        assert [(station_id, window[0].day) for station_id, window, _ in chunks] == [
+            (330001, 1), (330001, 2), (330002, 1), (330002, 2)]
+        expected = m.stationdata_many(['330001', '330002'], START=start, END=end)
+        for station_id in expected:
+            joined = pd.concat([df for chunk_id, _, df in chunks if chunk_id == station_id])
+            assert joined.index.equals(expected[station_id].index)
+            assert list(joined.columns) == list(expected[station_id].columns)
+
+
+# Sync Tests
+def teststationsync(tmp_path):
+    start = datetime.datetime(2020, 5, 1)
+    with StandInAPI({'stationdata': stationdata_range}) as api:
+        m = client(api)
+        sync = StationSync(m, PickleFrameStore(str(tmp_path)), WatermarkStore(str(tmp_path / 'marks.json')),
+                           initial_start=start)
+        assert sync.sync(['330001', '330002'], END=start + datetime.timedelta(hours=2)) == {'330001': 9, '330002': 9}
+        assert sync.sync(['330001', '330002'], END=start + datetime.timedelta(hours=3)) == {'330001': 4, '330002': 4}
+        assert api.requests[-1][1]['START'] == '2020-05-01 02:00:00'
+        assert sync.sync(['330001'], END=start + datetime.timedelta(hours=3)) == {'330001': 0}
+
+        # a new instance picks up from the saved watermarks
+        sync = StationSync(m, PickleFrameStore(str(tmp_path)), WatermarkStore(str(tmp_path / 'marks.json')))
+        assert sync.sync(['330001'], END=start + datetime.timedelta(hours=4)) == {'330001': 4}
+        df = sync.store.read('330001', '15MIN')
+        assert len(df) == 17 and df.index.is_unique and df.index.is_monotonic_increasing
+
+
+# Archive Tests
+def teststationarchive(tmp_path):
+    import pytest
+    pytest.importorskip('pyarrow')
+    start, end = datetime.datetime(2020, 1, 20), datetime.datetime(2020, 2, 10)
+    with StandInAPI({'stationdata': stationdata_range}) as api:
+        archive = StationArchive(str(tmp_path), awn=client(api))
+        df = archive.stationdata('330001', start, end)
+        assert len(df) == (end - start) // datetime.timedelta(minutes=15) + 1
+        assert sorted(p.name for p in (tmp_path / '15MIN' / '330001' / '2020').iterdir()) == ['01.parquet',
+                                                                                            '02.parquet']
+        num_requests = len(api.requests)
+
+        # covered ranges are read from disk, with only the requested columns
+        inner = archive.stationdata('330001', datetime.datetime(2020, 2, 1), end, columns=['AT_F'])
+        assert list(inner.columns) == ['AT_F'] and inner.index[0] == datetime.datetime(2020, 2, 1)
+        assert len(api.requests) == num_requests
+
+        # only the missing range is fetched
+        archive.stationdata('330001', start, datetime.datetime(2020, 2, 20))
+        assert len(api.requests) == num_requests + 1
+        assert api.requests[-1][1]['START'] == '2020-02-10 00:00:00'
+        assert StationArchive(str(tmp_path)).coverage('330001') == [(start, datetime.datetime(2020, 2, 20))]
+
+
+def testexportarray(tmp_path):
+    import os
+    import numpy as np
+    start, end = datetime.datetime(2020, 5, 1), datetime.datetime(2020, 5, 2)
+    with StandInAPI({'metadata': make_metadata(3), 'stationdata': stationdata_range}) as api:
+        m = client(api)
+        m.export_array(str(tmp_path), start, end, variables=['AT_F', 'NOT_A_SENSOR'])
+        array, coords = load_station_array(str(tmp_path))
+        assert isinstance(array, np.memmap)
+        assert array.shape == (3, 97, 2) and array.dtype == np.float32
+        assert coords['station_ids'] == ['330000', '330001', '330002']
+        assert coords['latitude'][1] == 46.02 and coords['times'][-1] == end
+        expected = m.stationdata(STATION_ID='330001', START=start, END=end, return_dataframe=True)
+        assert np.array_equal(array[1, :, 0], expected['AT_F'].to_numpy(dtype='float32'))
+        assert np.isnan(array[:, :, 1]).all()
+
+        # an export that fails part way leaves no temporary array behind
+        iter_stationdata = m.iter_stationdata
+
+        def failing(*args, **kwargs):
+            for item in iter_stationdata(*args, **kwargs):
+                yield item
+                raise AWNPyError('lost connection')
+
+        m.iter_stationdata = failing
+        try:
+            m.export_array(str(tmp_path / 'failed'), start, end)
+        except AWNPyError:
+            pass
+        else:
+            raise AssertionError('AWNPyError not raised')
+        assert os.listdir(str(tmp_path / 'failed')) == []
+
+
+# Cache Tests
+def testdiskcache(tmp_path):
+    with StandInAPI({'metadata': make_metadata(3), 'stationdata': stationdata_range}) as api:
+        m = client(api, cache=DiskCache(str(tmp_path)))
+        assert m.metadata() == m.metadata()
+        old = dict(STATION_ID='330092', START=datetime.datetime(2019, 1, 1), END=datetime.datetime(2019, 1, 2))
+        m.stationdata(**dict(old))
+        assert len(api.requests) == 2
+
+        # a new client and cache on the same directory still hits
+        m = client(api, cache=DiskCache(str(tmp_path)))
+        m.metadata()
+        assert len(m.stationdata(**dict(old))['message'][0]['DATA']) == 97
+        assert len(api.requests) == 2
+
+        # the password is not part of the key
+        m.password = 'other'
+        m.metadata()
+        assert len(api.requests) == 2
+
+        m = client(api, cache=DiskCache(str(tmp_path / 'uncached')), cache_ttl={'metadata': 0})
+        m.metadata()
+        m.metadata()
+        assert len(api.requests) == 4
+
+
+def testdiskcacheexpiry(tmp_path):
+    cache = DiskCache(str(tmp_path), max_bytes=250)
+    cache.set('a', b'x' * 100)
+    cache.set('b', b'x' * 100, ttl=-1)
+    assert cache.get('a') == b'x' * 100
+    assert cache.get('b') is None
+    cache.set('c', b'x' * 100)
+    cache.set('d', b'x' * 100)
+    assert cache.get('d') == b'x' * 100
+    assert sum(cache.get(key) is not None for key in 'acd') == 2
+
+
+def testcachettl():
+    m = AWN(username='user', password='pass')
+    old = m._cache_ttl('stationdata', {'END': datetime.datetime(2019, 1, 1)})
+    recent = m._cache_ttl('stationdata', {'END': datetime.datetime.now()})
+    assert old is None
+    assert recent == 900
+    assert m._cache_ttl('metadata', {}) == 86400
+
+
+# StationRegistry Tests
+def teststationregistry():
+    with StandInAPI({'metadata': make_metadata(12), 'stationdata': stationdata_range}) as api:
+        m = client(api)
+        assert len(m.stations) == 12
+        assert m.stations[330003]['STATION_NAME'] == 'Station 3'
+        assert m.stations.get('1') is None
+        assert m.stations.station_id('Station 4') == '330004'
+        assert m.stations.station_id('Old Station 5') == '330005'
+        assert [s['STATION_ID'] for s in m.stations.filter(COUNTY='King', TIER=3)] == ['330002', '330005', '330008',
+                                                                                      '330011']
+        assert len(m.stations.filter(ACTIVE_STATION='N')) == 1
+        assert len(m.stations.filter(COUNTY=['King', 'Yakima'], LW_UNITIY='Y')) == 4
+
+        for name in ['Station 1', 'Station 2']:
+            m.stationdata(STATION_NAME=name, START=datetime.datetime(2020, 5, 1), END=datetime.datetime(2020, 5, 2))
+        assert [request[0] for request in api.requests] == ['metadata', 'stationdata', 'stationdata']
+        assert api.requests[-1][1]['STATION_ID'] == '330002'
+
+        try:
+            m.stations.station_id('Nowhere')
+        except ValueError:
+            pass
+        else:
+            raise AssertionError('ValueError not raised')
+
+
+def testresolvestationnames():
+    metadata = make_metadata(12)
+    metadata['message'][3]['STATION_NAME'] = 'Prosser N.E.'
+    with StandInAPI({'metadata': metadata}) as api:
+        m = client(api)
+        names = ['Station 4', 'old station 5', 'prosser ne', 'Statoin 7', 'Station 4', 'Nowhere Near']
+        matches = m.stations.resolve(names * 200)
+        assert len(api.requests) == 1
+        assert len(matches) == 1200
+        assert [match.station_id for match in matches[:6]] == ['330004', '330005', '330003', '330007', '330004', None]
+        assert matches[1].matched == 'Old Station 5' and matches[1].score == 1.
+        assert matches[2].matched == 'Prosser N.E.'
+        assert 0.75 <= matches[3].score < 1. and matches[3].matched == 'Station 7'
+        assert matches[5].matched is None and matches[5].score < 0.75
+        assert m.stations.resolve(['Statoin 7'], cutoff=0.99)[0].station_id is None
+
+
+# StationLocator Tests
+def haversine_miles(lat1, lon1, lat2, lon2):
+    import math
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * 3958.8 * math.asin(math.sqrt(a))
+
+
+def testofflinestationlocator():
+    metadata = make_metadata(20)
+    with StandInAPI({'metadata': metadata}) as api:
+        m = client(api)
+        stations = m.stationlocator(LATITUDE='46.1', LONGITUDE='-120.2', QTY='3', offline=True)
+        active = [s for s in metadata['message'] if s['ACTIVE_STATION'] == 'Y']
+        expected = sorted(active, key=lambda s: haversine_miles(46.1, -120.2, float(s['LATITUDE_DEGREE']),
+                                                                float(s['LONGITUDE_DEGREE'])))
+        assert [s['STATION_ID'] for s in stations] == [s['STATION_ID'] for s in expected[:3]]
+        assert abs(stations[0]['DISTANCE'] - haversine_miles(46.1, -120.2, float(expected[0]['LATITUDE_DEGREE']),
+                                                             float(expected[0]['LONGITUDE_DEGREE']))) < 1e-6
+
+        within = m.stationlocator(LATITUDE='46.1', LONGITUDE='-120.2', MAX_MILES='5', offline=True)
+        assert within and all(s['DISTANCE'] <= 5 for s in within)
+
+        ids, distances = m.stationlocator_many([46.1, 46.3, 46.0], [-120.2, -120.4, -120.0], QTY=2)
+        assert ids.shape == (3, 2)
+        assert ids[0, 0] == stations[0]['STATION_ID']
+        assert (distances[:, 0] <= distances[:, 1]).all()
+        assert len(api.requests) == 1
+
+
+# AsyncAWN Tests
+def testasync():
+    async def run(url):
+        async with AsyncAWN(username='user', password='pass', max_concurrency=4) as m:
+            m.base_url = url
+            metadata = await m.metadata()
+            locator = await m.stationlocator(LATITUDE='46.0', LONGITUDE='-120.0')
+            data = await m.stationdata_many(['330%03d' % i for i in range(20)])
+            return metadata, locator, data
+
+    handlers = {'metadata': make_metadata(3), 'stationlocator': make_stationlocator(2),
+                'stationdata': stationdata_by_id}
+    with StandInAPI(handlers) as api:
+        metadata, locator, data = asyncio.run(run(api.url))
+        assert len(metadata) == 3
+        assert len(locator) == 2
+        assert len(data) == 20
+        assert api.connections <= 4
+
+
+def testasynccache(tmp_path):
+    import os
+    import threading
+
+    class RecordingCache(DiskCache):
+        threads = []
+
+        def get(self, key):
+            self.threads.append(threading.current_thread())
+            return DiskCache.get(self, key)
+
+        def set(self, key, value, ttl=None):
+            self.threads.append(threading.current_thread())
+            DiskCache.set(self, key, value, ttl)
+
+    async def run(url):
+        async with AsyncAWN(username='user', password='pass', cache=RecordingCache(str(tmp_path))) as m:
+            m.base_url = url
+            return [await m.metadata(), await m.metadata()]
+
+    with StandInAPI({'metadata': make_metadata(3)}) as api:
+        first, second = asyncio.run(run(api.url))
+        assert first == second and len(api.requests) == 1
+    # the cache's file reads and writes happen off the event loop's thread
+    assert len(RecordingCache.threads) == 3 and threading.main_thread() not in RecordingCache.threads
+    assert [name for name in os.listdir(str(tmp_path)) if not name.endswith('.cache')] == []
+
+
+def testasyncstations():
+    import warnings
+
+    async def run(api):
+        async with AsyncAWN(username='user', password='pass') as m:
+            m.base_url = api.url
+            try:
+                len(m.stations)
+            except AWNPyError as e:
+                assert 'refresh_stations' in str(e)
+            else:
+                raise AssertionError('AWNPyError not raised')
+            try:
+                m.locator
+            except AWNPyError:
+                pass
+            else:
+                raise AssertionError('AWNPyError not raised')
+            station_ids, _ = await m.stationlocator_many([46.0], [-120.0])
+            assert station_ids[0, 0] == '330000'
+            await m.refresh_stations()
+            return len(m.stations), m.stations.filter(COUNTY='King')[0]['STATION_ID']
+
+    with StandInAPI({'metadata': make_metadata(6)}) as api:
+        with warnings.catch_warnings():
+            warnings.simplefilter('error', RuntimeWarning)
+            assert asyncio.run(run(api)) == (6, '330002')
+
+
+def testasyncunsupported(tmp_path):
+    m = AsyncAWN(username='user', password='pass')
+    for call in [lambda: m.iter_stationdata(), lambda: m.export_array(str(tmp_path), datetime.datetime(2020, 5, 1),
+                                                                      datetime.datetime(2020, 5, 2))]:
+        try:
+            call()
+        except AWNPyError:
+            pass
+        else:
+            raise AssertionError('AWNPyError not raised')
+
+
+def testasyncerror():
+    async def run(url):
+        m = AsyncAWN(username='user', password='pass')
+        m.base_url = url
+        try:
+            await m.stationdata(STATION_ID='999')
+        finally:
+            await m.close()
+
+    with StandInAPI({'stationdata': stationdata_by_id}) as api:
+        try:
+            asyncio.run(run(api.url))
+        except AWNPyError:
+            pass
+        else:
+            raise AssertionError('AWNPyError not raised')